@@ -0,0 +1,253 @@
+"""Нагрузочный прогон всего диалога: N пользователей одновременно от /start до публикации.
+
+Бот работает в режиме вебхука против подмен Telegram Bot API, OpenAI и API платформ.
+Печатает пропускную способность, p50/p95/p99 по шагам диалога и пиковую память;
+с --output сохраняет результат в JSON, с --baseline сравнивает с прошлым прогоном.
+
+Запуск: python -m benchmarks.bench_load --users 100 --text-latency 1.5 --error-rate 0.05 \
+            --output load.json --baseline load_prev.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import Dict, List
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+
+import telegram_smm_bot as bot  # noqa: E402
+from benchmarks.fake_openai import FakeAsyncOpenAI  # noqa: E402
+from benchmarks.fake_platforms import FakePlatforms  # noqa: E402
+from benchmarks.fake_telegram import FakeTelegramAPI, UpdateSender, callback_update, message_update  # noqa: E402
+from smm_jobs import BackgroundJobQueue  # noqa: E402
+from smm_limits import AdmissionController  # noqa: E402
+from smm_metrics import MetricsRegistry  # noqa: E402
+from smm_publish import InstagramAdapter, Publisher, TelegramChannelAdapter, TikTokAdapter, VKAdapter  # noqa: E402
+from smm_server import serve_webhook  # noqa: E402
+from smm_transport import TransportConfig  # noqa: E402
+
+# Подменный Bot API на aiohttp понимает только HTTP/1.1
+TELEGRAM_TRANSPORT = TransportConfig(max_connections=256, http2=False)
+
+# Шаги диалога: (название, вид апдейта, данные, фрагмент ответа бота, по которому шаг считается выполненным)
+FLOW = [
+    ("start", "message", "/start", "Привет"),
+    ("choose_niche", "callback", "create_post", "Выберите тематику"),
+    ("niche_selected", "callback", "niche_auto", "Введите тему"),
+    ("generate", "message", "BMW X5 2025 для пользователя {user}", "ПРЕВЬЮ ПОСТА"),
+    ("publish", "callback", "approve", "ОПУБЛИКОВАН"),
+]
+
+CHANNEL_ID = "@bench_channel"
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def run_user(api: FakeTelegramAPI, sender: UpdateSender, user_id: int, latencies: Dict[str, List[float]],
+                   failures: Dict[str, int], timeout: float) -> bool:
+    for step, kind, payload, expected in FLOW:
+        after = len(api.sent_texts[user_id])
+        if kind == "message":
+            update = message_update(sender.next_id(), user_id, payload.format(user=user_id))
+        else:
+            update = callback_update(sender.next_id(), user_id, payload)
+
+        started = time.perf_counter()
+        await sender.send(update)
+        try:
+            await api.wait_for_text(user_id, expected, after=after, timeout=timeout)
+        except asyncio.TimeoutError:
+            failures[step] += 1
+            return False
+        latencies[step].append(time.perf_counter() - started)
+    return True
+
+
+async def run(args) -> Dict:
+    # Подмены внешних сервисов
+    bot.client = FakeAsyncOpenAI(
+        text_latency=args.text_latency,
+        image_latency=args.image_latency,
+        sigma=args.sigma,
+        error_rate=args.error_rate,
+        error_kinds=args.error_kinds,
+        seed=args.seed
+    )
+    telegram_api = FakeTelegramAPI(latency=args.telegram_latency)
+    base_url = await telegram_api.start()
+    platforms = FakePlatforms(latency=args.platform_latency, seed=args.seed)
+    platforms_url = await platforms.start()
+
+    # Бот настраивается так же, как в main(), но без файлов на диске
+    smm_bot = bot.smm_bot
+    smm_bot.metrics = MetricsRegistry()
+    smm_bot.jobs = BackgroundJobQueue(workers=args.job_workers, poll_interval=0.2)
+    smm_bot.images = None  # картинки подмены не скачиваются, в превью остаётся ссылка
+    smm_bot.text_limiter = AdmissionController("text", rpm=args.text_rpm, tpm=args.text_tpm, max_queue=args.users * 8)
+    smm_bot.image_limiter = AdmissionController("image", rpm=args.image_rpm, max_queue=args.users * 2)
+    application = bot.build_application("123456:TEST", base_url=base_url, concurrent_updates=args.concurrency,
+                                          transport=TELEGRAM_TRANSPORT)
+
+    smm_bot.publisher = Publisher(timeout=30)
+    smm_bot.publisher.add_adapter(TelegramChannelAdapter(application.bot, CHANNEL_ID))
+    smm_bot.publisher.add_adapter(VKAdapter("token", "1", smm_bot.publisher.session,
+                                            base_url=f"{platforms_url}/vk"))
+    smm_bot.publisher.add_adapter(InstagramAdapter("token", "17841", smm_bot.publisher.session,
+                                                   base_url=f"{platforms_url}/instagram"))
+    smm_bot.publisher.add_adapter(TikTokAdapter("token", smm_bot.publisher.session,
+                                                base_url=f"{platforms_url}/tiktok"))
+
+    stop_event = asyncio.Event()
+    server = asyncio.create_task(serve_webhook(
+        application, f"http://127.0.0.1:{args.port}", host="127.0.0.1", port=args.port, stop_event=stop_event
+    ))
+    while not telegram_api.calls["setWebhook"]:
+        await asyncio.sleep(0.01)
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    sender = UpdateSender(f"http://127.0.0.1:{args.port}/webhook")
+    latencies = defaultdict(list)
+    failures = defaultdict(int)
+
+    started = time.perf_counter()
+    completed = await asyncio.gather(*[
+        run_user(telegram_api, sender, 10_000 + number, latencies, failures, args.timeout)
+        for number in range(args.users)
+    ])
+    elapsed = time.perf_counter() - started
+
+    peak_traced = tracemalloc.get_traced_memory()[1] if args.tracemalloc else 0
+    tracemalloc.stop()
+
+    await sender.close()
+    stop_event.set()
+    await server
+    await platforms.stop()
+    await telegram_api.stop()
+
+    # ru_maxrss — килобайты в Linux, байты в macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    updates = sum(len(values) for values in latencies.values()) + sum(failures.values())
+    # Время самих обработчиков по данным метрик бота (без сети и очереди генерации)
+    handlers = sorted({dict(series)["handler"] for name, series in smm_bot.metrics.histograms
+                       if name == "smm_handler_seconds"})
+
+    return {
+        "users": args.users,
+        "completed": sum(completed),
+        "elapsed": elapsed,
+        "flows_per_second": sum(completed) / elapsed,
+        "updates_per_second": updates / elapsed,
+        "steps": {
+            step: {
+                "count": len(latencies[step]),
+                "failed": failures[step],
+                "p50": percentile(latencies[step], 0.50),
+                "p95": percentile(latencies[step], 0.95),
+                "p99": percentile(latencies[step], 0.99),
+            }
+            for step, *_ in FLOW
+        },
+        "handlers_p95": {
+            handler: smm_bot.metrics.merged_histogram("smm_handler_seconds", handler=handler).quantile(0.95)
+            for handler in handlers
+        },
+        "peak_traced_mb": peak_traced / 2 ** 20,
+        "max_rss_mb": max_rss / 2 ** 20,
+        "openai_calls": dict(bot.client.calls),
+        "openai_errors": dict(bot.client.errors),
+        "telegram_calls": telegram_api.total,
+        "published": dict(platforms.posts),
+    }
+
+
+def print_report(result: Dict):
+    print(f"Пользователей: {result['users']}, прошли весь диалог: {result['completed']} "
+          f"за {result['elapsed']:.1f} с")
+    print(f"Пропускная способность: {result['flows_per_second']:.2f} диалогов/с, "
+          f"{result['updates_per_second']:.1f} апдейтов/с")
+    print()
+    print(f"{'шаг':<16}{'готово':>8}{'ошибок':>8}{'p50, с':>10}{'p95, с':>10}{'p99, с':>10}")
+    for step, stats in result["steps"].items():
+        print(f"{step:<16}{stats['count']:>8}{stats['failed']:>8}"
+              f"{stats['p50']:>10.3f}{stats['p95']:>10.3f}{stats['p99']:>10.3f}")
+    print()
+    print("Обработчики бота, p95: " + ", ".join(
+        f"{handler} {seconds * 1000:.1f} мс" for handler, seconds in result["handlers_p95"].items()
+    ))
+    print(f"Пиковая память: {result['peak_traced_mb']:.1f} МБ (tracemalloc), RSS {result['max_rss_mb']:.1f} МБ")
+    print(f"OpenAI: {result['openai_calls']}, отказов: {result['openai_errors'] or 'нет'}")
+    print(f"Запросов к Bot API: {result['telegram_calls']}, опубликовано: {result['published']}")
+
+
+def compare(result: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Шаги, где p95 или пропускная способность стали хуже baseline больше чем на tolerance"""
+    regressions = []
+    if result["flows_per_second"] < baseline["flows_per_second"] * (1 - tolerance):
+        regressions.append(f"пропускная способность: {baseline['flows_per_second']:.2f} → "
+                           f"{result['flows_per_second']:.2f} диалогов/с")
+    for step, stats in result["steps"].items():
+        before = baseline["steps"].get(step)
+        if before and stats["p95"] > before["p95"] * (1 + tolerance):
+            regressions.append(f"{step}: p95 {before['p95']:.3f} → {stats['p95']:.3f} с")
+    if result["peak_traced_mb"] > baseline["peak_traced_mb"] * (1 + tolerance) > 0:
+        regressions.append(f"память: {baseline['peak_traced_mb']:.1f} → {result['peak_traced_mb']:.1f} МБ")
+    return regressions
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=64, help="одновременно обрабатываемых апдейтов")
+    parser.add_argument("--job-workers", type=int, default=8, help="воркеров фоновой генерации")
+    parser.add_argument("--text-latency", type=float, default=1.5, help="медиана ответа GPT, с")
+    parser.add_argument("--image-latency", type=float, default=4.0, help="медиана ответа DALL-E, с")
+    parser.add_argument("--sigma", type=float, default=0.5, help="разброс логнормальной задержки")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="доля отказов OpenAI")
+    parser.add_argument("--error-kinds", nargs="+", default=["timeout", "rate_limit", "server"])
+    parser.add_argument("--text-rpm", type=float, default=3500)
+    parser.add_argument("--text-tpm", type=float, default=90000)
+    parser.add_argument("--image-rpm", type=float, default=50)
+    parser.add_argument("--telegram-latency", type=float, default=0.03, help="задержка Bot API, с")
+    parser.add_argument("--platform-latency", type=float, default=0.2, help="задержка API платформ, с")
+    parser.add_argument("--timeout", type=float, default=300, help="сколько ждать ответа на шаг, с")
+    parser.add_argument("--port", type=int, default=8098)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-tracemalloc", dest="tracemalloc", action="store_false",
+                        help="не считать память через tracemalloc (он заметно замедляет прогон)")
+    parser.add_argument("--output", help="куда сохранить результат (JSON)")
+    parser.add_argument("--baseline", help="результат прошлого прогона для сравнения (JSON)")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение относительно baseline")
+    args = parser.parse_args()
+
+    result = await run(args)
+    print_report(result)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        if regressions:
+            print("\n⚠️ Ухудшение относительно baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\n✅ Без ухудшений относительно baseline")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,104 @@
+"""Сборка превью черновика и клавиатуры под ним.
+
+Меряет время превью обычного поста и поста, не влезающего в одно сообщение Telegram: прежнее
+сложение строк через += (без учёта лимита; без экранирования, как было, и с ним) против
+PreviewRenderer (одна сборка join, экранирование, разбиение на сообщения или сворачивание
+для потоковых правок), а также сборку клавиатуры заново на каждое превью против готовой разметки.
+
+Запуск: python -m benchmarks.bench_preview --iterations 20000 --long-factor 6
+"""
+import argparse
+import html
+import os
+import random
+import time
+from typing import Callable, Dict
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+
+import telegram_smm_bot as bot  # noqa: E402
+from smm_preview import TELEGRAM_MESSAGE_LIMIT, PreviewRenderer  # noqa: E402
+
+PHRASES = [
+    "Новый BMW X5 2025 — это сочетание мощности & комфорта.", "Разгон до 100 км/ч за 5,4 секунды 🚀",
+    "Панорамная крыша, подогрев всех сидений и <адаптивный> круиз-контроль.", "Запишитесь на тест-драйв уже сегодня!",
+    "✅ Полный привод xDrive", "✅ Расход от 8,5 л на 100 км", "Пишите в личные сообщения — подберём комплектацию.",
+]
+HASHTAGS = "#BMW #X5 #тестдрайв #авто #новинка"
+
+
+def legacy_preview(post_data: Dict, escape: Callable[[str], str] = str) -> str:
+    """Для сравнения: превью, собранное сложением строк (как было до PreviewRenderer)"""
+    text = "📋 <b>ПРЕВЬЮ ПОСТА</b>\n\n"
+    text += f"🎯 <b>Тема:</b> {escape(post_data['topic'])}\n"
+    text += f"📂 <b>Ниша:</b> {post_data['niche'].capitalize()}\n"
+    text += f"🖼 <b>Фото:</b> {'✅ Готово' if post_data.get('image_url') else '⏳ Генерируется...'}\n\n"
+    text += "━━━━━━━━━━━━━━━━━━━━\n\n"
+    icons = {"tiktok": "🎵", "telegram": "✈️", "instagram": "📸", "vk": "🌐"}
+    for platform, content in post_data['platforms'].items():
+        icon = icons.get(platform, "📱")
+        text += f"{icon} <b>{platform.upper()}</b>\n"
+        text += f"{escape(content['text'])}\n\n"
+    return text
+
+
+def make_post(factor: int, seed: int) -> Dict:
+    """Черновик с текстами обычной длины, умноженной на factor"""
+    rng = random.Random(seed)
+    sentences = {"tiktok": 2, "telegram": 8, "instagram": 6, "vk": 7}
+    platforms = {}
+    for platform, count in sentences.items():
+        lines = [rng.choice(PHRASES) for _ in range(count * factor)]
+        platforms[platform] = {"text": "\n".join(lines + [HASHTAGS])}
+    return {"id": "post_1", "topic": "BMW X5 2025: новая эра комфорта", "niche": "автомобили",
+            "platforms": platforms, "image_url": "https://example.com/1.png"}
+
+
+def timed(function: Callable, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - started) / iterations
+
+
+def bench_post(name: str, post_data: Dict, renderer: PreviewRenderer, iterations: int):
+    legacy = legacy_preview(post_data)
+    pages = renderer.render(post_data)
+    single = renderer.render_single(post_data)
+    print(f"{name}: прежнее превью {len(legacy)} символов"
+          f"{' — Telegram его отклонит' if len(legacy) > TELEGRAM_MESSAGE_LIMIT else ''}")
+    print(f"  сообщений: {len(pages)} (самое длинное {max(map(len, pages))}), "
+          f"свёрнутое превью {len(single)} символов")
+    timings = {
+        "сложение строк +=": timed(lambda: legacy_preview(post_data), iterations),
+        "+= с html.escape": timed(lambda: legacy_preview(post_data, html.escape), iterations),
+        "render (сообщения)": timed(lambda: renderer.render(post_data), iterations),
+        "render_single (свёрнутое)": timed(lambda: renderer.render_single(post_data), iterations),
+    }
+    for label, seconds in timings.items():
+        print(f"  {label:<28}{seconds * 1e6:>8.2f} мкс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20_000)
+    parser.add_argument("--long-factor", type=int, default=6, help="во сколько раз длиннее тексты длинного поста")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    renderer = PreviewRenderer()
+    bench_post("Обычный пост", make_post(1, args.seed), renderer, args.iterations)
+    print()
+    bench_post(f"Длинный пост (×{args.long_factor})", make_post(args.long_factor, args.seed), renderer,
+               args.iterations)
+
+    print()
+    print("Клавиатура под превью:")
+    rebuild = timed(bot.review_keyboard.__wrapped__, args.iterations)
+    cached = timed(bot.review_keyboard, args.iterations)
+    print(f"  {'сборка заново':<28}{rebuild * 1e6:>8.2f} мкс")
+    print(f"  {'готовая разметка':<28}{cached * 1e6:>8.2f} мкс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Публикация на все платформы против локальных подмен API: пропускная способность и обработка отказов.
+
+Запуск: python -m benchmarks.bench_publish --posts 500 --latency 0.2 --failure-rate 0.05
+"""
+import argparse
+import asyncio
+import time
+
+from telegram import Bot
+
+from benchmarks.fake_platforms import FakePlatforms
+from benchmarks.fake_telegram import FakeTelegramAPI
+from smm_publish import InstagramAdapter, Publisher, TelegramChannelAdapter, TikTokAdapter, VKAdapter
+
+PLATFORMS = ["tiktok", "telegram", "instagram", "vk"]
+
+
+def make_post(number: int) -> dict:
+    return {
+        "id": f"post_bench_{number}",
+        "topic": f"BMW X5 2025 #{number}",
+        "niche": "автомобили",
+        "platforms": {platform: {"text": f"Пост {number} для {platform} 🚗 #bmw"} for platform in PLATFORMS},
+        "image_url": f"https://example.com/{number}.png",
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--posts", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50, help="одновременных публикаций")
+    parser.add_argument("--latency", type=float, default=0.2, help="задержка ответа платформы, с")
+    parser.add_argument("--failure-rate", type=float, default=0.05)
+    args = parser.parse_args()
+
+    platforms = FakePlatforms(latency=args.latency, failure_rate=args.failure_rate, seed=1)
+    base_url = await platforms.start()
+    telegram_api = FakeTelegramAPI(latency=args.latency)
+    telegram_url = await telegram_api.start()
+
+    publisher = Publisher(timeout=10)
+    bot = Bot("123456:TEST", base_url=telegram_url)
+    await bot.initialize()
+    publisher.add_adapter(TelegramChannelAdapter(bot, "@bench_channel"))
+    publisher.add_adapter(VKAdapter("token", "1", publisher.session, base_url=f"{base_url}/vk"))
+    publisher.add_adapter(InstagramAdapter("token", "17841", publisher.session, base_url=f"{base_url}/instagram"))
+    publisher.add_adapter(TikTokAdapter("token", publisher.session, base_url=f"{base_url}/tiktok"))
+
+    posts = [make_post(number) for number in range(args.posts)]
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def publish(post):
+        async with semaphore:
+            return await publisher.publish(post)
+
+    started = time.perf_counter()
+    first = await asyncio.gather(*[publish(post) for post in posts])
+    elapsed = time.perf_counter() - started
+    failed = [post for post, results in zip(posts, first) if not all(r.ok for r in results.values())]
+
+    # Повтор: уже опубликованные платформы не должны публиковаться второй раз
+    started_retry = time.perf_counter()
+    retry = await asyncio.gather(*[publish(post) for post in failed])
+    retry_elapsed = time.perf_counter() - started_retry
+    still_failed = sum(1 for results in retry if not all(r.ok for r in results.values()))
+
+    total = args.posts * len(PLATFORMS)
+    print(f"Публикаций: {total} за {elapsed:.2f} с → {total / elapsed:.1f} публикаций/с")
+    print(f"Постов с ошибками: {len(failed)}, после повтора ({retry_elapsed:.2f} с): {still_failed}")
+    print(f"Создано на платформах: {dict(platforms.posts)}, telegram: {telegram_api.calls['sendPhoto']}")
+    print(f"Отказов платформ: {dict(platforms.failures)}")
+    duplicates = {p: n for p, n in platforms.posts.items() if n > args.posts}
+    print(f"Двойных публикаций: {duplicates or 'нет'}")
+
+    await publisher.close()
+    await bot.shutdown()
+    await platforms.stop()
+    await telegram_api.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
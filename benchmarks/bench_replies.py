@@ -0,0 +1,164 @@
+"""Автоответы на большом синтетическом потоке комментариев.
+
+Меряет скорость распознавания намерения (выражение-дерево против одной альтернации всех слов
+и проверки каждого слова по очереди), полный ответ по шаблону и весь путь с ответами GPT пачками
+через подмену OpenAI: сколько запросов к GPT понадобилось и за сколько пришли ответы.
+
+Запуск: python -m benchmarks.bench_replies --comments 100000 --typical 0.7 --batch-size 20
+"""
+import argparse
+import asyncio
+import os
+import random
+import re
+import time
+from collections import Counter
+from typing import List
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+
+import telegram_smm_bot as bot  # noqa: E402
+from benchmarks.fake_openai import FakeAsyncOpenAI  # noqa: E402
+from smm_replies import INTENTS, AutoReplyEngine, Comment, normalize  # noqa: E402
+
+NICHES = ["автомобили", "недвижимость"]
+
+TYPICAL = [
+    "Сколько стоит?", "А цена какая?", "Почём такая красота?", "Какой расход топлива?", "Какая мощность двигателя?",
+    "Можно записаться на тест-драйв?", "Где посмотреть вживую?", "Какая площадь квартиры?", "Есть ипотека?",
+    "Шикарно 🔥", "Мечта!", "Очень красиво 😍", "Какой этаж?", "Как связаться с дилером?", "Есть в наличии?",
+]
+OTHER = [
+    "А вы работаете в выходные?", "Был у вас в прошлом году, всё понравилось", "Почему такой цвет выбрали?",
+    "Жена против, что делать", "А доставка в другой город бывает?", "Интересно, а как зимой?", "Хм",
+    "Подписался, жду новых постов", "Кто снимал видео?", "А если сравнить с конкурентами?",
+]
+FILLER = ["", "Привет! ", "Добрый день. ", "Ребята, ", "Вопрос: "]
+
+
+def configure(engine: AutoReplyEngine):
+    """Ключевые слова и шаблоны ниш из реестра, как у бота"""
+    prompts = bot.smm_bot.prompts.current()
+    engine.configure(prompts.reply_keywords, prompts.reply_templates, prompts.version)
+
+
+def make_comments(count: int, typical: float, seed: int) -> List[Comment]:
+    rng = random.Random(seed)
+    comments = []
+    for number in range(count):
+        text = rng.choice(TYPICAL if rng.random() < typical else OTHER)
+        comments.append(Comment(str(number), rng.choice(FILLER) + text, rng.choice(NICHES), "BMW X5 2025"))
+    return comments
+
+
+class NaiveMatcher:
+    """Для сравнения: проверка каждого ключевого слова по очереди в порядке приоритета намерений"""
+
+    def __init__(self, intents):
+        self.words = sorted(intents.items(), key=lambda item: INTENTS.index(item[1]))
+
+    def match(self, text: str):
+        for word, intent in self.words:
+            if word in text:
+                return intent
+        return None
+
+
+class FlatMatcher:
+    """Для сравнения: одна альтернация всех слов без общего префиксного дерева"""
+
+    def __init__(self, intents):
+        self.intents = intents
+        self.pattern = re.compile("|".join(map(re.escape, sorted(intents, key=len, reverse=True))))
+
+    def match(self, text: str):
+        found = [self.intents[word] for word in self.pattern.findall(text)]
+        return min(found, key=INTENTS.index) if found else None
+
+
+def timed(function, items) -> float:
+    started = time.perf_counter()
+    for item in items:
+        function(item)
+    return (time.perf_counter() - started) / len(items)
+
+
+def bench_matching(engine: AutoReplyEngine, comments: List[Comment]):
+    """Время на комментарий: {способ: секунды} и распознанные намерения"""
+    matcher = engine._matchers["автомобили"]
+    texts = [normalize(comment.text) for comment in comments]
+    timings = {
+        "дерево ключевых слов": timed(matcher.match, texts),
+        "одна альтернация": timed(FlatMatcher(matcher._intents).match, texts),
+        "перебор слов по очереди": timed(NaiveMatcher(matcher._intents).match, texts),
+    }
+    matched = Counter(reply.intent if reply else None for reply in map(engine.match, comments))
+    timings["полный ответ по шаблону"] = timed(engine.match, comments)
+    return timings, matched
+
+
+async def bench_engine(args, comments: List[Comment]):
+    bot.client = FakeAsyncOpenAI(text_latency=args.text_latency, sigma=0.3, seed=args.seed)
+    engine = AutoReplyEngine(bot.smm_bot.answer_comments, batch_size=args.batch_size, max_delay=args.max_delay)
+    configure(engine)
+
+    latencies = []
+
+    async def answer(comment: Comment):
+        started = time.perf_counter()
+        reply = await engine.reply(comment)
+        latencies.append((reply.source if reply else None, time.perf_counter() - started))
+
+    started = time.perf_counter()
+    # Комментарии приходят потоком: сразу пачкой args.rate в секунду
+    tasks = []
+    for start in range(0, len(comments), args.rate):
+        tasks.extend(asyncio.create_task(answer(comment)) for comment in comments[start:start + args.rate])
+        await asyncio.sleep(1)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    await engine.close()
+    return latencies, elapsed, dict(bot.client.calls)
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--comments", type=int, default=100_000, help="комментариев для распознавания")
+    parser.add_argument("--typical", type=float, default=0.7, help="доля типовых комментариев")
+    parser.add_argument("--stream", type=int, default=2000, help="комментариев в прогоне с GPT")
+    parser.add_argument("--rate", type=int, default=500, help="комментариев в секунду в прогоне с GPT")
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--max-delay", type=float, default=2.0)
+    parser.add_argument("--text-latency", type=float, default=1.5, help="медиана ответа GPT, с")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    comments = make_comments(args.comments, args.typical, args.seed)
+    engine = AutoReplyEngine()
+    configure(engine)
+    timings, matched = bench_matching(engine, comments)
+    answered = sum(count for intent, count in matched.items() if intent)
+    print(f"Распознавание {len(comments)} комментариев (по шаблону {answered}, {answered / len(comments):.0%}):")
+    for name, seconds in timings.items():
+        print(f"  {name:<26}{seconds * 1e6:>8.2f} мкс/комментарий")
+    print("  намерения: " + ", ".join(f"{intent or 'нет'} {count}" for intent, count in matched.most_common()))
+
+    latencies, elapsed, calls = await bench_engine(args, make_comments(args.stream, args.typical, args.seed + 1))
+    template = [seconds for source, seconds in latencies if source == "template"]
+    ai = [seconds for source, seconds in latencies if source == "ai"]
+    print()
+    print(f"Поток {args.stream} комментариев ({args.rate}/с) за {elapsed:.1f} с:")
+    print(f"  по шаблону: {len(template)}, p99 {percentile(template, 0.99) * 1e6:.0f} мкс")
+    print(f"  через GPT: {len(ai)}, p50 {percentile(ai, 0.5):.2f} с, p99 {percentile(ai, 0.99):.2f} с")
+    print(f"  запросов к GPT: {calls.get('chat', 0)} вместо {len(ai)} (пачки по {args.batch_size})")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
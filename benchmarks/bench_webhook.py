@@ -0,0 +1,78 @@
+"""Пропускная способность вебхука: N пользователей одновременно проходят начало диалога.
+
+Запуск: python -m benchmarks.bench_webhook --users 200 --latency 0.05 --concurrency 1 64
+"""
+import argparse
+import asyncio
+import os
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+
+import telegram_smm_bot as bot  # noqa: E402
+from benchmarks.fake_telegram import FakeTelegramAPI, UpdateSender, callback_update, message_update  # noqa: E402
+from smm_server import serve_webhook  # noqa: E402
+from smm_transport import TransportConfig  # noqa: E402
+
+# Подменный Bot API на aiohttp понимает только HTTP/1.1
+TELEGRAM_TRANSPORT = TransportConfig(max_connections=256, http2=False)
+
+# Каждый пользователь: /start → "Создать пост" → выбор ниши
+FLOW = [("message", "/start"), ("callback", "create_post"), ("callback", "niche_auto")]
+# Запросов к Bot API на пользователя: sendMessage + 2 × (answerCallbackQuery + editMessageText)
+CALLS_PER_USER = 5
+
+
+async def run_user(sender: UpdateSender, user_id: int):
+    for kind, payload in FLOW:
+        if kind == "message":
+            await sender.send(message_update(sender.next_id(), user_id, payload))
+        else:
+            await sender.send(callback_update(sender.next_id(), user_id, payload))
+
+
+async def run(users: int, latency: float, concurrency: int, port: int) -> float:
+    api = FakeTelegramAPI(latency=latency)
+    base_url = await api.start()
+    application = bot.build_application("123456:TEST", base_url=base_url, concurrent_updates=concurrency,
+                                          transport=TELEGRAM_TRANSPORT)
+
+    stop_event = asyncio.Event()
+    server = asyncio.create_task(serve_webhook(
+        application, f"http://127.0.0.1:{port}", host="127.0.0.1", port=port, stop_event=stop_event
+    ))
+    while not api.calls["setWebhook"]:
+        await asyncio.sleep(0.01)
+    setup_calls = api.total
+
+    sender = UpdateSender(f"http://127.0.0.1:{port}/webhook")
+    started = time.perf_counter()
+    await asyncio.gather(*[run_user(sender, 10_000 + i) for i in range(users)])
+    completed = await api.wait_for_calls(setup_calls + users * CALLS_PER_USER)
+    elapsed = time.perf_counter() - started
+
+    await sender.close()
+    stop_event.set()
+    await server
+    await api.stop()
+
+    if not completed:
+        print(f"⚠️ concurrency={concurrency}: не все апдейты обработаны (порядок внутри чата нарушен?)")
+    return users * len(FLOW) / elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.05, help="задержка ответа Bot API, с")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 64])
+    parser.add_argument("--port", type=int, default=8099)
+    args = parser.parse_args()
+
+    for concurrency in args.concurrency:
+        rate = await run(args.users, args.latency, concurrency, args.port)
+        print(f"concurrency={concurrency:>4}: {rate:8.1f} апдейтов/с")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
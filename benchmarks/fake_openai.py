@@ -0,0 +1,124 @@
+"""Локальная подмена AsyncOpenAI с настраиваемыми задержками и отказами для бенчмарков"""
+import asyncio
+import itertools
+import json
+import math
+import random
+import re
+from collections import Counter
+from types import SimpleNamespace
+from typing import Dict, Optional, Sequence
+
+import httpx
+import openai
+
+FAKE_API_URL = "https://fake-openai.local/v1"
+
+# Виды отказов, которые умеет изображать подмена
+ERROR_KINDS = ("timeout", "rate_limit", "server", "bad_request")
+
+PLATFORMS = ("tiktok", "telegram", "instagram", "vk")
+
+
+class FakeAsyncOpenAI:
+    """Ведёт себя как AsyncOpenAI для chat.completions.create (в т.ч. stream) и images.generate.
+
+    Задержка ответа — логнормальная с медианой *_latency и разбросом sigma,
+    доля отказов — error_rate, вид отказа выбирается из error_kinds.
+    """
+
+    def __init__(self, text_latency: float = 1.0, image_latency: float = 3.0, sigma: float = 0.5,
+                 error_rate: float = 0.0, error_kinds: Sequence[str] = ("timeout", "rate_limit", "server"),
+                 chunk_size: int = 20, chunk_interval: float = 0.02, seed: Optional[int] = None):
+        self.text_latency = text_latency
+        self.image_latency = image_latency
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.error_kinds = tuple(error_kinds)
+        self.chunk_size = chunk_size
+        self.chunk_interval = chunk_interval
+        self.calls = Counter()  # вид запроса: количество
+        self.errors = Counter()  # вид отказа: количество
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._prefixes = set()  # начала промптов, уже попавшие в «кэш промптов»
+
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._chat_create))
+        self.images = SimpleNamespace(generate=self._images_generate)
+
+    def delay(self, median: float) -> float:
+        if median <= 0:
+            return 0.0
+        return self._random.lognormvariate(math.log(median), self.sigma)
+
+    def _maybe_fail(self, path: str):
+        if self._random.random() >= self.error_rate:
+            return
+        kind = self._random.choice(self.error_kinds)
+        self.errors[kind] += 1
+        request = httpx.Request("POST", f"{FAKE_API_URL}{path}")
+        if kind == "timeout":
+            raise openai.APITimeoutError(request=request)
+        status = {"rate_limit": 429, "server": 500, "bad_request": 400}[kind]
+        response = httpx.Response(status, request=request)
+        error = {
+            429: openai.RateLimitError, 500: openai.InternalServerError, 400: openai.BadRequestError
+        }[status]
+        raise error(f"fake {kind}", response=response, body=None)
+
+    async def _chat_create(self, model: str, messages: list, stream: bool = False, max_tokens: int = 500,
+                           response_format: Optional[Dict] = None, **kwargs):
+        self.calls["stream" if stream else "chat"] += 1
+        await asyncio.sleep(self.delay(self.text_latency))
+        self._maybe_fail("/chat/completions")
+
+        content = self.make_content(messages, response_format)
+        prompt_tokens = sum(len(message["content"]) for message in messages) // 4
+        usage = SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=len(content) // 4,
+                                prompt_tokens_details=SimpleNamespace(cached_tokens=self.cached_tokens(messages)))
+        if stream:
+            return self._stream(content, usage)
+
+        message = SimpleNamespace(role="assistant", content=content)
+        return SimpleNamespace(id=f"chatcmpl-{next(self._ids)}", model=model, usage=usage,
+                               choices=[SimpleNamespace(index=0, message=message, finish_reason="stop")])
+
+    async def _stream(self, content: str, usage):
+        for start in range(0, len(content), self.chunk_size):
+            await asyncio.sleep(self.chunk_interval)
+            delta = SimpleNamespace(content=content[start:start + self.chunk_size])
+            yield SimpleNamespace(choices=[SimpleNamespace(index=0, delta=delta)], usage=None)
+        yield SimpleNamespace(choices=[], usage=usage)
+
+    def cached_tokens(self, messages: list) -> int:
+        """Как кэш промптов OpenAI: повторное начало от 1024 токенов засчитывается блоками по 128"""
+        prefix = messages[0]["content"]
+        tokens = len(prefix) // 4
+        if tokens < 1024:
+            return 0
+        if prefix not in self._prefixes:
+            self._prefixes.add(prefix)
+            return 0
+        return tokens // 128 * 128
+
+    @staticmethod
+    def make_content(messages: list, response_format: Optional[Dict]) -> str:
+        # Тема, платформы и пожелания — в последнем сообщении (системный промпт общий для всех запросов)
+        prompt = messages[-1]["content"]
+        if (response_format or {}).get("type") == "json_object" and '"replies"' in prompt:
+            # Ответы на пачку комментариев: по одному на каждую пронумерованную строку
+            numbers = re.findall(r"^(\d+)\.", messages[-1]["content"], flags=re.MULTILINE)
+            return json.dumps({"replies": {number: "Спасибо за комментарий! 😊" for number in numbers}},
+                              ensure_ascii=False)
+        text = ("🚗 Новый пост: " + prompt[:120] + "\n\n") * 3 + "#smm #auto"
+        if (response_format or {}).get("type") != "json_object":
+            return text
+        # Пакетный запрос: ключи — платформы, перечисленные в промпте
+        platforms = [platform for platform in PLATFORMS if platform in prompt] or list(PLATFORMS)
+        return json.dumps({platform: f"{platform}: {text}" for platform in platforms}, ensure_ascii=False)
+
+    async def _images_generate(self, model: str, prompt: str, **kwargs):
+        self.calls["image"] += 1
+        await asyncio.sleep(self.delay(self.image_latency))
+        self._maybe_fail("/images/generations")
+        return SimpleNamespace(data=[SimpleNamespace(url=f"https://fake-images.local/{next(self._ids)}.png")])
@@ -0,0 +1,78 @@
+"""Локальные подмены API VK, Instagram Graph и TikTok для проверки публикации без сети"""
+import asyncio
+import itertools
+import random
+from collections import Counter
+from typing import Dict, Optional
+
+from aiohttp import web
+
+
+class FakePlatforms:
+    """HTTP-сервер с эндпоинтами, которые использует smm_publish, с задержкой и случайными отказами.
+
+    Повторный запрос с тем же Idempotency-Key получает сохранённый ответ и второй пост не создаёт.
+    """
+
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0, seed: Optional[int] = None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.posts = Counter()  # платформа: создано постов
+        self.failures = Counter()  # платформа: отказов
+        self.replays = Counter()  # платформа: повторов, отданных из кэша идемпотентности
+        self._responses: Dict[tuple, Dict] = {}
+        self._ids = itertools.count(1)
+        self._random = random.Random(seed)
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Запуск сервера; возвращает базовый адрес (платформы — /vk, /instagram, /tiktok)"""
+        app = web.Application()
+        app.router.add_post("/vk/wall.post", self.vk_wall_post)
+        app.router.add_post("/instagram/{user_id}/media", self.instagram_media)
+        app.router.add_post("/instagram/{user_id}/media_publish", self.instagram_publish)
+        app.router.add_post("/tiktok/post/publish/content/init/", self.tiktok_init)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _handle(self, request: web.Request, step: str, platform: str, creates_post: bool, make_response):
+        key = (step, request.headers.get("Idempotency-Key"))
+        if key[1] and key in self._responses:
+            self.replays[platform] += 1
+            return web.json_response(self._responses[key])
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self._random.random() < self.failure_rate:
+            self.failures[platform] += 1
+            return web.json_response({"error": "temporary failure"}, status=503)
+
+        response = make_response(next(self._ids))
+        if key[1]:
+            self._responses[key] = response
+        if creates_post:
+            self.posts[platform] += 1
+        return web.json_response(response)
+
+    async def vk_wall_post(self, request: web.Request) -> web.Response:
+        return await self._handle(request, "vk", "vk", True, lambda n: {"response": {"post_id": n}})
+
+    async def instagram_media(self, request: web.Request) -> web.Response:
+        return await self._handle(request, "ig_media", "instagram", False, lambda n: {"id": f"container_{n}"})
+
+    async def instagram_publish(self, request: web.Request) -> web.Response:
+        return await self._handle(request, "ig_publish", "instagram", True, lambda n: {"id": f"media_{n}"})
+
+    async def tiktok_init(self, request: web.Request) -> web.Response:
+        return await self._handle(
+            request, "tiktok", "tiktok", True,
+            lambda n: {"data": {"publish_id": f"publish_{n}"}, "error": {"code": "ok"}}
+        )
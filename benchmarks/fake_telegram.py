@@ -0,0 +1,213 @@
+"""Локальная подмена Telegram Bot API и генератор апдейтов для тестов и бенчмарков"""
+import asyncio
+import html
+import itertools
+import json
+import re
+import time
+from collections import Counter, defaultdict
+from typing import Dict, Optional
+
+import aiohttp
+from aiohttp import web
+
+BOT_USER = {"id": 1000, "is_bot": True, "first_name": "SMM Bot", "username": "smm_test_bot"}
+
+# Методы, которые возвращают сообщение, а не True
+MESSAGE_METHODS = {
+    "sendMessage", "editMessageText", "editMessageCaption", "editMessageReplyMarkup",
+    "sendPhoto", "sendDocument", "sendMediaGroup",
+}
+# Предел текста сообщения; Telegram считает его после разбора разметки
+MESSAGE_LIMIT = 4096
+TAG = re.compile(r"<[^>]+>")
+
+
+def visible_length(text: str, parse_mode: Optional[str]) -> int:
+    if parse_mode == "HTML":
+        return len(html.unescape(TAG.sub("", text)))
+    return len(text)
+
+
+class FakeTelegramAPI:
+    """Сервер, отвечающий на запросы бота как Telegram Bot API, с настраиваемой задержкой"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()  # метод: количество
+        self.chat_calls = defaultdict(list)  # chat_id: [метод, ...] в порядке поступления
+        self.sent_texts = defaultdict(list)  # chat_id: [текст, ...]
+        self.rejected = Counter()  # метод: отклонено слишком длинных сообщений
+        self.total = 0
+        self._changed = defaultdict(asyncio.Event)  # chat_id: новые запросы в этот чат
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Запуск сервера; возвращает base_url для Application.builder().base_url()"""
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_route("*", "/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{port}/bot"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = await self._params(request)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        self.calls[method] += 1
+        self.total += 1
+        chat_id = params.get("chat_id")
+        if chat_id:
+            # Каналы могут быть заданы именем (@channel), личные чаты — числом
+            chat_id = int(chat_id) if str(chat_id).lstrip("-").isdigit() else chat_id
+            self.chat_calls[chat_id].append(method)
+            if "text" in params:
+                self.sent_texts[chat_id].append(params["text"])
+            self._changed[chat_id].set()
+
+        if "text" in params and visible_length(params["text"], params.get("parse_mode")) > MESSAGE_LIMIT:
+            self.rejected[method] += 1
+            return web.json_response(
+                {"ok": False, "error_code": 400, "description": "Bad Request: message is too long"}, status=400
+            )
+        return web.json_response({"ok": True, "result": self.result(method, params)})
+
+    @staticmethod
+    async def _params(request: web.Request) -> Dict:
+        if request.content_type == "application/json":
+            return await request.json()
+        form = await request.post()
+        return {key: value for key, value in form.items() if isinstance(value, str)}
+
+    def result(self, method: str, params: Dict):
+        if method == "getMe":
+            return BOT_USER
+        if method == "getFile":
+            return {"file_id": params.get("file_id"), "file_unique_id": params.get("file_id"), "file_path": "file"}
+        if method not in MESSAGE_METHODS:
+            return True
+
+        message = {
+            "message_id": int(params.get("message_id") or next(self._message_ids)),
+            "date": int(time.time()),
+            "chat": self._chat(params.get("chat_id")),
+            "from": BOT_USER,
+        }
+        if "text" in params:
+            message["text"] = params["text"]
+        if method == "sendPhoto":
+            file_id = f"photo_{next(self._file_ids)}"
+            message["photo"] = [{"file_id": file_id, "file_unique_id": file_id, "width": 512, "height": 512}]
+        if method == "sendDocument":
+            file_id = f"document_{next(self._file_ids)}"
+            message["document"] = {"file_id": file_id, "file_unique_id": file_id}
+        if method == "sendMediaGroup":
+            return [message]
+        return message
+
+    @staticmethod
+    def _chat(chat_id) -> Dict:
+        if chat_id and not str(chat_id).lstrip("-").isdigit():
+            return {"id": -1001000000000, "type": "channel", "username": str(chat_id).lstrip("@")}
+        return {"id": int(chat_id or 0), "type": "private"}
+
+    async def wait_for_calls(self, total: int, timeout: float = 60) -> bool:
+        """Дождаться, пока бот сделает total запросов"""
+        deadline = time.monotonic() + timeout
+        while self.total < total:
+            if time.monotonic() > deadline:
+                return False
+            await asyncio.sleep(0.01)
+        return True
+
+
+    async def wait_for_text(self, chat_id: int, fragment: str, after: int = 0, timeout: float = 60) -> int:
+        """Дождаться текста с fragment среди отправленных в чат начиная с номера after.
+
+        Возвращает номер найденного текста; asyncio.TimeoutError, если его так и не было.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            texts = self.sent_texts[chat_id]
+            for index in range(after, len(texts)):
+                if fragment in texts[index]:
+                    return index
+            after = len(texts)
+            changed = self._changed[chat_id]
+            changed.clear()
+            await asyncio.wait_for(changed.wait(), max(0.0, deadline - time.monotonic()))
+
+
+def user_payload(user_id: int) -> Dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "language_code": "ru"}
+
+
+def message_update(update_id: int, user_id: int, text: str) -> Dict:
+    """Апдейт с текстовым сообщением (команды размечаются как bot_command)"""
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": user_payload(user_id),
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+def callback_update(update_id: int, user_id: int, data: str, message_id: int = 1) -> Dict:
+    """Апдейт с нажатием inline-кнопки"""
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": user_payload(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": BOT_USER,
+                "text": "…",
+            },
+        },
+    }
+
+
+class UpdateSender:
+    """Отправка апдейтов на вебхук бота так, как это делает Telegram"""
+
+    def __init__(self, webhook_url: str, secret_token: Optional[str] = None):
+        self.webhook_url = webhook_url
+        self.secret_token = secret_token
+        self._update_ids = itertools.count(1)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def next_id(self) -> int:
+        return next(self._update_ids)
+
+    async def send(self, update: Dict):
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        headers = {"Content-Type": "application/json"}
+        if self.secret_token:
+            headers["X-Telegram-Bot-Api-Secret-Token"] = self.secret_token
+        async with self._session.post(self.webhook_url, data=json.dumps(update), headers=headers) as response:
+            response.raise_for_status()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
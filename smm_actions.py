@@ -0,0 +1,58 @@
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Set, Tuple
+
+
+class ActionGuard:
+    """Защита от повторных нажатий кнопок.
+
+    Действие с тем же ключом не запускается, пока выполняется предыдущее, а действия,
+    завершённые с remember=True, ещё ttl секунд считаются выполненными. Ключ — кортеж,
+    первый элемент которого задаёт область (например, сообщение с кнопками): forget(область)
+    снова разрешает все выполненные в ней действия.
+    """
+
+    def __init__(self, ttl: float = 600, max_size: int = 10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._running = set()
+        self._done: "OrderedDict[Tuple, float]" = OrderedDict()  # ключ: время выполнения
+        self._scopes: Dict[Hashable, Set[Tuple]] = {}  # область: выполненные в ней ключи
+
+    def begin(self, key: Tuple) -> bool:
+        """Занять действие; False — оно уже выполняется или недавно выполнено"""
+        if key in self._running:
+            return False
+        done_at = self._done.get(key)
+        if done_at is not None:
+            if time.monotonic() - done_at < self.ttl:
+                return False
+            self._discard(key)
+        self._running.add(key)
+        return True
+
+    def end(self, key: Tuple, remember: bool = False):
+        self._running.discard(key)
+        if not remember:
+            return
+        self._done[key] = time.monotonic()
+        self._done.move_to_end(key)
+        self._scopes.setdefault(key[0], set()).add(key)
+        while len(self._done) > self.max_size:
+            self._discard(next(iter(self._done)))
+
+    def forget(self, scope: Hashable):
+        """Забыть выполненные действия области: её кнопки снова можно нажать"""
+        for key in self._scopes.pop(scope, ()):
+            del self._done[key]
+
+    def _discard(self, key: Tuple):
+        del self._done[key]
+        keys = self._scopes.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._scopes[key[0]]
+
+    def __len__(self):
+        return len(self._running) + len(self._done)
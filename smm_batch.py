@@ -0,0 +1,163 @@
+import csv
+import io
+import json
+import logging
+import os
+import sqlite3
+import time
+import zipfile
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Bot API принимает файлы до 50 МБ: архив пакета больше этого делится на части с запасом
+ARCHIVE_PART_LIMIT = 45 * 1024 * 1024
+
+# Заголовки колонок, которые пропускаются, если стоят в первой строке
+HEADER_WORDS = {"ниша", "niche", "тема", "topic"}
+
+
+class BatchError(ValueError):
+    """Файл пакета не удалось разобрать"""
+
+
+def detect_delimiter(lines: List[str]) -> Optional[str]:
+    """Разделитель колонок, который есть хотя бы в половине строк; None — в строке одна тема.
+
+    csv.Sniffer здесь ошибается: запятые часто встречаются внутри самих тем,
+    поэтому «;» и табуляция важнее запятой.
+    """
+    for delimiter in (";", "\t", ","):
+        if sum(delimiter in line for line in lines) * 2 >= len(lines):
+            return delimiter
+    return None
+
+
+def parse_batch(data: bytes, default_niche: str, niche_aliases: Dict[str, str],
+                max_rows: int = 200) -> List[Tuple[str, str]]:
+    """Строки (ниша, тема) из CSV или TXT.
+
+    В CSV — колонки «ниша, тема» (разделитель определяется сам), в TXT — по теме на строке
+    или «ниша; тема». niche_aliases — написания ниш в нижнем регистре и их названия (из реестра ниш);
+    строки без известной ниши получают default_niche.
+    """
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        text = data.decode("cp1251")
+
+    lines = [line for line in text.splitlines() if line.strip()]
+    if not lines:
+        raise BatchError("Файл пустой")
+    delimiter = detect_delimiter(lines[:50])
+
+    rows = []
+    for number, fields in enumerate(csv.reader(lines, delimiter=delimiter) if delimiter else ([line] for line in lines)):
+        fields = [field.strip() for field in fields if field.strip()]
+        if not fields:
+            continue
+        if number == 0 and fields[0].lower() in HEADER_WORDS:
+            continue
+        niche = niche_aliases.get(fields[0].lower()) if len(fields) > 1 else None
+        topic = ", ".join(fields[1:]) if niche else ", ".join(fields)
+        rows.append((niche or default_niche, topic[:300]))
+
+    if not rows:
+        raise BatchError("В файле нет тем")
+    if len(rows) > max_rows:
+        raise BatchError(f"Слишком много тем: {len(rows)}, можно не больше {max_rows}")
+    return rows
+
+
+class BatchStore:
+    """Строки пакетов и их результаты в SQLite: прерванный или частично неудачный пакет догенерируется.
+
+    Статусы строк: pending — ещё не генерировалась, done — готова, partial — часть текстов или фото
+    с ошибкой, failed — строка не сгенерировалась.
+    """
+
+    def __init__(self, db_path: str = ":memory:"):
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS batch_rows (batch_id TEXT NOT NULL, row INTEGER NOT NULL, "
+            "niche TEXT NOT NULL, topic TEXT NOT NULL, status TEXT NOT NULL, result TEXT, error TEXT, "
+            "updated_at REAL NOT NULL, PRIMARY KEY (batch_id, row))"
+        )
+        self._db.commit()
+
+    def create(self, batch_id: str, rows: List[Tuple[str, str]]):
+        now = time.time()
+        with self._db:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO batch_rows (batch_id, row, niche, topic, status, updated_at) "
+                "VALUES (?, ?, ?, ?, 'pending', ?)",
+                [(batch_id, number, niche, topic, now) for number, (niche, topic) in enumerate(rows)]
+            )
+
+    def unfinished(self, batch_id: str) -> List[Dict]:
+        """Строки, которые ещё нужно (до)генерировать, с уже полученной частью результата"""
+        return [row for row in self.rows(batch_id) if row["status"] != "done"]
+
+    def save(self, batch_id: str, row: int, status: str, result: Optional[Dict] = None,
+             error: Optional[str] = None):
+        with self._db:
+            self._db.execute(
+                "UPDATE batch_rows SET status = ?, result = COALESCE(?, result), error = ?, updated_at = ? "
+                "WHERE batch_id = ? AND row = ?",
+                (status, json.dumps(result, ensure_ascii=False) if result is not None else None, error,
+                 time.time(), batch_id, row)
+            )
+
+    def rows(self, batch_id: str) -> List[Dict]:
+        found = self._db.execute(
+            "SELECT row, niche, topic, status, result, error FROM batch_rows WHERE batch_id = ? ORDER BY row",
+            (batch_id,)
+        ).fetchall()
+        return [
+            {"row": row, "niche": niche, "topic": topic, "status": status,
+             "result": json.loads(result) if result else None, "error": error}
+            for row, niche, topic, status, result, error in found
+        ]
+
+    def summary(self, batch_id: str) -> Dict[str, int]:
+        found = self._db.execute(
+            "SELECT status, COUNT(*) FROM batch_rows WHERE batch_id = ? GROUP BY status", (batch_id,)
+        ).fetchall()
+        return dict(found)
+
+    def close(self):
+        self._db.close()
+
+
+def build_archive(rows: List[Dict], image_paths: Dict[int, str]) -> bytes:
+    """ZIP с posts.jsonl (строка файла — пост) и картинками images/<номер строки>.<расширение>"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        lines = []
+        for row in rows:
+            record = {key: row[key] for key in ("row", "niche", "topic", "status", "error")}
+            record.update(row["result"] or {})
+            path = image_paths.get(row["row"])
+            if path:
+                record["image_file"] = f"images/{row['row']}{path[path.rfind('.'):]}"
+                # Картинки уже сжаты: повторно их не сжимаем
+                archive.write(path, record["image_file"], compress_type=zipfile.ZIP_STORED)
+            lines.append(json.dumps(record, ensure_ascii=False))
+        archive.writestr("posts.jsonl", "\n".join(lines) + "\n")
+    return buffer.getvalue()
+
+
+def build_archives(rows: List[Dict], image_paths: Dict[int, str], max_size: int = ARCHIVE_PART_LIMIT) -> List[bytes]:
+    """Архивы пакета не больше max_size каждый: строки делятся по порядку, у каждой части свой posts.jsonl"""
+    parts: List[List[Dict]] = [[]]
+    size = 0
+    for row in rows:
+        path = image_paths.get(row["row"])
+        # Картинка не сжимается, текст записи — с запасом на заголовки ZIP
+        row_size = (os.path.getsize(path) if path else 0) + len(json.dumps(row, ensure_ascii=False).encode()) + 1024
+        if parts[-1] and size + row_size > max_size:
+            parts.append([])
+            size = 0
+        parts[-1].append(row)
+        size += row_size
+    return [build_archive(part, image_paths) for part in parts]
@@ -0,0 +1,96 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(value) -> str:
+    """Нормализация части ключа: регистр и лишние пробелы не влияют на кэш"""
+    return " ".join(str(value).lower().split())
+
+
+class ResponseCache:
+    """LRU-кэш ответов AI с TTL и опциональным хранением в SQLite"""
+
+    def __init__(self, max_size: int = 1000, ttl: float = 24 * 3600, db_path: Optional[str] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()  # key: (expires_at, value)
+        self._db = None
+
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS ai_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.execute("DELETE FROM ai_cache WHERE expires_at < ?", (time.time(),))
+            self._db.commit()
+
+    @staticmethod
+    def make_key(kind: str, *parts) -> str:
+        """Ключ кэша из нормализованных частей (тема, платформа, ниша, модель, версия промпта)"""
+        raw = json.dumps([kind] + [normalize(p) for p in parts], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Значение из кэша или None"""
+        now = time.time()
+
+        item = self._items.get(key)
+        if item and item[0] > now:
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[1]
+        if item:
+            del self._items[key]
+
+        if self._db is not None:
+            row = self._db.execute(
+                "SELECT value, expires_at FROM ai_cache WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            if row:
+                self._remember(key, row[0], row[1])
+                self.hits += 1
+                return row[0]
+
+        self.misses += 1
+        return None
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        """Сохранение значения (ttl — своё время жизни, например для временных ссылок)"""
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        self._remember(key, value, expires_at)
+
+        if self._db is not None:
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO ai_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, value, expires_at)
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Ошибка записи в кэш: {e}")
+
+    def _remember(self, key: str, value: str, expires_at: float):
+        self._items[key] = (expires_at, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def stats(self) -> Dict:
+        """Счётчики попаданий и промахов"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._items),
+        }
@@ -0,0 +1,151 @@
+import asyncio
+import io
+import logging
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from smm_images import ImageStore
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow не установлен: бот работает с исходной картинкой без производных
+    Image = None
+    ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+# Версия рецепта: при изменении форматов ниже производные пересчитываются
+RECIPE_VERSION = 1
+
+# Платформа: (соотношение сторон, максимальный размер). Картинка только уменьшается, но не растягивается
+PLATFORM_FORMATS = {
+    "tiktok": ((9, 16), (1080, 1920)),
+    "instagram": ((4, 5), (1080, 1350)),
+    "telegram": ((1, 1), (1280, 1280)),
+    "vk": ((16, 9), (1280, 720)),
+}
+
+THUMBNAIL_SIZE = (320, 320)
+JPEG_QUALITY = 85
+WEBP_QUALITY = 80
+
+
+def pillow_available() -> bool:
+    return Image is not None
+
+
+def crop_to_ratio(image, ratio: Tuple[int, int]):
+    """Центральная обрезка под соотношение сторон"""
+    width, height = image.size
+    target = ratio[0] / ratio[1]
+    if width / height > target:
+        new_width = round(height * target)
+        left = (width - new_width) // 2
+        return image.crop((left, 0, left + new_width, height))
+    new_height = round(width / target)
+    top = (height - new_height) // 2
+    return image.crop((0, top, width, top + new_height))
+
+
+def encode(image, image_format: str) -> bytes:
+    buffer = io.BytesIO()
+    if image_format == "JPEG":
+        image.save(buffer, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+    else:
+        image.save(buffer, "WEBP", quality=WEBP_QUALITY, method=4)
+    return buffer.getvalue()
+
+
+def render_derivatives(data: bytes) -> Dict[str, Tuple[bytes, str]]:
+    """Все производные одной картинки: {имя: (байты, расширение)}.
+
+    Чистая функция без состояния: выполняется в пуле потоков или процессов.
+    """
+    with Image.open(io.BytesIO(data)) as opened:
+        source = ImageOps.exif_transpose(opened).convert("RGB")
+
+    result = {}
+    for platform, (ratio, max_size) in PLATFORM_FORMATS.items():
+        image = crop_to_ratio(source, ratio)
+        if image.width > max_size[0] or image.height > max_size[1]:
+            image = image.resize(max_size, Image.LANCZOS)
+        result[f"{platform}.jpg"] = (encode(image, "JPEG"), ".jpg")
+        result[f"{platform}.webp"] = (encode(image, "WEBP"), ".webp")
+
+    thumbnail = source.copy()
+    thumbnail.thumbnail(THUMBNAIL_SIZE, Image.LANCZOS)
+    result["thumbnail.jpg"] = (encode(thumbnail, "JPEG"), ".jpg")
+    result["thumbnail.webp"] = (encode(thumbnail, "WEBP"), ".webp")
+    return result
+
+
+class ImageDerivatives:
+    """Кадрирование под платформы, сжатые JPEG/WebP и превью из одной сгенерированной картинки.
+
+    Обработка идёт в пуле вне цикла событий; результат хранится в ImageStore по хэшу исходника,
+    поэтому одна и та же картинка обрабатывается один раз.
+    """
+
+    def __init__(self, store: ImageStore, executor: Optional[Executor] = None, workers: int = 2):
+        self.store = store
+        self._executor = executor or ThreadPoolExecutor(max_workers=workers, thread_name_prefix="smm-images")
+        self._in_progress: Dict[str, asyncio.Future] = {}
+
+    async def ensure(self, digest: Optional[str]) -> Dict[str, str]:
+        """Производные картинки {имя: хэш}; пустой словарь, если сделать их нельзя"""
+        if not digest or not pillow_available():
+            return {}
+
+        cached = self.store.derivatives(digest, RECIPE_VERSION)
+        if cached:
+            return cached
+
+        # Параллельные запросы одной картинки ждут одну обработку
+        if digest in self._in_progress:
+            return await asyncio.shield(self._in_progress[digest])
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_progress[digest] = future
+        try:
+            derivatives = await self._render(digest)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка обработки изображения {digest}: {e}")
+            derivatives = {}
+        finally:
+            del self._in_progress[digest]
+        future.set_result(derivatives)
+        return derivatives
+
+    async def _render(self, digest: str) -> Dict[str, str]:
+        path = self.store.path(digest)
+        if not path:
+            return {}
+
+        data = await asyncio.to_thread(_read, path)
+        rendered = await asyncio.get_running_loop().run_in_executor(self._executor, render_derivatives, data)
+
+        derivatives = {}
+        for name, (content, extension) in rendered.items():
+            derivatives[name] = await self.store.put(content, extension)
+        self.store.remember_derivatives(digest, RECIPE_VERSION, derivatives)
+        return derivatives
+
+    @staticmethod
+    def platform_variants(derivatives: Dict[str, str]) -> Dict[str, str]:
+        """JPEG-вариант для каждой платформы: {платформа: хэш}"""
+        return {
+            platform: derivatives[f"{platform}.jpg"]
+            for platform in PLATFORM_FORMATS
+            if f"{platform}.jpg" in derivatives
+        }
+
+    async def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
@@ -0,0 +1,191 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryDraftStore:
+    """Черновики постов в памяти: не больше max_size штук, каждый живёт ttl секунд"""
+
+    def __init__(self, max_size: int = 1000, ttl: float = 24 * 3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items = OrderedDict()  # user_id: (expires_at, post_data)
+
+    def get(self, user_id: int) -> Optional[Dict]:
+        """Черновик пользователя или None"""
+        item = self._items.get(user_id)
+        if item is None:
+            return None
+        if item[0] <= time.time():
+            del self._items[user_id]
+            return None
+        self._items.move_to_end(user_id)
+        return item[1]
+
+    def put(self, user_id: int, post_data: Dict):
+        """Сохранить черновик (вызывать и после изменения уже сохранённого)"""
+        self._remember(user_id, post_data, time.time() + self.ttl)
+
+    def delete(self, user_id: int):
+        self._items.pop(user_id, None)
+
+    def merge(self, user_id: int, post_id: str, key: str, values: Dict) -> bool:
+        """Дописать values в словарь key черновика post_id, не трогая остальные поля.
+
+        False — у пользователя уже нет этого черновика (заменён или удалён).
+        """
+        post_data = self.get(user_id)
+        if not post_data or post_data.get('id') != post_id:
+            return False
+        post_data.setdefault(key, {}).update(values)
+        self.put(user_id, post_data)
+        return True
+
+    def _remember(self, user_id: int, post_data: Dict, expires_at: float):
+        self._items[user_id] = (expires_at, post_data)
+        self._items.move_to_end(user_id)
+        while len(self._items) > self.max_size:
+            evicted, _ = self._items.popitem(last=False)
+            logger.debug(f"Черновик пользователя {evicted} вытеснен из памяти")
+
+    def __len__(self):
+        return len(self._items)
+
+    def flush(self):
+        pass
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+class SQLiteDraftStore(MemoryDraftStore):
+    """Черновики в SQLite с горячим слоем в памяти.
+
+    Записи копятся и сбрасываются в базу пачкой раз в flush_interval секунд,
+    а черновики, вытесненные из памяти или оставшиеся после перезапуска, подгружаются при обращении.
+    """
+
+    def __init__(self, path: str, max_size: int = 1000, ttl: float = 24 * 3600,
+                 flush_interval: float = 2.0, mmap_size: int = 64 * 1024 * 1024):
+        super().__init__(max_size=max_size, ttl=ttl)
+        self.flush_interval = flush_interval
+        self._dirty = {}  # user_id: post_data или None (удалён)
+        self._task: Optional[asyncio.Task] = None
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS drafts ("
+            "user_id INTEGER PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._db.commit()
+
+    def get(self, user_id: int) -> Optional[Dict]:
+        post_data = super().get(user_id)
+        if post_data is not None:
+            return post_data
+
+        if user_id in self._dirty:
+            # Изменения ещё не в базе: None здесь означает удалённый черновик
+            post_data = self._dirty[user_id]
+            if post_data is not None:
+                self.put(user_id, post_data)
+            return post_data
+
+        row = self._db.execute(
+            "SELECT data, expires_at FROM drafts WHERE user_id = ? AND expires_at > ?", (user_id, time.time())
+        ).fetchone()
+        if row is None:
+            return None
+
+        post_data = json.loads(row[0])
+        self._remember(user_id, post_data, row[1])
+        return post_data
+
+    def put(self, user_id: int, post_data: Dict):
+        super().put(user_id, post_data)
+        self._dirty[user_id] = post_data
+
+    def delete(self, user_id: int):
+        super().delete(user_id)
+        self._dirty[user_id] = None
+
+    def merge(self, user_id: int, post_id: str, key: str, values: Dict) -> bool:
+        """Дописать values в словарь key черновика post_id одним UPDATE прямо в базе.
+
+        Черновик целиком не перезаписывается: правки, которые другой процесс успел сохранить
+        после того, как этот процесс прочитал черновик, не теряются.
+        """
+        # Свои несохранённые изменения — сначала в базу, иначе следующий сброс затрёт дописанное
+        self.flush()
+        try:
+            with self._db:
+                updated = self._db.execute(
+                    "UPDATE drafts SET data = json_set(data, ?, "
+                    "json_patch(COALESCE(json_extract(data, ?), '{}'), json(?))) "
+                    "WHERE user_id = ? AND expires_at > ? AND json_extract(data, '$.id') = ?",
+                    (f"$.{key}", f"$.{key}", json.dumps(values, ensure_ascii=False), user_id, time.time(), post_id)
+                ).rowcount
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка записи черновика: {e}")
+            return False
+        # Копия в памяти устарела: следующий get прочитает черновик из базы
+        super().delete(user_id)
+        return updated > 0
+
+    def flush(self):
+        """Записать накопленные изменения одной транзакцией"""
+        dirty, self._dirty = self._dirty, {}
+        now = time.time()
+        expires_at = now + self.ttl
+
+        upserts = []
+        deletes = []
+        for user_id, post_data in dirty.items():
+            if post_data is None:
+                deletes.append((user_id,))
+            else:
+                upserts.append((user_id, json.dumps(post_data, ensure_ascii=False), expires_at))
+
+        try:
+            with self._db:
+                if upserts:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO drafts (user_id, data, expires_at) VALUES (?, ?, ?)", upserts
+                    )
+                if deletes:
+                    self._db.executemany("DELETE FROM drafts WHERE user_id = ?", deletes)
+                self._db.execute("DELETE FROM drafts WHERE expires_at <= ?", (now,))
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка записи черновиков: {e}")
+            # Не теряем изменения: более свежие записи важнее неудачной пачки
+            dirty.update(self._dirty)
+            self._dirty = dirty
+
+    async def start(self):
+        """Запуск фонового сброса изменений в базу"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if self._dirty:
+                self.flush()
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.flush()
+        self._db.close()
@@ -0,0 +1,151 @@
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+from typing import Dict, Optional, Union
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# Расширения файлов по Content-Type ответа
+EXTENSIONS = {
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/webp": ".webp",
+    "image/gif": ".gif",
+}
+
+
+class ImageStore:
+    """Локальное хранилище картинок по хэшу содержимого + кэш file_id Telegram"""
+
+    def __init__(self, root: str = "images", download_timeout: float = 30):
+        self.root = root
+        self.download_timeout = download_timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._url_hashes = {}  # url: hash
+        self._file_ids = {}  # hash: file_id
+
+        os.makedirs(root, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(root, "index.db"), check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS images (hash TEXT PRIMARY KEY, path TEXT NOT NULL, file_id TEXT)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, hash TEXT NOT NULL)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS derivatives (source TEXT NOT NULL, version INTEGER NOT NULL, "
+            "name TEXT NOT NULL, hash TEXT NOT NULL, PRIMARY KEY (source, version, name))"
+        )
+        self._db.commit()
+
+        for digest, file_id in self._db.execute("SELECT hash, file_id FROM images WHERE file_id IS NOT NULL"):
+            self._file_ids[digest] = file_id
+
+    async def fetch(self, url: str) -> Optional[str]:
+        """Скачать картинку один раз и вернуть хэш её содержимого (None при ошибке)"""
+        digest = self._url_hashes.get(url) or self._lookup_url(url)
+        if digest and self.path(digest):
+            return digest
+
+        try:
+            if self._session is None or self._session.closed:
+                self._session = aiohttp.ClientSession(
+                    timeout=aiohttp.ClientTimeout(total=self.download_timeout)
+                )
+            async with self._session.get(url) as response:
+                response.raise_for_status()
+                data = await response.read()
+                content_type = response.headers.get("Content-Type", "").split(";")[0].strip()
+        except Exception as e:
+            logger.error(f"Ошибка загрузки изображения: {e}")
+            return None
+
+        digest = await self.put(data, EXTENSIONS.get(content_type, ".png"))
+        self._url_hashes[url] = digest
+        self._db.execute("INSERT OR REPLACE INTO urls (url, hash) VALUES (?, ?)", (url, digest))
+        self._db.commit()
+        return digest
+
+    async def put(self, data: bytes, extension: str = ".png") -> str:
+        """Сохранить байты картинки; одинаковое содержимое хранится один раз"""
+        digest = hashlib.sha256(data).hexdigest()
+        if self.path(digest):
+            return digest
+
+        relative = os.path.join(digest[:2], digest + extension)
+        await asyncio.to_thread(self._write, os.path.join(self.root, relative), data)
+        self._db.execute("INSERT OR IGNORE INTO images (hash, path) VALUES (?, ?)", (digest, relative))
+        self._db.commit()
+        return digest
+
+    @staticmethod
+    def _write(path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def path(self, digest: Optional[str]) -> Optional[str]:
+        """Путь к файлу картинки или None, если её нет на диске"""
+        if not digest:
+            return None
+        row = self._db.execute("SELECT path FROM images WHERE hash = ?", (digest,)).fetchone()
+        if not row:
+            return None
+        path = os.path.join(self.root, row[0])
+        return path if os.path.exists(path) else None
+
+    def relative_path(self, digest: Optional[str]) -> Optional[str]:
+        """Путь к файлу картинки относительно root (через "/", для ссылок) или None, если её нет на диске"""
+        path = self.path(digest)
+        if not path:
+            return None
+        return os.path.relpath(path, self.root).replace(os.sep, "/")
+
+    def photo(self, digest: Optional[str]) -> Optional[Union[str, bytes]]:
+        """Что передать в reply_photo: file_id, если картинка уже загружалась в Telegram, иначе байты"""
+        if not digest:
+            return None
+        if digest in self._file_ids:
+            return self._file_ids[digest]
+
+        path = self.path(digest)
+        if not path:
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def remember_file_id(self, digest: Optional[str], message):
+        """Запомнить file_id из ответа Telegram, чтобы больше не загружать файл"""
+        if not digest or not message or not message.photo or digest in self._file_ids:
+            return
+        file_id = message.photo[-1].file_id
+        self._file_ids[digest] = file_id
+        self._db.execute("UPDATE images SET file_id = ? WHERE hash = ?", (file_id, digest))
+        self._db.commit()
+
+    def derivatives(self, source: str, version: int) -> Dict[str, str]:
+        """Производные картинки source, сделанные рецептом version: {имя: хэш}"""
+        rows = self._db.execute(
+            "SELECT name, hash FROM derivatives WHERE source = ? AND version = ?", (source, version)
+        ).fetchall()
+        return {name: digest for name, digest in rows if self.path(digest)}
+
+    def remember_derivatives(self, source: str, version: int, derivatives: Dict[str, str]):
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO derivatives (source, version, name, hash) VALUES (?, ?, ?, ?)",
+                [(source, version, name, digest) for name, digest in derivatives.items()]
+            )
+
+    def _lookup_url(self, url: str) -> Optional[str]:
+        row = self._db.execute("SELECT hash FROM urls WHERE url = ?", (url,)).fetchone()
+        if row:
+            self._url_hashes[url] = row[0]
+            return row[0]
+        return None
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
@@ -0,0 +1,251 @@
+import asyncio
+import json
+import logging
+import socket
+import sqlite3
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты: чем больше, тем раньше задача попадёт к воркеру
+PRIORITY_INTERACTIVE = 10
+PRIORITY_BATCH = 0
+# Заранее генерируемые варианты черновика: только когда больше нечего делать
+PRIORITY_SPECULATIVE = -10
+
+# Статусы, при которых задача ещё не завершена
+ACTIVE_STATUSES = ("queued", "running")
+
+
+class Job:
+    """Фоновая задача"""
+
+    def __init__(self, job_id: str, kind: str, user_id: int, payload: Dict, priority: int = PRIORITY_INTERACTIVE,
+                 status: str = "queued", error: Optional[str] = None, created_at: Optional[float] = None,
+                 started_at: Optional[float] = None, finished_at: Optional[float] = None):
+        self.id = job_id
+        self.kind = kind
+        self.user_id = user_id
+        self.payload = payload
+        self.priority = priority
+        self.status = status
+        self.error = error
+        self.created_at = created_at or time.time()
+        self.started_at = started_at
+        self.finished_at = finished_at
+
+    @classmethod
+    def from_row(cls, row) -> "Job":
+        job_id, kind, user_id, payload, priority, status, error, created_at, started_at, finished_at = row
+        return cls(job_id, kind, user_id, json.loads(payload), priority, status, error,
+                   created_at, started_at, finished_at)
+
+
+JOB_COLUMNS = "id, kind, user_id, payload, priority, status, error, created_at, started_at, finished_at"
+
+
+class BackgroundJobQueue:
+    """Очередь фоновых задач с приоритетами, хранящаяся в SQLite.
+
+    Воркеры забирают задачи атомарным UPDATE, поэтому их можно запускать и в самом боте,
+    и в отдельном процессе с тем же файлом базы. Незавершённые задачи переживают перезапуск.
+    """
+
+    def __init__(self, db_path: str = ":memory:", workers: int = 4, poll_interval: float = 1.0,
+                 worker_name: str = "bot", keep_finished: float = 24 * 3600):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.keep_finished = keep_finished
+        # Имя постоянно между перезапусками: по нему находим свои зависшие задачи
+        self.worker_name = f"{socket.gethostname()}:{worker_name}"
+        self._handlers: Dict[str, Callable[[Job], Awaitable]] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._running: Dict[str, asyncio.Task] = {}  # id задачи: выполняющий её обработчик
+        self._cancelled = set()  # задачи, отменённые по запросу, а не остановкой бота
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, kind TEXT NOT NULL, user_id INTEGER NOT NULL, payload TEXT NOT NULL, "
+            "priority INTEGER NOT NULL, status TEXT NOT NULL, error TEXT, created_at REAL NOT NULL, "
+            "started_at REAL, finished_at REAL, worker TEXT)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority DESC, created_at)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_user ON jobs (user_id, created_at)")
+        self._db.commit()
+
+    def register(self, kind: str, handler: Callable[[Job], Awaitable]):
+        """Обработчик задач вида kind"""
+        self._handlers[kind] = handler
+
+    def submit(self, kind: str, user_id: int, payload: Dict, job_id: str,
+               priority: int = PRIORITY_INTERACTIVE) -> Job:
+        """Поставить задачу в очередь; задача с тем же id, если она ещё не завершена, не дублируется"""
+        existing = self.get(job_id)
+        if existing is not None and existing.status in ACTIVE_STATUSES:
+            return existing
+
+        job = Job(job_id, kind, user_id, payload, priority)
+        with self._db:
+            self._db.execute(
+                f"INSERT OR REPLACE INTO jobs ({JOB_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job.id, job.kind, job.user_id, json.dumps(job.payload, ensure_ascii=False), job.priority,
+                 job.status, None, job.created_at, None, None)
+            )
+        self._wakeup.set()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        row = self._db.execute(f"SELECT {JOB_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return Job.from_row(row) if row else None
+
+    def jobs_for(self, user_id: int, limit: int = 10) -> List[Job]:
+        """Последние задачи пользователя"""
+        rows = self._db.execute(
+            f"SELECT {JOB_COLUMNS} FROM jobs WHERE user_id = ? ORDER BY created_at DESC LIMIT ?", (user_id, limit)
+        ).fetchall()
+        return [Job.from_row(row) for row in rows]
+
+    def position(self, job: Job) -> Optional[int]:
+        """Место задачи в очереди (1 — следующая), None — уже не ждёт"""
+        if job.status != "queued":
+            return None
+        ahead = self._db.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'queued' "
+            "AND (priority > ? OR (priority = ? AND created_at < ?))",
+            (job.priority, job.priority, job.created_at)
+        ).fetchone()[0]
+        return ahead + 1
+
+    def cancel(self, user_id: int, kinds: Optional[List[str]] = None) -> List[Job]:
+        """Отменить незавершённые задачи пользователя (всех видов или только kinds).
+
+        Ждущие в очереди задачи больше не запустятся, выполняющиеся в этом процессе прерываются сразу;
+        воркер другого процесса увидит отмену через is_cancelled. Возвращает отменённые задачи.
+        """
+        query = f"SELECT {JOB_COLUMNS} FROM jobs WHERE user_id = ? AND status IN ('queued', 'running')"
+        params = [user_id]
+        if kinds:
+            query += f" AND kind IN ({', '.join('?' * len(kinds))})"
+            params.extend(kinds)
+
+        cancelled = []
+        with self._db:
+            for row in self._db.execute(query, params).fetchall():
+                job = Job.from_row(row)
+                updated = self._db.execute(
+                    "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = ?",
+                    (time.time(), job.id, job.status)
+                ).rowcount
+                if updated:
+                    cancelled.append(job)
+
+        for job in cancelled:
+            task = self._running.get(job.id)
+            if task is not None:
+                self._cancelled.add(job.id)
+                task.cancel()
+        return cancelled
+
+    def count_active(self, kind: str) -> int:
+        """Сколько задач вида kind ждёт в очереди или выполняется (во всех процессах)"""
+        return self._db.execute(
+            "SELECT COUNT(*) FROM jobs WHERE kind = ? AND status IN ('queued', 'running')", (kind,)
+        ).fetchone()[0]
+
+    def is_cancelled(self, job_id: str) -> bool:
+        job = self.get(job_id)
+        return job is not None and job.status == "cancelled"
+
+    def stats(self) -> Dict[str, int]:
+        rows = self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+    async def start(self):
+        """Вернуть в очередь задачи, прерванные прошлым запуском, и запустить воркеров"""
+        with self._db:
+            requeued = self._db.execute(
+                "UPDATE jobs SET status = 'queued', worker = NULL WHERE status = 'running' AND worker = ?",
+                (self.worker_name,)
+            ).rowcount
+            self._db.execute(
+                "DELETE FROM jobs WHERE status NOT IN ('queued', 'running') AND finished_at < ?",
+                (time.time() - self.keep_finished,)
+            )
+        if requeued:
+            logger.info(f"Возвращено в очередь прерванных задач: {requeued}")
+
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    async def stop(self):
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        self._stopping = False
+
+    def _claim(self) -> Optional[Job]:
+        with self._db:
+            row = self._db.execute(
+                f"UPDATE jobs SET status = 'running', started_at = ?, worker = ? "
+                f"WHERE id = (SELECT id FROM jobs WHERE status = 'queued' "
+                f"ORDER BY priority DESC, created_at LIMIT 1) AND status = 'queued' "
+                f"RETURNING {JOB_COLUMNS}",
+                (time.time(), self.worker_name)
+            ).fetchone()
+        return Job.from_row(row) if row else None
+
+    def _finish(self, job: Job, status: str, error: Optional[str] = None):
+        job.status = status
+        job.error = error
+        job.finished_at = time.time()
+        with self._db:
+            # Отменённую задачу не помечаем выполненной, даже если обработчик успел закончить
+            self._db.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ? AND status = 'running'",
+                (status, error, job.finished_at, job.id)
+            )
+
+    async def _worker(self):
+        while True:
+            self._wakeup.clear()
+            job = self._claim()
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job)
+
+    async def _run(self, job: Job):
+        handler = self._handlers.get(job.kind)
+        if handler is None:
+            self._finish(job, "failed", f"нет обработчика для {job.kind}")
+            return
+
+        # Обработчик выполняется отдельной задачей, чтобы его можно было отменить, не трогая воркер
+        task = asyncio.create_task(handler(job))
+        self._running[job.id] = task
+        try:
+            await task
+        except asyncio.CancelledError:
+            if self._stopping or job.id not in self._cancelled:
+                # Остановка бота: задача останется running и вернётся в очередь при следующем запуске
+                raise
+            logger.info(f"Задача {job.id} отменена")
+            return
+        except Exception as e:
+            logger.exception(f"Задача {job.id} завершилась ошибкой")
+            self._finish(job, "failed", str(e)[:500])
+            return
+        finally:
+            del self._running[job.id]
+            self._cancelled.discard(job.id)
+        self._finish(job, "done")
@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Очередь запросов к AI переполнена"""
+
+
+class TokenBucket:
+    """Токен-бакет: rate_per_minute единиц в минуту, не больше burst за раз"""
+
+    def __init__(self, rate_per_minute: float, burst: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = burst if burst is not None else max(1.0, rate_per_minute / 6.0)
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Сколько секунд ждать, пока в бакете наберётся amount (0 — можно сейчас)"""
+        self._refill()
+        # Запрос больше ёмкости пропускаем при полном бакете, иначе он не пройдёт никогда
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+
+class _Waiter:
+    __slots__ = ("user_id", "tokens", "future")
+
+    def __init__(self, user_id, tokens: float, future: asyncio.Future):
+        self.user_id = user_id
+        self.tokens = tokens
+        self.future = future
+
+
+class AdmissionController:
+    """Общий планировщик запросов к OpenAI.
+
+    Пропускает запросы в пределах RPM/TPM и max_in_flight, пользователей обслуживает по кругу,
+    чтобы один пользователь с кучей запросов не занимал всю очередь.
+    """
+
+    def __init__(self, name: str, rpm: float, tpm: Optional[float] = None,
+                 max_in_flight: int = 16, max_queue: int = 500):
+        self.name = name
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self._queues = OrderedDict()  # user_id: deque[_Waiter]
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def is_full(self) -> bool:
+        return self.queue_depth >= self.max_queue
+
+    def position(self, user_id) -> Optional[int]:
+        """Позиция первого запроса пользователя в очереди (1 — следующий), None — не ждёт"""
+        for index, queued_user in enumerate(self._queues):
+            if queued_user == user_id:
+                return index + 1
+        return None
+
+    def has_spare_capacity(self, headroom: float = 0.5) -> bool:
+        """Свободна ли сейчас доля headroom лимитов: никто не ждёт в очереди, занято не больше
+        (1 - headroom) мест и в бакетах запросов и токенов набрано не меньше headroom ёмкости"""
+        if self._queues or self.in_flight > self.max_in_flight * (1 - headroom):
+            return False
+        buckets = [self.requests] + ([self.tokens] if self.tokens is not None else [])
+        return all(bucket.wait_time(bucket.capacity * headroom) == 0 for bucket in buckets)
+
+    def stats(self) -> Dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "queued_users": len(self._queues),
+            "in_flight": self.in_flight,
+        }
+
+    @asynccontextmanager
+    async def slot(self, user_id=None, tokens: float = 1):
+        """Занять место для одного запроса на время блока async with"""
+        await self.acquire(user_id, tokens)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, user_id=None, tokens: float = 1):
+        if self.is_full():
+            raise QueueFullError(f"Очередь {self.name} переполнена ({self.queue_depth})")
+
+        waiter = _Waiter(user_id, tokens, asyncio.get_running_loop().create_future())
+        self._queues.setdefault(user_id, deque()).append(waiter)
+        self._pump()
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Место уже выдано, но запрос отменён — возвращаем его
+                self.release()
+            else:
+                self._discard(waiter)
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        self._pump()
+
+    def _discard(self, waiter: _Waiter):
+        queue = self._queues.get(waiter.user_id)
+        if queue and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del self._queues[waiter.user_id]
+        self._pump()
+
+    def _pump(self):
+        """Выдать места ожидающим, пока позволяют лимиты"""
+        while self._queues and self.in_flight < self.max_in_flight:
+            user_id, queue = next(iter(self._queues.items()))
+            waiter = queue[0]
+            if waiter.future.done():
+                queue.popleft()
+                if not queue:
+                    del self._queues[user_id]
+                continue
+
+            wait = self.requests.wait_time(1)
+            if self.tokens is not None:
+                wait = max(wait, self.tokens.wait_time(waiter.tokens))
+            if wait > 0:
+                self._schedule(wait)
+                return
+
+            self.requests.take(1)
+            if self.tokens is not None:
+                self.tokens.take(waiter.tokens)
+
+            # Пользователь уходит в конец круга
+            queue.popleft()
+            del self._queues[user_id]
+            if queue:
+                self._queues[user_id] = queue
+
+            self.in_flight += 1
+            waiter.future.set_result(None)
+
+    def _schedule(self, delay: float):
+        if self._timer is not None and not self._timer.cancelled():
+            return
+
+        def wake():
+            self._timer = None
+            self._pump()
+
+        self._timer = asyncio.get_running_loop().call_later(delay, wake)
+
+
+def estimate_tokens(messages: list, max_tokens: int) -> int:
+    """Грубая оценка токенов запроса для TPM: ~3 символа на токен плюс лимит ответа"""
+    chars = sum(len(message.get("content") or "") for message in messages)
+    return chars // 3 + max_tokens
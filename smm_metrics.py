@@ -0,0 +1,271 @@
+import asyncio
+import json
+import logging
+import sqlite3
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from datetime import date
+from typing import Callable, Dict, Optional, Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержек, секунд
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Описания метрик для /metrics (строка HELP)
+DESCRIPTIONS = {
+    "smm_openai_requests_total": "Запросы к OpenAI по виду, модели и исходу",
+    "smm_openai_request_seconds": "Длительность запросов к OpenAI",
+    "smm_openai_tokens_total": "Токены OpenAI (prompt/completion; cached — часть prompt из кэша промптов OpenAI)",
+    "smm_model_failovers_total": "Запросы, ушедшие в запасную модель вместо основной",
+    "smm_telegram_requests_total": "Запросы к Telegram Bot API по методу и HTTP-статусу",
+    "smm_telegram_request_seconds": "Длительность запросов к Telegram Bot API",
+    "smm_telegram_send_wait_seconds": "Ожидание отправки в планировщике исходящих сообщений",
+    "smm_telegram_coalesced_total": "Правки сообщений, заменённые более новой правкой до отправки",
+    "smm_telegram_retry_after_total": "Ответы Telegram RetryAfter (flood control)",
+    "smm_handler_seconds": "Длительность обработчиков диалога",
+    "smm_transitions_total": "Переходы диалога: обработчик и состояние после него",
+    "smm_posts_generated_total": "Сгенерированные тексты постов по платформам",
+    "smm_publications_total": "Публикации по платформам и исходу",
+    "smm_partial_regenerations_total": "Перегенерации отдельного текста или фото",
+    "smm_jobs_cancelled_total": "Генерации, отменённые пользователем или заменённые новой темой",
+    "smm_topic_reuse_total": "Выбор после предложения похожих постов: готовый черновик или новый",
+    "smm_auto_replies_total": "Автоответы на комментарии: шаблон или GPT, намерение",
+    "smm_batch_rows_total": "Строки пакетной генерации по итогу: done, partial, failed",
+    "smm_scheduled_total": "Отложенные публикации: запланированы, опубликованы, с ошибкой, отменены",
+    "smm_duplicate_actions_total": "Повторные нажатия кнопок, которые не запустили действие",
+    "smm_image_processing_seconds": "Подготовка вариантов картинки под платформы",
+    "smm_speculative_requests_total": "Просьбы о новом варианте: hit — выдан заранее готовый, miss — генерация",
+    "smm_speculative_variants_total": "Заранее генерируемые варианты: ready, served, wasted, failed, skipped (AI занят)",
+    "smm_speculative_tokens_total": "Токены заранее сгенерированных вариантов: served — пригодились, wasted — впустую",
+    "smm_speculative_images_total": "Фото заранее сгенерированных вариантов: served — пригодились, wasted — впустую",
+}
+
+
+class Histogram:
+    """Гистограмма задержек с фиксированными корзинами (как в Prometheus)"""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя корзина — +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Оценка квантиля линейной интерполяцией внутри корзины"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class MetricsRegistry:
+    """Счётчики и гистограммы в памяти, агрегаты по пользователям и дням, сброс в SQLite"""
+
+    def __init__(self, db_path: Optional[str] = None, flush_interval: float = 30.0):
+        self.flush_interval = flush_interval
+        self.counters: Dict[Tuple, float] = defaultdict(float)  # (имя, метки): значение
+        self.histograms: Dict[Tuple, Histogram] = {}
+        self.users: Dict[int, Counter] = defaultdict(Counter)
+        self.daily: Dict[str, Counter] = defaultdict(Counter)
+        self.gauges: Dict[str, Callable[[], float]] = {}  # снимаются в момент выдачи /metrics
+        self._task: Optional[asyncio.Task] = None
+        self._db = None
+
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.executescript(
+                "CREATE TABLE IF NOT EXISTS counters (name TEXT, labels TEXT, value REAL, PRIMARY KEY (name, labels));"
+                "CREATE TABLE IF NOT EXISTS histograms (name TEXT, labels TEXT, counts TEXT, sum REAL, count INTEGER,"
+                " PRIMARY KEY (name, labels));"
+                "CREATE TABLE IF NOT EXISTS user_stats (user_id INTEGER, key TEXT, value REAL, PRIMARY KEY (user_id, key));"
+                "CREATE TABLE IF NOT EXISTS daily_stats (day TEXT, key TEXT, value REAL, PRIMARY KEY (day, key));"
+            )
+            self._load()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+    def gauge(self, name: str, read: Callable[[], float]):
+        """Текущее значение (глубина очереди и т.п.), которое читается при каждой выдаче метрик"""
+        self.gauges[name] = read
+
+    def count_event(self, key: str, user_id: Optional[int] = None, value: float = 1):
+        """Бизнес-событие: в агрегаты за сегодня и, если указан, по пользователю"""
+        self.daily[date.today().isoformat()][key] += value
+        if user_id is not None:
+            self.users[user_id][key] += value
+
+    def today(self) -> Counter:
+        return self.daily[date.today().isoformat()]
+
+    def total(self, name: str, **labels) -> float:
+        """Сумма счётчика по всем сериям, подходящим под указанные метки"""
+        wanted = set(labels.items())
+        return sum(value for (metric, series), value in self.counters.items()
+                   if metric == name and wanted <= set(series))
+
+    def merged_histogram(self, name: str, **labels) -> Histogram:
+        """Все серии гистограммы с подходящими метками, сложенные в одну"""
+        wanted = set(labels.items())
+        merged = Histogram()
+        for (metric, series), histogram in self.histograms.items():
+            if metric == name and wanted <= set(series):
+                merged.counts = [a + b for a, b in zip(merged.counts, histogram.counts)]
+                merged.sum += histogram.sum
+                merged.count += histogram.count
+        return merged
+
+    def render(self) -> str:
+        """Текстовый формат Prometheus"""
+        lines = []
+        described = set()
+
+        def header(name: str, kind: str):
+            if name in described:
+                return
+            described.add(name)
+            if name in DESCRIPTIONS:
+                lines.append(f"# HELP {name} {DESCRIPTIONS[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for (name, series), value in sorted(self.counters.items()):
+            header(name, "counter")
+            lines.append(f"{name}{_labels(series)} {value:g}")
+
+        for (name, series), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+            header(name, "histogram")
+            cumulative = 0
+            for bound, count in zip(list(histogram.buckets) + ["+Inf"], histogram.counts):
+                cumulative += count
+                le = bound if bound == "+Inf" else f"{bound:g}"
+                lines.append(f"{name}_bucket{_labels(series + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(series)} {histogram.sum:g}")
+            lines.append(f"{name}_count{_labels(series)} {histogram.count}")
+
+        for name, read in sorted(self.gauges.items()):
+            try:
+                value = read()
+            except Exception as e:
+                logger.warning(f"Не удалось снять метрику {name}: {e}")
+                continue
+            header(name, "gauge")
+            lines.append(f"{name} {value:g}")
+
+        return "\n".join(lines) + "\n"
+
+    async def start(self):
+        if self._db is not None and self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._db is not None:
+            self.flush()
+            self._db.close()
+            self._db = None
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Записать текущие значения в базу (значения абсолютные, поэтому запись идемпотентна)"""
+        if self._db is None:
+            return
+        try:
+            with self._db:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO counters (name, labels, value) VALUES (?, ?, ?)",
+                    [(name, json.dumps(series), value) for (name, series), value in self.counters.items()]
+                )
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO histograms (name, labels, counts, sum, count) VALUES (?, ?, ?, ?, ?)",
+                    [(name, json.dumps(series), json.dumps(h.counts), h.sum, h.count)
+                     for (name, series), h in self.histograms.items()]
+                )
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO user_stats (user_id, key, value) VALUES (?, ?, ?)",
+                    [(user_id, key, value) for user_id, stats in self.users.items() for key, value in stats.items()]
+                )
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO daily_stats (day, key, value) VALUES (?, ?, ?)",
+                    [(day, key, value) for day, stats in self.daily.items() for key, value in stats.items()]
+                )
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка сохранения метрик: {e}")
+
+    def _load(self):
+        for name, series, value in self._db.execute("SELECT name, labels, value FROM counters"):
+            self.counters[(name, _series(series))] = value
+        for name, series, counts, total, count in self._db.execute(
+            "SELECT name, labels, counts, sum, count FROM histograms"
+        ):
+            histogram = Histogram()
+            histogram.counts = json.loads(counts)
+            histogram.sum = total
+            histogram.count = count
+            self.histograms[(name, _series(series))] = histogram
+        for user_id, key, value in self._db.execute("SELECT user_id, key, value FROM user_stats"):
+            self.users[user_id][key] = value
+        for day, key, value in self._db.execute("SELECT day, key, value FROM daily_stats"):
+            self.daily[day][key] = value
+
+
+def _series(raw: str) -> Tuple:
+    return tuple(tuple(pair) for pair in json.loads(raw))
+
+
+def _labels(series: Tuple) -> str:
+    if not series:
+        return ""
+    pairs = []
+    for key, value in series:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def metrics_handler(registry: MetricsRegistry):
+    """aiohttp-обработчик для /metrics"""
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    return handle
+
+
+async def start_metrics_server(registry: MetricsRegistry, host: str, port: int) -> web.AppRunner:
+    """Отдельный HTTP-сервер с /metrics (для режима polling, где своего сервера нет)"""
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler(registry))
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
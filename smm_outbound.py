@@ -0,0 +1,245 @@
+import asyncio
+import itertools
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from smm_limits import TokenBucket
+from smm_metrics import MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты исходящих сообщений: чем больше, тем раньше уходит запрос
+PRIORITY_PROGRESS = 0  # промежуточные статусы и анимация прогресса
+PRIORITY_NORMAL = 5
+PRIORITY_FINAL = 10  # превью и сообщения с кнопками
+
+# Правки, из которых в очереди достаточно последней
+COALESCED_ENDPOINTS = {"editMessageText", "editMessageCaption", "editMessageReplyMarkup"}
+
+# Сколько чатов помнить: бакет простаивавшего чата всё равно полон, его можно забыть
+MAX_TRACKED_CHATS = 10000
+
+
+def is_limited(endpoint: str) -> bool:
+    """Запросы, которые Telegram считает отправкой сообщений"""
+    return endpoint.startswith(("send", "edit", "copyMessage", "forwardMessage"))
+
+
+def default_priority(endpoint: str, data: Dict) -> int:
+    # Сообщение с кнопками — итог шага (превью, меню), правка без кнопок — обычно прогресс
+    if data.get("reply_markup"):
+        return PRIORITY_FINAL
+    if endpoint.startswith("edit"):
+        return PRIORITY_PROGRESS
+    return PRIORITY_NORMAL
+
+
+class _Request:
+    __slots__ = ("chat_id", "priority", "seq", "key", "start", "done")
+
+    def __init__(self, chat_id, priority: int, seq: int, key: Optional[tuple], done: asyncio.Future):
+        self.chat_id = chat_id
+        self.priority = priority
+        self.seq = seq
+        self.key = key
+        # start: None — можно отправлять, _Request — правку заменила более новая, ждём её результат
+        self.start = asyncio.get_running_loop().create_future()
+        self.done = done
+
+
+class _Chat:
+    __slots__ = ("bucket", "blocked_until")
+
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self.blocked_until = 0.0
+
+
+class OutboundScheduler(BaseRateLimiter):
+    """Планировщик исходящих запросов к Bot API.
+
+    Держит общий лимит бота и лимиты каждого чата, отправляет запросы по приоритету
+    (превью раньше анимации прогресса), а из нескольких ожидающих правок одного сообщения
+    отправляет только последнюю. На RetryAfter чат ставится на паузу и запрос повторяется.
+    Приоритет можно задать явно: rate_limit_args={"priority": PRIORITY_FINAL}.
+    """
+
+    def __init__(self, global_rate: float = 30, private_rate: float = 60, group_rate: float = 20,
+                 burst: float = 3, max_retries: int = 2, metrics: Optional[MetricsRegistry] = None):
+        """global_rate — сообщений в секунду на бота, private_rate и group_rate — в минуту на чат"""
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.metrics = metrics
+        self._global = TokenBucket(global_rate * 60, burst=global_rate)
+        self._global_blocked_until = 0.0
+        self._chats: "OrderedDict[Any, _Chat]" = OrderedDict()
+        self._queue: List[_Request] = []
+        self._edits: Dict[tuple, _Request] = {}  # ключ правки: ожидающий запрос
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._timer_at = 0.0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    async def process_request(self, callback, args, kwargs, endpoint: str, data: Dict[str, Any],
+                              rate_limit_args: Optional[Dict]):
+        if not is_limited(endpoint):
+            return await callback(*args, **kwargs)
+
+        chat_id = data.get("chat_id")
+        priority = (rate_limit_args or {}).get("priority", default_priority(endpoint, data))
+        key = None
+        if endpoint in COALESCED_ENDPOINTS:
+            key = (endpoint, chat_id, data.get("message_id"), data.get("inline_message_id"))
+
+        # Результат общий для всех попыток: его же получат вытесненные этим запросом правки
+        done = asyncio.get_running_loop().create_future()
+        try:
+            result = await self._send(callback, args, kwargs, chat_id, priority, key, done)
+        except asyncio.CancelledError:
+            done.cancel()
+            raise
+        except Exception as e:
+            done.set_exception(e)
+            done.exception()  # исключение получит вызывающий, future его не «теряет»
+            raise
+        done.set_result(result)
+        return result
+
+    async def _send(self, callback, args, kwargs, chat_id, priority: int, key: Optional[tuple],
+                    done: asyncio.Future):
+        for attempt in range(self.max_retries + 1):
+            request = _Request(chat_id, priority, next(self._seq), key, done)
+            superseded_by = await self._acquire(request)
+            if superseded_by is not None:
+                # Эту правку заменила более новая: её результат и есть наш
+                return await asyncio.shield(superseded_by.done)
+
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") \
+                    else float(e.retry_after)
+                self._block(chat_id, retry_after)
+                if self.metrics is not None:
+                    self.metrics.inc("smm_telegram_retry_after_total")
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"Telegram просит подождать {retry_after:.1f} с (чат {chat_id}), повторяем")
+
+    async def _acquire(self, request: _Request) -> Optional[_Request]:
+        """Ждать своей очереди; вернуть запрос, который заменил этот, если правку вытеснили"""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+
+        if request.key is not None:
+            previous = self._edits.get(request.key)
+            if previous is not None and not previous.start.done():
+                # Старая правка ещё не ушла: её место занимает новая, сохраняя более высокий приоритет
+                self._queue.remove(previous)
+                request.priority = max(request.priority, previous.priority)
+                request.seq = previous.seq
+                previous.start.set_result(request)
+                if self.metrics is not None:
+                    self.metrics.inc("smm_telegram_coalesced_total")
+            self._edits[request.key] = request
+
+        self._queue.append(request)
+        self._pump()
+        try:
+            superseded_by = await request.start
+        except asyncio.CancelledError:
+            if request in self._queue:
+                self._queue.remove(request)
+            self._forget(request)
+            raise
+
+        self._forget(request)
+        if self.metrics is not None and superseded_by is None:
+            self.metrics.observe("smm_telegram_send_wait_seconds", loop.time() - started)
+        return superseded_by
+
+    def _forget(self, request: _Request):
+        if request.key is not None and self._edits.get(request.key) is request:
+            del self._edits[request.key]
+
+    def _chat(self, chat_id) -> _Chat:
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            # Положительные id — личные чаты, отрицательные и @имя — группы и каналы
+            private = isinstance(chat_id, int) and chat_id > 0 or str(chat_id).isdigit()
+            rate = self.private_rate if private else self.group_rate
+            chat = self._chats[chat_id] = _Chat(TokenBucket(rate, burst=self.burst))
+            while len(self._chats) > MAX_TRACKED_CHATS:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return chat
+
+    def _block(self, chat_id, seconds: float):
+        until = asyncio.get_running_loop().time() + seconds
+        if chat_id is None:
+            self._global_blocked_until = max(self._global_blocked_until, until)
+        else:
+            chat = self._chat(chat_id)
+            chat.blocked_until = max(chat.blocked_until, until)
+        self._schedule(seconds)
+
+    def _pump(self):
+        """Отпустить запросы, которые укладываются в лимиты, в порядке приоритета"""
+        if not self._queue:
+            return
+
+        now = asyncio.get_running_loop().time()
+        next_delay = None
+        for request in sorted(self._queue, key=lambda r: (-r.priority, r.seq)):
+            global_wait = max(self._global_blocked_until - now, self._global.wait_time(1))
+            if global_wait > 0:
+                next_delay = global_wait if next_delay is None else min(next_delay, global_wait)
+                break
+
+            chat = self._chat(request.chat_id)
+            wait = max(chat.blocked_until - now, chat.bucket.wait_time(1))
+            if wait > 0:
+                # Этот чат упёрся в свой лимит, но другие чаты ждать не должны
+                next_delay = wait if next_delay is None else min(next_delay, wait)
+                continue
+
+            self._global.take(1)
+            chat.bucket.take(1)
+            self._queue.remove(request)
+            request.start.set_result(None)
+
+        if self._queue and next_delay is not None:
+            self._schedule(next_delay)
+
+    def _schedule(self, delay: float):
+        loop = asyncio.get_running_loop()
+        at = loop.time() + delay
+        if self._timer is not None and self._timer_at <= at:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+
+        def wake():
+            self._timer = None
+            self._pump()
+
+        self._timer = loop.call_later(delay, wake)
+        self._timer_at = at
@@ -0,0 +1,166 @@
+import functools
+import html
+from typing import Dict, List, Optional
+
+# Предел длины текста одного сообщения Telegram. Telegram считает символы UTF-16 (эмодзи вне BMP —
+# за два) и без HTML-тегов; здесь теги и сущности вроде &amp; тоже считаются, так что запас есть всегда
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+PLATFORM_ICONS = {"tiktok": "🎵", "telegram": "✈️", "instagram": "📸", "vk": "🌐"}
+
+SEPARATOR = "━━━━━━━━━━━━━━━━━━━━\n\n"
+ELLIPSIS = "…"
+
+
+def text_size(text: str) -> int:
+    """Длина текста в символах UTF-16, как её считает Telegram"""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def clip_escaped(text: str, size: int) -> str:
+    """Начало уже экранированного текста не длиннее size символов UTF-16, не разрезающее сущность вроде &amp;"""
+    if text_size(text) <= size:
+        return text
+    # Символ занимает в UTF-16 не меньше одного, поэтому начинаем с первых size символов строки
+    clipped = text[:size]
+    while True:
+        amp = clipped.rfind("&")
+        if amp != -1 and clipped.find(";", amp) == -1:
+            clipped = clipped[:amp]
+        excess = text_size(clipped) - size
+        if excess <= 0:
+            return clipped
+        clipped = clipped[:len(clipped) - excess]
+
+
+@functools.lru_cache(maxsize=None)
+def section_title(platform: str, continued: bool = False) -> str:
+    suffix = " (продолжение)" if continued else ""
+    return f"{PLATFORM_ICONS.get(platform, '📱')} <b>{platform.upper()}</b>{suffix}\n"
+
+
+class PreviewRenderer:
+    """Превью черновика в HTML для Telegram.
+
+    Тема и тексты экранируются, каждое сообщение собирается одним join. Если превью длиннее
+    лимита сообщения, render() раскладывает его на несколько сообщений целыми секциями
+    платформ (слишком длинная секция делится по строкам), а render_single() для сообщения,
+    которое правится на месте, сворачивает самые длинные тексты до начала с многоточием.
+    """
+
+    def __init__(self, limit: int = TELEGRAM_MESSAGE_LIMIT):
+        self.limit = limit
+
+    def header(self, post_data: Dict) -> str:
+        image_status = "✅ Готово" if post_data.get('image_url') else "⏳ Генерируется..."
+        return "".join((
+            "📋 <b>ПРЕВЬЮ ПОСТА</b>\n\n",
+            "🎯 <b>Тема:</b> ", html.escape(post_data['topic']), "\n",
+            "📂 <b>Ниша:</b> ", html.escape(post_data['niche'].capitalize()), "\n",
+            "🖼 <b>Фото:</b> ", image_status, "\n\n",
+            SEPARATOR,
+        ))
+
+    def render(self, post_data: Dict, prefix: str = "") -> List[str]:
+        """Тексты сообщений превью по порядку; prefix (уже HTML) ставится перед первым"""
+        head = prefix + self.header(post_data)
+        texts = {platform: html.escape(content['text']) for platform, content in post_data['platforms'].items()}
+        page = self._single_page(head, texts)
+        if page is not None:
+            return [page]
+
+        pages: List[str] = []
+        parts = [head]
+        size = text_size(head)
+        for platform, text in texts.items():
+            for section in self._sections(platform, text, self.limit - size):
+                section_size = text_size(section)
+                if size + section_size > self.limit:
+                    pages.append("".join(parts))
+                    parts, size = [], 0
+                parts.append(section)
+                size += section_size
+        pages.append("".join(parts))
+        return pages
+
+    def render_single(self, post_data: Dict, prefix: str = "") -> str:
+        """Превью в одном сообщении: не поместившиеся тексты свёрнуты до начала"""
+        head = prefix + self.header(post_data)
+        texts = {platform: html.escape(content['text']) for platform, content in post_data['platforms'].items()}
+        page = self._single_page(head, texts)
+        if page is not None:
+            return page
+
+        titles = {platform: section_title(platform) for platform in texts}
+        # Каждая секция — заголовок, текст и "\n\n"
+        budget = self.limit - text_size(head) - sum(text_size(title) + 2 for title in titles.values())
+        sizes = {platform: text_size(text) for platform, text in texts.items()}
+        shares = self._shares(sizes, budget)
+
+        parts = [head]
+        for platform, text in texts.items():
+            if sizes[platform] > shares[platform]:
+                text = clip_escaped(text, max(0, shares[platform] - len(ELLIPSIS))).rstrip() + ELLIPSIS
+            parts.extend((titles[platform], text, "\n\n"))
+        return "".join(parts)
+
+    def _single_page(self, head: str, texts: Dict[str, str]) -> Optional[str]:
+        """Всё превью одним сообщением, если оно влезает в лимит, иначе None"""
+        parts = [head]
+        for platform, text in texts.items():
+            parts.extend((section_title(platform), text, "\n\n"))
+        page = "".join(parts)
+        # В UTF-16 символ занимает не больше двух: короткое превью можно не мерить
+        if len(page) * 2 <= self.limit or text_size(page) <= self.limit:
+            return page
+        return None
+
+    def _sections(self, platform: str, text: str, free: int) -> List[str]:
+        """Секция платформы целиком или, если она сама длиннее лимита, её части по строкам.
+
+        Первая часть занимает free — место, оставшееся в текущем сообщении, если его не слишком мало.
+        """
+        section = section_title(platform) + text + "\n\n"
+        if text_size(section) <= self.limit:
+            return [section]
+
+        room = self.limit - text_size(section_title(platform, True)) - 2
+        first_room = free - text_size(section_title(platform)) - 2
+        if first_room < self.limit // 4:
+            first_room = room
+        lines = []
+        for line in text.split("\n"):
+            # Строку длиннее целого сообщения приходится резать посередине
+            while text_size(line) > room:
+                piece = clip_escaped(line, room) or line[:room // 2]
+                lines.append(piece)
+                line = line[len(piece):]
+            lines.append(line)
+
+        chunks, current, size = [], [], -1
+        for line in lines:
+            line_size = text_size(line)
+            if current and size + 1 + line_size > (room if chunks else first_room):
+                chunks.append("\n".join(current))
+                current, size = [], -1
+            current.append(line)
+            size += 1 + line_size
+        chunks.append("\n".join(current))
+        return [section_title(platform, index > 0) + chunk + "\n\n" for index, chunk in enumerate(chunks)]
+
+    @staticmethod
+    def _shares(sizes: Dict[str, int], budget: int) -> Dict[str, int]:
+        """Поровну делим место между текстами; короткие берут сколько нужно, остаток — длинным"""
+        shares = {}
+        remaining = dict(sizes)
+        while remaining:
+            fair = max(0, budget) // len(remaining)
+            fitting = {platform: size for platform, size in remaining.items() if size <= fair}
+            if not fitting:
+                shares.update({platform: fair for platform in remaining})
+                break
+            for platform, size in fitting.items():
+                shares[platform] = size
+                budget -= size
+                del remaining[platform]
+        return shares
@@ -0,0 +1,178 @@
+import hashlib
+import json
+import logging
+import os
+import string
+import time
+from typing import Dict, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# Реестр по умолчанию лежит рядом с ботом
+DEFAULT_PROMPTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts.json")
+
+# Поля, которые можно использовать в каждом шаблоне; шаблон с другим полем не загрузится
+TEMPLATE_FIELDS = {
+    "post": {"topic", "niche", "platform"},
+    "instructions": {"instructions"},
+    "current_text": {"current_text"},
+    "batch": {"topic", "niche", "platforms"},
+    "image": {"keywords", "niche"},
+    "image_instructions": {"instructions"},
+}
+
+
+class PromptError(ValueError):
+    """Файл промптов не удалось загрузить"""
+
+
+class PromptTemplate:
+    """Шаблон с полями {поле}, разобранный один раз при загрузке реестра"""
+
+    def __init__(self, name: str, text: str, fields: set):
+        self.name = name
+        self._parts = []  # (текст, поле или None)
+        try:
+            parsed = list(string.Formatter().parse(text))
+        except ValueError as e:
+            raise PromptError(f"Шаблон {name}: {e}")
+        for literal, field, spec, conversion in parsed:
+            if field is not None and (field not in fields or spec or conversion):
+                raise PromptError(f"Шаблон {name}: неизвестное поле {{{field}}}, допустимы: {', '.join(sorted(fields))}")
+            self._parts.append((literal, field))
+
+    def render(self, **values) -> str:
+        return "".join(literal + (str(values[field]) if field is not None else "") for literal, field in self._parts)
+
+
+class Niche:
+    """Ниша: name — название, которым ниша обозначается в черновиках и маршрутах, key — в кнопках.
+
+    aliases — другие написания ниши в файлах пакетов, replies — ключевые слова и шаблоны автоответов
+    ниши ({"keywords": {намерение: [...]}, "templates": {намерение: [...]}}), дополняющие общие.
+    """
+
+    def __init__(self, key: str, name: str, title: str, description: str = "", examples: Optional[List[str]] = None,
+                 guide: str = "", aliases: Optional[List[str]] = None, replies: Optional[Dict] = None):
+        self.key = key
+        self.name = name
+        self.title = title
+        self.description = description
+        self.examples = examples or []
+        self.guide = guide
+        self.aliases = aliases or []
+        self.replies = replies or {}
+
+
+def _text(value: Union[str, List[str]]) -> str:
+    """Длинные тексты в файле можно писать списком строк"""
+    return "\n".join(value) if isinstance(value, list) else value
+
+
+class Prompts:
+    """Загруженная версия реестра: ниши, системный промпт и шаблоны. Не меняется после создания.
+
+    Системный промпт полностью статический: правила всех платформ и ниш собраны в нём заранее,
+    а тема, ниша и платформа идут в сообщении пользователя. Поэтому у всех запросов на генерацию
+    одинаковое начало, и OpenAI берёт его из своего кэша промптов (для промптов от 1024 токенов).
+    """
+
+    def __init__(self, data: Dict, version: str):
+        self.version = version
+        try:
+            self.platforms: Dict[str, str] = {key: _text(value) for key, value in data["platforms"].items()}
+            self.niches: Dict[str, Niche] = {
+                key: Niche(key, **niche) for key, niche in data["niches"].items()
+            }
+            templates = data["templates"]
+            system = _text(data["system"])
+        except (KeyError, TypeError, AttributeError) as e:
+            raise PromptError(f"Неверная структура файла промптов: {e!r}")
+        if not self.niches:
+            raise PromptError("В файле промптов нет ни одной ниши")
+
+        missing = set(TEMPLATE_FIELDS) - set(templates)
+        if missing:
+            raise PromptError(f"В файле промптов нет шаблонов: {', '.join(sorted(missing))}")
+        self.templates = {
+            name: PromptTemplate(name, _text(templates[name]), fields) for name, fields in TEMPLATE_FIELDS.items()
+        }
+        self._by_name = {niche.name: niche for niche in self.niches.values()}
+        # Как ниша может быть записана в файле пакета: ключ, название или псевдоним в любом регистре
+        self.niche_aliases: Dict[str, str] = {
+            alias.lower(): niche.name
+            for niche in self.niches.values() for alias in (niche.key, niche.name, *niche.aliases)
+        }
+        try:
+            self.reply_keywords: Dict[str, Dict] = {
+                niche.name: niche.replies["keywords"] for niche in self.niches.values() if "keywords" in niche.replies
+            }
+            self.reply_templates: Dict[str, Dict] = {
+                niche.name: niche.replies["templates"] for niche in self.niches.values() if "templates" in niche.replies
+            }
+        except TypeError as e:
+            raise PromptError(f"Неверная структура автоответов ниши: {e!r}")
+
+        self.system = PromptTemplate("system", system, {"platform_guides", "niche_guides"}).render(
+            platform_guides="\n".join(f"- {guide}" for guide in self.platforms.values()),
+            niche_guides="\n".join(f"- {niche.guide}" for niche in self.niches.values() if niche.guide)
+        )
+
+    def niche(self, key: str) -> Optional[Niche]:
+        return self.niches.get(key)
+
+    def niche_by_name(self, name: str) -> Optional[Niche]:
+        return self._by_name.get(name)
+
+    def render(self, name: str, **values) -> str:
+        return self.templates[name].render(**values)
+
+
+class PromptRegistry:
+    """Реестр промптов и ниш из JSON-файла с перезагрузкой без перезапуска бота.
+
+    Не чаще раза в check_interval секунд проверяется время изменения файла; изменённый файл
+    загружается заново, а если в нём ошибка, остаётся предыдущая версия. Версия — хэш файла:
+    она входит в ключи кэша, поэтому правка промптов сбрасывает кэш текстов.
+    """
+
+    def __init__(self, path: str = DEFAULT_PROMPTS_FILE, check_interval: float = 5.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._stamp = None
+        self._checked = time.monotonic()
+        self._prompts = self._load()
+
+    def _load(self) -> Prompts:
+        stat = os.stat(self.path)
+        with open(self.path, "rb") as f:
+            raw = f.read()
+        # Файл с ошибкой тоже запоминается: пока его не исправят, он не перечитывается
+        self._stamp = (stat.st_mtime_ns, stat.st_size)
+        try:
+            data = json.loads(raw.decode("utf-8"))
+        except ValueError as e:
+            raise PromptError(f"Файл промптов {self.path} — не JSON: {e}")
+        return Prompts(data, hashlib.sha256(raw).hexdigest()[:12])
+
+    def current(self) -> Prompts:
+        now = time.monotonic()
+        if now - self._checked >= self.check_interval:
+            self._checked = now
+            self.reload()
+        return self._prompts
+
+    def reload(self, force: bool = False) -> bool:
+        """Перечитать файл, если он изменился; True — загружена новая версия"""
+        try:
+            stat = os.stat(self.path)
+            if not force and (stat.st_mtime_ns, stat.st_size) == self._stamp:
+                return False
+            prompts = self._load()
+        except (OSError, PromptError) as e:
+            logger.error(f"Не удалось перезагрузить промпты из {self.path}, остаётся версия {self._prompts.version}: {e}")
+            return False
+        if prompts.version != self._prompts.version:
+            logger.info(f"Промпты перезагружены: версия {prompts.version}")
+        self._prompts = prompts
+        return True
@@ -0,0 +1,316 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from typing import Callable, Dict, List, Optional
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+
+class PublishError(Exception):
+    """Платформа отказала в публикации"""
+
+
+class PublishResult:
+    """Итог публикации на одной платформе"""
+
+    def __init__(self, platform: str, ok: bool, external_id: Optional[str] = None, url: Optional[str] = None,
+                 error: Optional[str] = None, duplicate: bool = False):
+        self.platform = platform
+        self.ok = ok
+        self.external_id = external_id
+        self.url = url
+        self.error = error
+        # True — пост уже был опубликован раньше, повторно не отправляли
+        self.duplicate = duplicate
+
+    def __repr__(self):
+        return f"PublishResult({self.platform!r}, ok={self.ok}, external_id={self.external_id!r}, error={self.error!r})"
+
+
+class PlatformAdapter:
+    """Публикация поста на одной платформе"""
+
+    name = ""
+
+    async def publish(self, post_data: Dict, idempotency_key: str) -> PublishResult:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class TelegramChannelAdapter(PlatformAdapter):
+    """Публикация в Telegram-канал от имени бота (бот должен быть админом канала)"""
+
+    name = "telegram"
+
+    # Ограничение Telegram на длину подписи к фото
+    CAPTION_LIMIT = 1024
+
+    def __init__(self, bot, channel_id: str, images=None):
+        self.bot = bot
+        self.channel_id = channel_id
+        self.images = images
+
+    async def publish(self, post_data: Dict, idempotency_key: str) -> PublishResult:
+        text = post_data['platforms'][self.name]['text']
+        # Вариант, кадрированный под Telegram, а если его нет — исходная картинка
+        digest = (post_data.get('image_variants') or {}).get(self.name) or post_data.get('image_hash')
+        photo = self.images.photo(digest) if self.images else None
+        photo = photo or post_data.get('image_url')
+
+        if photo and len(text) <= self.CAPTION_LIMIT:
+            message = await self.bot.send_photo(chat_id=self.channel_id, photo=photo, caption=text)
+        else:
+            if photo:
+                await self.bot.send_photo(chat_id=self.channel_id, photo=photo)
+            message = await self.bot.send_message(chat_id=self.channel_id, text=text)
+
+        url = None
+        if message.chat.username:
+            url = f"https://t.me/{message.chat.username}/{message.message_id}"
+        return PublishResult(self.name, True, external_id=str(message.message_id), url=url)
+
+
+class HTTPPlatformAdapter(PlatformAdapter):
+    """Основа для платформ с HTTP API: общая сессия, заголовок Idempotency-Key, разбор ошибок"""
+
+    def __init__(self, base_url: str, session_factory: Callable[[], aiohttp.ClientSession]):
+        self.base_url = base_url.rstrip("/")
+        self._session_factory = session_factory
+
+    async def request(self, method: str, path: str, idempotency_key: str, **kwargs) -> Dict:
+        headers = kwargs.pop("headers", {})
+        headers["Idempotency-Key"] = idempotency_key
+        session = self._session_factory()
+        async with session.request(method, f"{self.base_url}{path}", headers=headers, **kwargs) as response:
+            try:
+                data = await response.json(content_type=None)
+            except (ValueError, aiohttp.ContentTypeError):
+                data = {}
+            if response.status >= 400:
+                raise PublishError(f"HTTP {response.status}: {json.dumps(data, ensure_ascii=False)[:200]}")
+            return data or {}
+
+
+class VKAdapter(HTTPPlatformAdapter):
+    """Публикация на стену сообщества ВКонтакте (wall.post)"""
+
+    name = "vk"
+
+    def __init__(self, token: str, group_id: str, session_factory, base_url: str = "https://api.vk.com/method",
+                 api_version: str = "5.199"):
+        super().__init__(base_url, session_factory)
+        self.token = token
+        self.group_id = group_id.lstrip("-")
+        self.api_version = api_version
+
+    async def publish(self, post_data: Dict, idempotency_key: str) -> PublishResult:
+        data = await self.request("POST", "/wall.post", idempotency_key, data={
+            "owner_id": f"-{self.group_id}",
+            "from_group": 1,
+            "message": post_data['platforms'][self.name]['text'],
+            # VK сам отбрасывает повторы с тем же guid
+            "guid": idempotency_key,
+            "access_token": self.token,
+            "v": self.api_version,
+        })
+        if "error" in data:
+            raise PublishError(data["error"].get("error_msg", "ошибка VK API"))
+
+        post_id = str(data["response"]["post_id"])
+        return PublishResult(self.name, True, external_id=post_id,
+                             url=f"https://vk.com/wall-{self.group_id}_{post_id}")
+
+
+class InstagramAdapter(HTTPPlatformAdapter):
+    """Публикация в Instagram через Graph API: контейнер с фото, затем media_publish"""
+
+    name = "instagram"
+
+    def __init__(self, token: str, user_id: str, session_factory,
+                 base_url: str = "https://graph.facebook.com/v19.0"):
+        super().__init__(base_url, session_factory)
+        self.token = token
+        self.user_id = user_id
+
+    async def publish(self, post_data: Dict, idempotency_key: str) -> PublishResult:
+        # Graph API сам скачивает фото по ссылке: нужна постоянная публичная ссылка, а не временная от DALL-E
+        if not post_data.get('public_image_url'):
+            raise PublishError("Instagram требует фото по публичной ссылке")
+
+        container = await self.request("POST", f"/{self.user_id}/media", idempotency_key, data={
+            "image_url": post_data['public_image_url'],
+            "caption": post_data['platforms'][self.name]['text'],
+            "access_token": self.token,
+        })
+        published = await self.request("POST", f"/{self.user_id}/media_publish", idempotency_key, data={
+            "creation_id": container["id"],
+            "access_token": self.token,
+        })
+        return PublishResult(self.name, True, external_id=str(published["id"]))
+
+
+class TikTokAdapter(HTTPPlatformAdapter):
+    """Публикация фото-поста в TikTok (Content Posting API, PULL_FROM_URL)"""
+
+    name = "tiktok"
+
+    def __init__(self, token: str, session_factory, base_url: str = "https://open.tiktokapis.com/v2"):
+        super().__init__(base_url, session_factory)
+        self.token = token
+
+    async def publish(self, post_data: Dict, idempotency_key: str) -> PublishResult:
+        if not post_data.get('public_image_url'):
+            raise PublishError("TikTok требует фото по публичной ссылке")
+
+        data = await self.request(
+            "POST", "/post/publish/content/init/", idempotency_key,
+            headers={"Authorization": f"Bearer {self.token}"},
+            json={
+                "post_info": {
+                    "title": post_data['topic'][:90],
+                    "description": post_data['platforms'][self.name]['text'],
+                },
+                "source_info": {"source": "PULL_FROM_URL", "photo_images": [post_data['public_image_url']]},
+                "post_mode": "DIRECT_POST",
+                "media_type": "PHOTO",
+            }
+        )
+        error = data.get("error") or {}
+        if error.get("code") not in (None, "ok"):
+            raise PublishError(error.get("message") or error["code"])
+        return PublishResult(self.name, True, external_id=str(data["data"]["publish_id"]))
+
+
+class Publisher:
+    """Параллельная публикация поста на все подключённые платформы.
+
+    Успешные публикации запоминаются по (post_id, платформа): повторный вызов для того же поста
+    не публикует дважды, а повторяет только платформы, где была ошибка.
+
+    image_resolver(post_data, платформа) возвращает постоянную публичную ссылку на фото поста
+    для платформ, которые скачивают его сами (Instagram, TikTok); адаптер получает её в
+    post_data['public_image_url'].
+    """
+
+    def __init__(self, db_path: Optional[str] = None, timeout: float = 60.0,
+                 image_resolver: Optional[Callable[[Dict, str], Optional[str]]] = None):
+        self.adapters: Dict[str, PlatformAdapter] = {}
+        self.timeout = timeout
+        self.image_resolver = image_resolver
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._published: Dict[str, PublishResult] = {}  # idempotency_key: успешный результат
+        self._in_progress: Dict[str, asyncio.Future] = {}
+        self._db = None
+
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS publications ("
+                "key TEXT PRIMARY KEY, platform TEXT NOT NULL, external_id TEXT, url TEXT, published_at REAL NOT NULL)"
+            )
+            self._db.commit()
+            for key, platform, external_id, url in self._db.execute(
+                "SELECT key, platform, external_id, url FROM publications"
+            ):
+                self._published[key] = PublishResult(platform, True, external_id=external_id, url=url)
+
+    def session(self) -> aiohttp.ClientSession:
+        """Общая HTTP-сессия для всех адаптеров"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    def add_adapter(self, adapter: PlatformAdapter):
+        self.adapters[adapter.name] = adapter
+
+    def platforms(self, post_data: Dict) -> List[str]:
+        """Платформы поста, для которых подключён адаптер (на остальные пост не публикуется)"""
+        return [platform for platform in post_data['platforms'] if platform in self.adapters]
+
+    async def publish(self, post_data: Dict, on_progress=None) -> Dict[str, PublishResult]:
+        """Публикация на подключённые платформы поста; on_progress(результат) вызывается по мере готовности"""
+
+        async def run(platform: str) -> PublishResult:
+            result = await self._publish_once(platform, post_data)
+            if on_progress is not None:
+                on_progress(result)
+            return result
+
+        platforms = self.platforms(post_data)
+        results = await asyncio.gather(*[run(platform) for platform in platforms])
+        return dict(zip(platforms, results))
+
+    async def _publish_once(self, platform: str, post_data: Dict) -> PublishResult:
+        key = f"{post_data['id']}:{platform}"
+
+        published = self._published.get(key) or self._lookup(key)
+        if published is not None:
+            return PublishResult(platform, True, external_id=published.external_id, url=published.url,
+                                 duplicate=True)
+
+        # Двойное нажатие: второй вызов ждёт результат первого, а не публикует ещё раз
+        if key in self._in_progress:
+            return await asyncio.shield(self._in_progress[key])
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_progress[key] = future
+        try:
+            result = await self._call_adapter(platform, post_data, key)
+            if result.ok:
+                self._remember(key, result)
+            future.set_result(result)
+            return result
+        finally:
+            if not future.done():
+                future.cancel()
+            del self._in_progress[key]
+
+    async def _call_adapter(self, platform: str, post_data: Dict, key: str) -> PublishResult:
+        adapter = self.adapters.get(platform)
+        if adapter is None:
+            return PublishResult(platform, False, error="платформа не подключена")
+
+        try:
+            if self.image_resolver is not None:
+                post_data = dict(post_data, public_image_url=self.image_resolver(post_data, platform))
+            return await asyncio.wait_for(adapter.publish(post_data, key), self.timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Таймаут публикации в {platform}")
+            return PublishResult(platform, False, error="таймаут")
+        except Exception as e:
+            logger.error(f"Ошибка публикации в {platform}: {e}")
+            return PublishResult(platform, False, error=str(e)[:200])
+
+    def _lookup(self, key: str) -> Optional[PublishResult]:
+        """Успешная публикация из журнала: её мог сделать другой процесс с тем же файлом"""
+        if self._db is None:
+            return None
+        row = self._db.execute(
+            "SELECT platform, external_id, url FROM publications WHERE key = ?", (key,)
+        ).fetchone()
+        if not row:
+            return None
+        self._published[key] = PublishResult(row[0], True, external_id=row[1], url=row[2])
+        return self._published[key]
+
+    def _remember(self, key: str, result: PublishResult):
+        self._published[key] = result
+        if self._db is not None:
+            self._db.execute(
+                "INSERT OR REPLACE INTO publications (key, platform, external_id, url, published_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, result.platform, result.external_id, result.url, time.time())
+            )
+            self._db.commit()
+
+    async def close(self):
+        for adapter in self.adapters.values():
+            await adapter.close()
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
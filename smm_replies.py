@@ -0,0 +1,311 @@
+import asyncio
+import json
+import logging
+import re
+import zlib
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Намерения в порядке приоритета: в комментарии «сколько стоит и где посмотреть» важнее запись на просмотр
+INTENTS = ["order", "price", "specs", "compliment"]
+
+# Ключевые слова намерений: основы слов, совпадение ищется с начала слова нормализованного комментария.
+# Многозначные основы («цен» — оценка, «стоит» — не стоит, «класс» — класс авто) заменены однозначными словами.
+# Здесь общие для всех ниш; свои слова ниши добавляются из реестра ниш (replies в prompts.json)
+KEYWORDS = {
+    None: {
+        "price": ["цена", "цену", "цены", "ценник", "сколько стоит", "стоимост", "почем", "сколько будет", "прайс",
+                  "бюджет", "рассрочк", "кредит"],
+        "specs": ["характеристик", "параметр", "подробнее", "какой размер", "комплектац"],
+        "order": ["заказ", "купить", "куплю", "забронир", "записат", "запись", "как связаться", "контакт",
+                  "где посмотреть", "можно посмотреть", "адрес", "в наличии"],
+        "compliment": ["красив", "классн", "шикарн", "супер", "огонь", "круто", "восторг", "мечта", "лучший",
+                       "нравится", "👍", "🔥", "😍", "❤"],
+    },
+}
+
+# Шаблоны ответов: {topic} — тема поста. Здесь общие; для ниши без своего шаблона в реестре берётся общий
+TEMPLATES = {
+    None: {
+        "price": ["Спасибо за интерес! Актуальную стоимость и условия отправим в личные сообщения 💬",
+                  "Цена зависит от условий — напишите нам в личные сообщения, всё рассчитаем 👌"],
+        "specs": ["Подробные характеристики пришлём в личные сообщения — напишите нам 📩",
+                  "Хороший вопрос! Все детали расскажем в личных сообщениях 😊"],
+        "order": ["Будем рады помочь! Напишите нам в личные сообщения, и мы всё организуем 🤝",
+                  "Оставьте заявку в личных сообщениях — свяжемся в течение часа ⏱"],
+        "compliment": ["Спасибо! Очень приятно 😊", "Спасибо за тёплые слова! ❤️", "Рады, что вам понравилось! 🔥"],
+    },
+}
+
+# Отрицание или недовольство меняет смысл ключевых слов («не нравится», «не лучший»): такие
+# комментарии шаблоном не отвечаются, их разбирает GPT
+NEGATIONS = ["не", "нет", "ни", "нельзя"]
+NEGATIVE = ["плох", "ужас", "кошмар", "отстой", "отврат", "разочаров", "хуже", "худш", "обман", "развод",
+            "жалоб", "верните", "👎", "😡", "🤬", "🤮"]
+
+# Комментарии, на которые не отвечаем вовсе: пустые, только ссылки или символы
+_NO_LETTERS = re.compile(r"^[\W\d_]*$")
+_URL = re.compile(r"https?://\S+")
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.lower().replace("ё", "е").split())
+
+
+def trie_pattern(words: Sequence[str]) -> str:
+    """Регулярное выражение в виде префиксного дерева: общие начала слов проверяются один раз"""
+    trie: Dict = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: Dict) -> str:
+        ends = "" in node
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        if len(branches) == 1 and not ends:
+            return branches[0]
+        body = "(?:" + "|".join(branches) + ")"
+        # Конец слова здесь — остальное необязательно; жадный ? выбирает самое длинное совпадение
+        return body + "?" if ends else body
+
+    return build(trie)
+
+
+def word_start_pattern(words: Sequence[str]) -> str:
+    """Выражение для слов и основ, совпадающих только с начала слова (сцена — не «цен»)"""
+    return r"(?<!\w)(?:" + trie_pattern(words) + ")"
+
+
+class KeywordMatcher:
+    """Поиск намерения в тексте одним скомпилированным выражением по всем ключевым словам.
+
+    Слова отрицания и недовольства входят в то же выражение: текст с ними намерения не получает.
+    """
+
+    def __init__(self, keywords: Dict[str, Sequence[str]]):
+        self._intents: Dict[str, str] = {}  # ключевое слово: намерение
+        for intent, words in keywords.items():
+            for word in words:
+                self._intents.setdefault(normalize(word), intent)
+        self._priority = {intent: index for index, intent in enumerate(INTENTS)}
+        self._negative = set(NEGATIONS) | set(NEGATIVE)
+        words = sorted(set(self._intents) | self._negative)
+        self._pattern = re.compile(word_start_pattern(words)) if self._intents else None
+
+    def match(self, text: str) -> Optional[str]:
+        """Самое приоритетное намерение в нормализованном тексте или None (и при отрицании в тексте)"""
+        if self._pattern is None:
+            return None
+        best = None
+        for found in self._pattern.finditer(text):
+            word = found.group(0)
+            if word in self._negative:
+                # Отрицание — только отдельным словом: «не», но не «недвижимость»
+                if word not in NEGATIONS or not text[found.end():found.end() + 1].isalnum():
+                    return None
+                continue
+            intent = self._intents.get(word)
+            if intent is None:
+                continue
+            if best is None or self._priority.get(intent, len(INTENTS)) < self._priority.get(best, len(INTENTS)):
+                best = intent
+        return best
+
+
+class Comment:
+    """Комментарий к посту"""
+
+    def __init__(self, comment_id: str, text: str, niche: Optional[str] = None, topic: str = ""):
+        self.id = comment_id
+        self.text = text
+        self.niche = niche
+        self.topic = topic
+
+
+class Reply:
+    """Ответ на комментарий: source — template (шаблон) или ai (GPT)"""
+
+    def __init__(self, comment: Comment, text: str, source: str, intent: Optional[str] = None):
+        self.comment = comment
+        self.text = text
+        self.source = source
+        self.intent = intent
+
+
+# Запрос к GPT за ответами на пачку комментариев: [комментарии] -> {id: ответ}
+BatchResponder = Callable[[List[Comment]], Awaitable[Dict[str, str]]]
+
+
+class AutoReplyEngine:
+    """Автоответы на комментарии: шаблоны для типовых вопросов, GPT — для остальных.
+
+    Типовые комментарии (цена, характеристики, запись, комплименты) распознаются по ключевым словам
+    ниши и получают ответ из шаблона сразу, без сети. Остальные копятся и уходят в GPT пачками
+    до batch_size комментариев или через max_delay секунд после первого.
+    """
+
+    def __init__(self, responder: Optional[BatchResponder] = None, batch_size: int = 20, max_delay: float = 2.0,
+                 keywords: Dict = KEYWORDS, templates: Dict = TEMPLATES):
+        self.responder = responder
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.version: Optional[str] = None
+        self.configure(keywords, templates)
+        self._pending: List[Tuple[Comment, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._batches = set()
+
+    def configure(self, keywords: Dict, templates: Dict, version: Optional[str] = None):
+        """Ключевые слова и шаблоны по нишам; без общих (ключ None) берутся KEYWORDS и TEMPLATES.
+
+        version — версия реестра ниш, из которого они взяты: по ней видно, что реестр изменился.
+        """
+        keywords = {None: KEYWORDS[None], **keywords}
+        self.templates = {None: TEMPLATES[None], **templates}
+        self._matchers = {
+            niche: KeywordMatcher(self._merge(keywords, niche))
+            for niche in keywords
+        }
+        self.version = version
+
+    @staticmethod
+    def _merge(keywords: Dict, niche: Optional[str]) -> Dict[str, List[str]]:
+        merged = {intent: list(words) for intent, words in keywords[None].items()}
+        if niche is not None:
+            for intent, words in keywords[niche].items():
+                merged.setdefault(intent, []).extend(words)
+        else:
+            # Ниша неизвестна: ищем ключевые слова всех ниш
+            for niche_keywords in keywords.values():
+                for intent, words in niche_keywords.items():
+                    merged.setdefault(intent, []).extend(words)
+        return merged
+
+    def match(self, comment: Comment) -> Optional[Reply]:
+        """Ответ по шаблону, если комментарий типовой (без обращения к сети)"""
+        text = normalize(comment.text)
+        matcher = self._matchers.get(comment.niche) or self._matchers[None]
+        intent = matcher.match(text)
+        if intent is None:
+            return None
+        # Шаблоны ниши упоминают тему поста, поэтому без темы берутся общие
+        options = None
+        if comment.topic:
+            options = (self.templates.get(comment.niche) or {}).get(intent)
+        options = options or self.templates[None][intent]
+        # Один и тот же комментарий всегда получает один и тот же вариант, разные — разные
+        template = options[zlib.crc32(comment.id.encode()) % len(options)]
+        return Reply(comment, template.format(topic=comment.topic), "template", intent)
+
+    @staticmethod
+    def needs_reply(comment: Comment) -> bool:
+        return not _NO_LETTERS.match(_URL.sub("", comment.text))
+
+    async def reply(self, comment: Comment) -> Optional[Reply]:
+        """Ответ на комментарий; None — отвечать не нужно или GPT не справился"""
+        if not self.needs_reply(comment):
+            return None
+        reply = self.match(comment)
+        if reply is not None or self.responder is None:
+            return reply
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((comment, future))
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_delay, self._flush)
+        return await future
+
+    async def reply_many(self, comments: Sequence[Comment]) -> List[Optional[Reply]]:
+        return await asyncio.gather(*[self.reply(comment) for comment in comments])
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._answer(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _answer(self, batch: List[Tuple[Comment, asyncio.Future]]):
+        try:
+            answers = await self.responder([comment for comment, _ in batch])
+        except Exception as e:
+            logger.error(f"Ошибка AI-ответа на комментарии ({len(batch)} шт.): {e}")
+            answers = {}
+        for comment, future in batch:
+            if future.done():
+                continue
+            text = answers.get(comment.id)
+            future.set_result(Reply(comment, text, "ai") if text else None)
+
+    async def close(self):
+        self._flush()
+        if self._batches:
+            await asyncio.gather(*self._batches, return_exceptions=True)
+
+
+def build_reply_request(comments: List[Comment], model: str) -> Dict:
+    """Один запрос к GPT на пачку комментариев; ответ — JSON {"replies": {"номер": "ответ"}}"""
+    lines = []
+    for number, comment in enumerate(comments, 1):
+        context = f" [пост: {comment.topic}]" if comment.topic else ""
+        lines.append(f"{number}.{context} {comment.text}")
+    return dict(
+        model=model,
+        messages=[
+            {"role": "system", "content": (
+                "Ты SMM-менеджер и отвечаешь на комментарии подписчиков под постами. "
+                "Отвечай коротко (1-2 предложения), дружелюбно, по-русски, с одним эмодзи. "
+                "На оскорбления и спам отвечай пустой строкой. "
+                'Верни JSON вида {"replies": {"номер комментария": "ответ"}}.'
+            )},
+            {"role": "user", "content": "Комментарии:\n" + "\n".join(lines)},
+        ],
+        response_format={"type": "json_object"},
+        temperature=0.7,
+        max_tokens=80 * len(comments)
+    )
+
+
+def parse_replies(content: Optional[str], comments: List[Comment]) -> Dict[str, str]:
+    """Ответы из JSON модели по id комментариев; битые и пустые пропускаются"""
+    try:
+        replies = json.loads(content or "").get("replies", {})
+    except (json.JSONDecodeError, AttributeError):
+        logger.error("GPT вернул ответы на комментарии не в формате JSON")
+        return {}
+    if not isinstance(replies, dict):
+        return {}
+    result = {}
+    for number, comment in enumerate(comments, 1):
+        text = replies.get(str(number))
+        if isinstance(text, str) and text.strip():
+            result[comment.id] = text.strip()
+    return result
+
+
+class PostRegistry:
+    """Какой пост в канале к какой нише и теме относится (для ответов на комментарии под ним)"""
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._posts: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()  # id сообщения: (ниша, тема)
+
+    def remember(self, message_id: str, niche: str, topic: str):
+        self._posts[str(message_id)] = (niche, topic)
+        self._posts.move_to_end(str(message_id))
+        while len(self._posts) > self.max_size:
+            self._posts.popitem(last=False)
+
+    def get(self, message_id) -> Tuple[Optional[str], str]:
+        return self._posts.get(str(message_id), (None, ""))
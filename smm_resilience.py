@@ -0,0 +1,135 @@
+import asyncio
+import contextvars
+import logging
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Optional
+
+import openai
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, после которых есть смысл повторить запрос
+RETRYABLE_ERRORS = (
+    asyncio.TimeoutError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+# Абсолютный момент (time.monotonic), к которому должна закончиться генерация поста
+_deadline: contextvars.ContextVar = contextvars.ContextVar("smm_generation_deadline", default=None)
+
+
+class RetryPolicy:
+    """Параметры повторов: число попыток, таймаут одной попытки и экспоненциальная пауза"""
+
+    def __init__(self, attempts: int = 3, timeout: float = 30.0, base_delay: float = 0.5, max_delay: float = 8.0):
+        self.attempts = attempts
+        self.timeout = timeout
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt: int) -> float:
+        """Пауза перед повтором: экспонента с полным джиттером"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class LatencyTracker:
+    """Скользящее окно длительностей успешных запросов"""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """q-й перцентиль (0..1) или None, пока данных мало"""
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+@contextmanager
+def generation_deadline(seconds: Optional[float]):
+    """Общий дедлайн для всех запросов к AI внутри блока (включая дочерние задачи)"""
+    if not seconds:
+        yield
+        return
+    token = _deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def time_left() -> Optional[float]:
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+async def call_with_retry(attempt, policy: RetryPolicy, hedge_after: Optional[float] = None):
+    """Запрос с повторами.
+
+    attempt(timeout) — корутинная функция одной попытки; timeout она применяет к самому запросу к API
+    (ожидание в очереди планировщика в него не входит, но ограничено общим дедлайном).
+    hedge_after — через сколько секунд без ответа запускать дублирующий запрос.
+    """
+    for number in range(policy.attempts):
+        left = time_left()
+        if left is not None and left <= 0:
+            raise asyncio.TimeoutError("Истёк общий дедлайн генерации")
+        timeout = policy.timeout if left is None else min(policy.timeout, left)
+
+        try:
+            call = hedged(attempt, timeout, hedge_after) if hedge_after else attempt(timeout)
+            return await asyncio.wait_for(call, left)
+        except Exception as e:
+            if not is_retryable(e) or number == policy.attempts - 1:
+                raise
+            delay = policy.backoff(number)
+            left = time_left()
+            if left is not None and delay >= left:
+                raise
+            logger.warning(f"Попытка {number + 1} не удалась ({type(e).__name__}: {e}), повтор через {delay:.1f} с")
+            await asyncio.sleep(delay)
+
+
+async def hedged(attempt, timeout: float, hedge_after: float):
+    """Если первый запрос не ответил за hedge_after секунд, запускаем второй и берём первый ответ"""
+    first = asyncio.ensure_future(attempt(timeout))
+    tasks = {first}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+        if done:
+            return first.result()
+
+        logger.info(f"Нет ответа за {hedge_after:.1f} с, отправляем дублирующий запрос")
+        tasks.add(asyncio.ensure_future(attempt(timeout)))
+        error = None
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,183 @@
+import json
+import logging
+import time
+from collections import deque
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Маршруты по умолчанию: "default" ← "<платформа>" ← "<ниша>/<платформа>", более точный ключ
+# дополняет более общий. model — основная модель, fallbacks — запасные по порядку,
+# max_tokens — бюджет ответа (подпись в TikTok в разы короче лонгрида в Telegram).
+# Модели по умолчанию кэшируют промпты: длинный общий системный промпт (см. smm_prompts) оплачивается
+# со скидкой и не замедляет ответ. Модель без кэша промптов платит за него полностью в каждом запросе
+DEFAULT_ROUTES = {
+    "default": {"model": "gpt-4o-mini", "fallbacks": ["gpt-4.1-mini"], "max_tokens": 500},
+    "tiktok": {"max_tokens": 200},
+    "instagram": {"max_tokens": 400},
+    "vk": {"max_tokens": 450},
+    "telegram": {"max_tokens": 600},
+}
+
+
+class Route:
+    """Модели-кандидаты (основная первой) и бюджет токенов ответа"""
+
+    def __init__(self, models: List[str], max_tokens: int):
+        self.models = models
+        self.max_tokens = max_tokens
+
+    @property
+    def model(self) -> str:
+        return self.models[0]
+
+
+class ModelHealth:
+    """Исходы и длительности запросов к модели за последние window секунд (с бюджетом токенов запроса)"""
+
+    def __init__(self, window: float = 300.0):
+        self.window = window
+        self._samples = deque()  # (время, длительность, успех, max_tokens)
+
+    def record(self, seconds: float, ok: bool, max_tokens: Optional[int] = None):
+        self._samples.append((time.monotonic(), seconds, ok, max_tokens))
+        self._trim()
+
+    def _trim(self):
+        horizon = time.monotonic() - self.window
+        while self._samples and self._samples[0][0] < horizon:
+            self._samples.popleft()
+
+    def __len__(self):
+        self._trim()
+        return len(self._samples)
+
+    def error_rate(self) -> float:
+        self._trim()
+        if not self._samples:
+            return 0.0
+        return sum(1 for _, _, ok, _ in self._samples if not ok) / len(self._samples)
+
+    def budgets(self) -> List[int]:
+        """Бюджеты токенов успешных запросов за окно"""
+        self._trim()
+        return sorted({max_tokens for _, _, ok, max_tokens in self._samples if ok and max_tokens})
+
+    def successes(self, max_tokens: Optional[int] = None) -> List[float]:
+        """Длительности успешных запросов (только с бюджетом max_tokens, если он задан)"""
+        self._trim()
+        return [seconds for _, seconds, ok, budget in self._samples
+                if ok and (max_tokens is None or budget == max_tokens)]
+
+    def percentile(self, q: float, max_tokens: Optional[int] = None) -> Optional[float]:
+        """q-й перцентиль длительности успешных запросов (с бюджетом max_tokens) или None, если их нет"""
+        ordered = sorted(self.successes(max_tokens))
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class ModelRouter:
+    """Выбор модели и бюджета токенов по платформе и нише с переключением на запасные модели.
+
+    Модель считается деградировавшей, если за окно набралось не меньше min_samples запросов
+    и доля ошибок выше max_error_rate или p95 длительности выше SLO. Длительность зависит от
+    длины ответа, поэтому p95 считается отдельно по каждому бюджету токенов: latency_slo — для
+    ответов до slo_tokens токенов, для больших бюджетов (пакетный запрос на все платформы) SLO
+    растёт пропорционально. Тогда берётся следующая здоровая модель маршрута. Пока модель не используется, её старые замеры уходят
+    из окна, и она снова получает запросы — так проверяется, восстановилась ли она.
+    """
+
+    def __init__(self, routes: Optional[Dict] = None, latency_slo: float = 20.0, max_error_rate: float = 0.2,
+                 window: float = 300.0, min_samples: int = 10, slo_tokens: int = 600):
+        self.routes = routes or DEFAULT_ROUTES
+        self.latency_slo = latency_slo
+        self.slo_tokens = slo_tokens
+        self.max_error_rate = max_error_rate
+        self.window = window
+        self.min_samples = min_samples
+        self._health: Dict[str, ModelHealth] = {}
+
+    @staticmethod
+    def load(path: str) -> Dict:
+        """Маршруты из JSON-файла в формате DEFAULT_ROUTES; не указанное в файле берётся из DEFAULT_ROUTES"""
+        with open(path, encoding="utf-8") as f:
+            routes = json.load(f)
+        merged = {key: dict(value) for key, value in DEFAULT_ROUTES.items()}
+        for key, value in routes.items():
+            merged.setdefault(key, {}).update(value)
+        return merged
+
+    def route(self, platform: str, niche: Optional[str] = None) -> Route:
+        settings = dict(self.routes.get("default", {}))
+        settings.update(self.routes.get(platform, {}))
+        if niche:
+            settings.update(self.routes.get(f"{niche}/{platform}", {}))
+        models = [settings["model"]] + [model for model in settings.get("fallbacks", []) if model != settings["model"]]
+        return Route(models, int(settings["max_tokens"]))
+
+    def batch_route(self, platforms: Iterable[str], niche: Optional[str] = None) -> Route:
+        """Маршрут одного запроса на несколько платформ: модель самой требовательной платформы, сумма бюджетов"""
+        routes = [self.route(platform, niche) for platform in platforms]
+        widest = max(routes, key=lambda route: route.max_tokens)
+        return Route(widest.models, sum(route.max_tokens for route in routes))
+
+    def health(self, model: str) -> ModelHealth:
+        if model not in self._health:
+            self._health[model] = ModelHealth(self.window)
+        return self._health[model]
+
+    def record(self, model: str, seconds: float, ok: bool, max_tokens: Optional[int] = None):
+        self.health(model).record(seconds, ok, max_tokens)
+
+    def slo(self, max_tokens: Optional[int] = None) -> float:
+        """Допустимый p95 длительности ответа с бюджетом max_tokens"""
+        if not max_tokens:
+            return self.latency_slo
+        return self.latency_slo * max(1.0, max_tokens / self.slo_tokens)
+
+    def slow(self, model: str, max_tokens: Optional[int] = None) -> bool:
+        """p95 ответов с бюджетом max_tokens выше SLO (без бюджета — хоть для одного из бюджетов окна)"""
+        health = self.health(model)
+        budgets = [max_tokens] if max_tokens else health.budgets()
+        for budget in budgets:
+            if len(health.successes(budget)) < self.min_samples:
+                continue
+            p95 = health.percentile(0.95, budget)
+            if p95 is not None and p95 > self.slo(budget):
+                return True
+        return False
+
+    def degraded(self, model: str, max_tokens: Optional[int] = None) -> bool:
+        health = self.health(model)
+        if len(health) < self.min_samples:
+            return False
+        if health.error_rate() > self.max_error_rate:
+            return True
+        return self.slow(model, max_tokens)
+
+    def choose(self, route: Route, exclude: Iterable[str] = ()) -> str:
+        """Первая здоровая для бюджета маршрута модель, кроме exclude (уже не ответивших на этот запрос).
+
+        Если деградировали все, берётся та, у которой меньше ошибок и быстрее ответы относительно SLO.
+        """
+        candidates = [model for model in route.models if model not in exclude] or route.models
+        for model in candidates:
+            if not self.degraded(model, route.max_tokens):
+                return model
+        return min(candidates, key=lambda model: (
+            self.health(model).error_rate(),
+            (self.health(model).percentile(0.95, route.max_tokens) or 0.0) / self.slo(route.max_tokens)
+        ))
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Состояние моделей: запросов за окно, доля ошибок, p95 и признак деградации"""
+        return {
+            model: {
+                "requests": len(health),
+                "error_rate": health.error_rate(),
+                "p95": health.percentile(0.95) or 0.0,
+                "degraded": float(self.degraded(model)),
+            }
+            for model, health in self._health.items()
+        }
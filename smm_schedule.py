@@ -0,0 +1,229 @@
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import socket
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Насколько вперёд можно запланировать публикацию
+MAX_SCHEDULE_AHEAD = timedelta(days=90)
+
+SCHEDULED_COLUMNS = "id, user_id, chat_id, publish_at, post, status, error, created_at"
+
+
+class ScheduledPost:
+    """Отложенная публикация"""
+
+    def __init__(self, post_id: str, user_id: int, chat_id: int, publish_at: float, post: Dict,
+                 status: str = "scheduled", error: Optional[str] = None, created_at: Optional[float] = None):
+        self.id = post_id
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.publish_at = publish_at
+        self.post = post
+        self.status = status
+        self.error = error
+        self.created_at = created_at or time.time()
+
+    @classmethod
+    def from_row(cls, row) -> "ScheduledPost":
+        post_id, user_id, chat_id, publish_at, post, status, error, created_at = row
+        return cls(post_id, user_id, chat_id, publish_at, json.loads(post), status, error, created_at)
+
+
+class PublicationScheduler:
+    """Календарь публикаций: куча по времени публикации в памяти, копия в SQLite.
+
+    Добавление и выдача очередной публикации — O(log n). Отменённые записи из кучи не удаляются,
+    а пропускаются при выдаче. Публикацию забирает атомарный UPDATE, поэтому она не уйдёт дважды,
+    даже если планировщик запущен в нескольких процессах с одной базой. Забравший публикацию
+    процесс записывается в worker: после перезапуска процесс снова отправляет только свои
+    прерванные публикации (Publisher пропустит платформы, где пост уже вышел), а чужие,
+    которые сейчас публикует другой процесс, не трогает.
+    """
+
+    def __init__(self, db_path: str = ":memory:", concurrency: int = 4, worker_name: str = "bot"):
+        self.concurrency = concurrency
+        # Имя постоянно между перезапусками: по нему находим свои прерванные публикации
+        self.worker_name = f"{socket.gethostname()}:{worker_name}"
+        self._handler: Optional[Callable[[ScheduledPost], Awaitable[bool]]] = None
+        self._heap: List[tuple] = []  # (время публикации, порядковый номер, id)
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._running = set()
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS scheduled ("
+            "id TEXT PRIMARY KEY, user_id INTEGER NOT NULL, chat_id INTEGER NOT NULL, publish_at REAL NOT NULL, "
+            "post TEXT NOT NULL, status TEXT NOT NULL, error TEXT, created_at REAL NOT NULL, worker TEXT)"
+        )
+        columns = [column[1] for column in self._db.execute("PRAGMA table_info(scheduled)")]
+        if "worker" not in columns:
+            self._db.execute("ALTER TABLE scheduled ADD COLUMN worker TEXT")
+        self._db.execute("CREATE INDEX IF NOT EXISTS scheduled_due ON scheduled (status, publish_at)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS scheduled_user ON scheduled (user_id, publish_at)")
+        self._db.commit()
+
+    def register(self, handler: Callable[[ScheduledPost], Awaitable[bool]]):
+        """Обработчик наступившей публикации; False — пост вышел не на всех платформах"""
+        self._handler = handler
+
+    def schedule(self, post: Dict, user_id: int, chat_id: int, publish_at: float) -> ScheduledPost:
+        """Запланировать публикацию черновика; повторное планирование того же поста переносит время"""
+        item = ScheduledPost(post['id'], user_id, chat_id, publish_at, post)
+        with self._db:
+            self._db.execute(
+                f"INSERT OR REPLACE INTO scheduled ({SCHEDULED_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (item.id, user_id, chat_id, publish_at, json.dumps(post, ensure_ascii=False), item.status,
+                 None, item.created_at)
+            )
+        self._push(item.id, publish_at)
+        return item
+
+    def cancel(self, post_id: str, user_id: int) -> bool:
+        """Отменить ещё не начавшуюся публикацию пользователя"""
+        with self._db:
+            updated = self._db.execute(
+                "UPDATE scheduled SET status = 'cancelled' WHERE id = ? AND user_id = ? AND status = 'scheduled'",
+                (post_id, user_id)
+            ).rowcount
+        return bool(updated)
+
+    def get(self, post_id: str) -> Optional[ScheduledPost]:
+        row = self._db.execute(f"SELECT {SCHEDULED_COLUMNS} FROM scheduled WHERE id = ?", (post_id,)).fetchone()
+        return ScheduledPost.from_row(row) if row else None
+
+    def upcoming(self, user_id: int, limit: int = 10) -> List[ScheduledPost]:
+        """Ближайшие запланированные публикации пользователя"""
+        rows = self._db.execute(
+            f"SELECT {SCHEDULED_COLUMNS} FROM scheduled WHERE user_id = ? AND status = 'scheduled' "
+            f"ORDER BY publish_at LIMIT ?", (user_id, limit)
+        ).fetchall()
+        return [ScheduledPost.from_row(row) for row in rows]
+
+    def __len__(self):
+        """Записей в куче (включая ещё не пропущенные отменённые)"""
+        return len(self._heap)
+
+    async def start(self):
+        """Загрузить незавершённые публикации и запустить выдачу"""
+        with self._db:
+            # Прерванные остановкой этого процесса публикации отправляются снова
+            recovered = self._db.execute(
+                "UPDATE scheduled SET status = 'scheduled', worker = NULL WHERE status = 'publishing' AND worker = ?",
+                (self.worker_name,)
+            ).rowcount
+        if recovered:
+            logger.info(f"Возвращено в календарь прерванных публикаций: {recovered}")
+
+        rows = self._db.execute("SELECT id, publish_at FROM scheduled WHERE status = 'scheduled'").fetchall()
+        self._heap = [(publish_at, next(self._seq), post_id) for post_id, publish_at in rows]
+        heapq.heapify(self._heap)
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def stop(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+            self._dispatcher = None
+        # Незавершённые публикации останутся publishing и будут отправлены после перезапуска
+        for task in list(self._running):
+            task.cancel()
+        await asyncio.gather(*self._running, return_exceptions=True)
+
+    def close(self):
+        self._db.close()
+
+    def _push(self, post_id: str, publish_at: float):
+        heapq.heappush(self._heap, (publish_at, next(self._seq), post_id))
+        self._wakeup.set()
+
+    async def _dispatch(self):
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                # Ждём ближайшую публикацию или добавления более ранней
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            publish_at, _, post_id = heapq.heappop(self._heap)
+            item = self._claim(post_id, publish_at)
+            if item is None:
+                continue
+            await self._semaphore.acquire()
+            task = asyncio.create_task(self._run(item))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    def _claim(self, post_id: str, publish_at: float) -> Optional[ScheduledPost]:
+        """Забрать публикацию, если её не отменили, не перенесли и не забрал другой процесс"""
+        with self._db:
+            row = self._db.execute(
+                f"UPDATE scheduled SET status = 'publishing', worker = ? "
+                f"WHERE id = ? AND status = 'scheduled' AND publish_at = ? RETURNING {SCHEDULED_COLUMNS}",
+                (self.worker_name, post_id, publish_at)
+            ).fetchone()
+        return ScheduledPost.from_row(row) if row else None
+
+    async def _run(self, item: ScheduledPost):
+        try:
+            published = await self._handler(item)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception(f"Отложенная публикация {item.id} завершилась ошибкой")
+            self._finish(item, "failed", str(e)[:500])
+        else:
+            self._finish(item, "done" if published else "failed", None if published else "опубликован не везде")
+        finally:
+            self._semaphore.release()
+
+    def _finish(self, item: ScheduledPost, status: str, error: Optional[str] = None):
+        with self._db:
+            self._db.execute("UPDATE scheduled SET status = ?, error = ? WHERE id = ?", (status, error, item.id))
+
+
+def parse_publish_time(text: str, now: datetime) -> Optional[datetime]:
+    """Время публикации из «ЧЧ:ММ», «ДД.ММ ЧЧ:ММ» или «ДД.ММ.ГГГГ ЧЧ:ММ» в часовом поясе now.
+
+    «ЧЧ:ММ», которое сегодня уже прошло, — это завтра. None — не разобрали или время в прошлом.
+    """
+    text = " ".join(text.strip().split())
+    for pattern in ("%d.%m.%Y %H:%M", "%d.%m %H:%M", "%H:%M"):
+        try:
+            parsed = datetime.strptime(text, pattern)
+        except ValueError:
+            continue
+        if pattern == "%H:%M":
+            moment = now.replace(hour=parsed.hour, minute=parsed.minute, second=0, microsecond=0)
+            if moment <= now:
+                moment += timedelta(days=1)
+        elif pattern == "%d.%m %H:%M":
+            moment = now.replace(month=parsed.month, day=parsed.day, hour=parsed.hour, minute=parsed.minute,
+                                 second=0, microsecond=0)
+            if moment <= now:
+                moment = moment.replace(year=now.year + 1)
+        else:
+            moment = parsed.replace(tzinfo=now.tzinfo)
+        if now < moment <= now + MAX_SCHEDULE_AHEAD:
+            return moment
+        return None
+    return None
@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import signal
+import time
+from typing import Dict, Optional
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application, BaseUpdateProcessor
+from telegram.request import HTTPXRequest
+
+from smm_metrics import MetricsRegistry, metrics_handler
+from smm_transport import TransportConfig, pool_stats, warm_up
+
+logger = logging.getLogger(__name__)
+
+# Предел для семафора BaseUpdateProcessor: настоящий предел PerChatUpdateProcessor держит сам
+UNLIMITED_UPDATES = 1_000_000
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка апдейтов: разные чаты — одновременно, один чат — строго по очереди.
+
+    Порядок внутри чата нужен ConversationHandler, иначе состояния диалога перепутаются.
+    Апдейт сначала дожидается своей очереди в чате и только потом занимает общее место
+    из max_concurrent_updates: всплеск апдейтов одного чата (двойные нажатия, быстрый ввод)
+    ждёт сам по себе и не занимает места, нужные другим чатам. Поэтому общий предел — свой
+    семафор внутри do_process_update, а семафор BaseUpdateProcessor заведомо не ограничивает.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(UNLIMITED_UPDATES)
+        self.concurrency = max_concurrent_updates
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._waiting: Dict[int, int] = {}
+
+    @staticmethod
+    def update_key(update: object) -> Optional[int]:
+        if not isinstance(update, Update):
+            return None
+        if update.effective_chat:
+            return update.effective_chat.id
+        if update.effective_user:
+            return update.effective_user.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine):
+        key = self.update_key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._waiting[key] = self._waiting.get(key, 0) + 1
+        try:
+            async with lock:
+                # Общее место — только когда подошла очередь чата
+                async with self._slots:
+                    await coroutine
+        finally:
+            self._waiting[key] -= 1
+            if not self._waiting[key]:
+                del self._waiting[key]
+                del self._locks[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTP-транспорт бота, который считает запросы к Bot API и их длительность по методам.
+
+    Пул соединений, HTTP/2 и таймауты берутся из TransportConfig; без него — HTTP/1.1.
+    """
+
+    def __init__(self, metrics: MetricsRegistry, config: Optional[TransportConfig] = None, **kwargs):
+        config = config or TransportConfig(max_connections=256, http2=False)
+        super().__init__(
+            connection_pool_size=config.max_connections,
+            connect_timeout=config.connect_timeout,
+            read_timeout=config.read_timeout,
+            write_timeout=config.write_timeout,
+            pool_timeout=config.pool_timeout,
+            http_version="2" if config.http2 else "1.1",
+            **kwargs
+        )
+        self.metrics = metrics
+        self.config = config
+        self.in_flight = 0
+        # PTB держит открытыми все соединения пула и закрывает простаивающие через 5 секунд:
+        # задаём свои пределы keep-alive и пересобираем ещё не использованный клиент
+        self._client_kwargs["limits"] = config.limits()
+        self._client = self._build_client()
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        status = "error"
+        started = time.perf_counter()
+        self.in_flight += 1
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+            status = str(code)
+            return code, payload
+        finally:
+            self.in_flight -= 1
+            self.metrics.observe("smm_telegram_request_seconds", time.perf_counter() - started, method=api_method)
+            self.metrics.inc("smm_telegram_requests_total", method=api_method, status=status)
+
+    def pool_stats(self) -> Dict[str, float]:
+        return pool_stats(getattr(self._client, "_transport", None), self.in_flight, self.config.max_connections)
+
+    async def warm_up(self, base_url: str) -> int:
+        """Заранее открыть config.warmup соединений к Bot API (запросами getMe)"""
+        return await warm_up("Telegram", lambda: self.do_request(f"{base_url}/getMe", "POST"), self.config.warmup)
+
+
+def images_handler(images):
+    """Обработчик /images/{каталог}/{файл}: картинки из ImageStore по постоянным ссылкам для платформ"""
+
+    async def handle(request: web.Request) -> web.Response:
+        name = request.match_info["name"]
+        digest = name.split(".", 1)[0]
+        relative = images.relative_path(digest)
+        if relative != f"{request.match_info['prefix']}/{name}":
+            return web.Response(status=404)
+        return web.FileResponse(images.path(digest))
+
+    return handle
+
+
+def build_webhook_app(application: Application, path: str, secret_token: Optional[str] = None,
+                      metrics: Optional[MetricsRegistry] = None, images=None) -> web.Application:
+    """aiohttp-приложение, принимающее апдейты от Telegram (и отдающее /metrics и /images, если они переданы)"""
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if secret_token and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != secret_token:
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+
+        await application.update_queue.put(Update.de_json(data, application.bot))
+        return web.Response()
+
+    async def health(request: web.Request) -> web.Response:
+        return web.Response(text="ok")
+
+    app = web.Application()
+    app.router.add_post(f"/{path.strip('/')}", handle_update)
+    app.router.add_get("/healthz", health)
+    if metrics is not None:
+        app.router.add_get("/metrics", metrics_handler(metrics))
+    if images is not None:
+        app.router.add_get("/images/{prefix}/{name}", images_handler(images))
+    return app
+
+
+async def serve_webhook(application: Application, webhook_url: str, host: str = "0.0.0.0", port: int = 8080,
+                        path: str = "webhook", secret_token: Optional[str] = None,
+                        stop_event: Optional[asyncio.Event] = None, metrics: Optional[MetricsRegistry] = None,
+                        images=None):
+    """Запуск бота в режиме вебхука на aiohttp (вместо run_polling)"""
+    stop_event = stop_event or asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    app = build_webhook_app(application, path, secret_token, metrics=metrics, images=images)
+    runner = web.AppRunner(app)
+
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        await application.bot.set_webhook(
+            url=f"{webhook_url.rstrip('/')}/{path.strip('/')}",
+            allowed_updates=Update.ALL_TYPES,
+            secret_token=secret_token
+        )
+        logger.info(f"Вебхук слушает {host}:{port}/{path.strip('/')}")
+
+        try:
+            await stop_event.wait()
+        finally:
+            await runner.cleanup()
+            await application.stop()
+            if application.post_shutdown:
+                await application.post_shutdown(application)
@@ -0,0 +1,188 @@
+import base64
+import json
+import logging
+import os
+import sqlite3
+import time
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # NumPy не установлен: похожие темы не ищутся, посты всегда генерируются заново
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Начальная ёмкость файла векторов; при заполнении он увеличивается вдвое
+INITIAL_CAPACITY = 1024
+
+# Владелец тем, сохранённых до разделения индекса по пользователям: ни с кем не совпадает
+NO_OWNER = -1
+
+
+def numpy_available() -> bool:
+    return np is not None
+
+
+def encode_vector(vector: Sequence[float]) -> str:
+    """Компактная строка для кэша: float32 в base64 (в 4-5 раз короче JSON)"""
+    return base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode("ascii")
+
+
+def decode_vector(value: str):
+    return np.frombuffer(base64.b64decode(value), dtype=np.float32)
+
+
+class SimilarTopic:
+    """Найденная похожая тема и сохранённый для неё черновик"""
+
+    def __init__(self, row: int, topic: str, score: float, post: Dict):
+        self.row = row
+        self.topic = topic
+        self.score = score
+        self.post = post
+
+
+class TopicIndex:
+    """Индекс прошлых тем по эмбеддингам для поиска перефразированных тем в той же нише.
+
+    Векторы нормированы и лежат одной матрицей float32 в .npy-файле, который открывается через
+    memmap, поэтому индекс загружается мгновенно; темы и снимки черновиков хранятся в SQLite.
+    Поиск — одно матричное умножение по строкам нужной ниши и нужного владельца: черновики
+    одного пользователя другим не предлагаются.
+    Индекс пишет один процесс: воркеры в отдельных процессах его не открывают.
+    """
+
+    def __init__(self, root: str = "topic_index", dim: int = 1536):
+        self.root = root
+        self.dim = dim
+        os.makedirs(root, exist_ok=True)
+        self._vectors_path = os.path.join(root, "vectors.npy")
+
+        self._db = sqlite3.connect(os.path.join(root, "topics.db"), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS topics (row INTEGER PRIMARY KEY, post_id TEXT UNIQUE NOT NULL, "
+            "niche TEXT NOT NULL, topic TEXT NOT NULL, post TEXT NOT NULL, created_at REAL NOT NULL, owner INTEGER)"
+        )
+        # Индекс до появления владельцев: его темы больше никому не предлагаются
+        columns = [column[1] for column in self._db.execute("PRAGMA table_info(topics)")]
+        if "owner" not in columns:
+            self._db.execute("ALTER TABLE topics ADD COLUMN owner INTEGER")
+        self._db.commit()
+
+        rows = self._db.execute("SELECT row, niche, owner FROM topics ORDER BY row").fetchall()
+        self._count = len(rows)
+        self._niche_codes: Dict[str, int] = {}
+        self._scopes: Set[Tuple[int, str]] = set()  # (владелец, ниша), где есть темы
+        niches = [self._niche_code(niche) for _, niche, _ in rows]
+        self._niches = np.array(niches, dtype=np.int32)
+        self._owners = np.array([NO_OWNER if owner is None else owner for _, _, owner in rows], dtype=np.int64)
+        self._scopes.update((owner, niche) for _, niche, owner in rows if owner is not None)
+        self._vectors = self._open(max(INITIAL_CAPACITY, self._count))
+
+    def _open(self, capacity: int):
+        if os.path.exists(self._vectors_path):
+            vectors = np.load(self._vectors_path, mmap_mode="r+")
+            if vectors.shape[1] == self.dim and vectors.shape[0] >= self._count:
+                return vectors
+            logger.warning(f"Файл индекса тем {self._vectors_path} не подходит, индекс создаётся заново")
+            self._db.execute("DELETE FROM topics")
+            self._db.commit()
+            self._count = 0
+            self._niches = np.zeros(0, dtype=np.int32)
+            self._owners = np.zeros(0, dtype=np.int64)
+            self._niche_codes.clear()
+            self._scopes.clear()
+        return np.lib.format.open_memmap(self._vectors_path, mode="w+", dtype=np.float32,
+                                         shape=(capacity, self.dim))
+
+    def _grow(self):
+        """Удвоить ёмкость файла векторов: новый файл заменяет старый атомарно"""
+        tmp_path = self._vectors_path + ".tmp.npy"
+        grown = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32,
+                                          shape=(self._vectors.shape[0] * 2, self.dim))
+        grown[:self._count] = self._vectors[:self._count]
+        grown.flush()
+        del grown
+        self._vectors = None
+        os.replace(tmp_path, self._vectors_path)
+        self._vectors = np.load(self._vectors_path, mmap_mode="r+")
+
+    def _niche_code(self, niche: str) -> int:
+        return self._niche_codes.setdefault(niche, len(self._niche_codes))
+
+    def has_niche(self, niche: str, owner: int) -> bool:
+        """Есть ли у владельца в нише хоть одна тема (иначе эмбеддинг для поиска можно не запрашивать)"""
+        return (owner, niche) in self._scopes
+
+    def contains(self, post_id: str) -> bool:
+        return self._db.execute("SELECT 1 FROM topics WHERE post_id = ?", (post_id,)).fetchone() is not None
+
+    def add(self, vector: Sequence[float], niche: str, topic: str, post: Dict, owner: int) -> Optional[int]:
+        """Запомнить тему и снимок черновика владельца; черновик с тем же id добавляется один раз"""
+        if self.contains(post["id"]):
+            return None
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if vector.shape != (self.dim,) or norm == 0:
+            logger.error(f"Некорректный эмбеддинг темы: размер {vector.shape}, ожидался {self.dim}")
+            return None
+
+        if self._count == self._vectors.shape[0]:
+            self._grow()
+        row = self._count
+        self._vectors[row] = vector / norm
+        self._vectors.flush()
+
+        with self._db:
+            self._db.execute(
+                "INSERT INTO topics (row, post_id, niche, topic, post, created_at, owner) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (row, post["id"], niche, topic, json.dumps(post, ensure_ascii=False), time.time(), owner)
+            )
+        self._niches = np.append(self._niches, np.int32(self._niche_code(niche)))
+        self._owners = np.append(self._owners, np.int64(owner))
+        self._scopes.add((owner, niche))
+        self._count += 1
+        return row
+
+    def search(self, vector: Sequence[float], niche: str, owner: int, threshold: float = 0.9,
+               limit: int = 3) -> List[SimilarTopic]:
+        """Похожие темы владельца в нише с косинусной близостью не ниже threshold, самые близкие первыми"""
+        if not self.has_niche(niche, owner) or self._count == 0:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if query.shape != (self.dim,) or norm == 0:
+            return []
+
+        rows = np.flatnonzero((self._niches == self._niche_codes[niche]) & (self._owners == owner))
+        scores = self._vectors[rows] @ (query / norm)
+        candidates = np.flatnonzero(scores >= threshold)
+        if candidates.size > limit:
+            candidates = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+        candidates = candidates[np.argsort(-scores[candidates])]
+
+        found = []
+        for index in candidates:
+            row = int(rows[index])
+            topic = self.get(row)
+            if topic is not None:
+                topic.score = float(scores[index])
+                found.append(topic)
+        return found
+
+    def get(self, row: int, owner: int) -> Optional[SimilarTopic]:
+        found = self._db.execute(
+            "SELECT topic, post FROM topics WHERE row = ? AND owner = ?", (row, owner)
+        ).fetchone()
+        if not found:
+            return None
+        return SimilarTopic(row, found[0], 1.0, json.loads(found[1]))
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        if self._vectors is not None:
+            self._vectors.flush()
+        self._db.close()
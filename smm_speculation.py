@@ -0,0 +1,66 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional
+
+# Все заранее генерируемые варианты идут к AI одной «очередью пользователя»: планировщик
+# обслуживает пользователей по кругу, поэтому под нагрузкой догадки всех пользователей вместе
+# получают не больше места, чем один живой пользователь
+SPECULATIVE_LANE = "speculative"
+
+# Ключ черновика с готовыми вариантами: {часть поста: {"value": ..., "tokens": ..., "images": ...}}.
+# Варианты лежат в самом черновике, потому что их генерирует воркер, а выдаёт бот — возможно,
+# в разных процессах с общим хранилищем черновиков
+VARIANTS_KEY = "variants"
+
+
+class Spend:
+    """Расход на генерацию одного варианта: токены GPT и картинки DALL-E"""
+
+    def __init__(self, tokens: int = 0, images: int = 0):
+        self.tokens = tokens
+        self.images = images
+
+
+_current: ContextVar[Optional[Spend]] = ContextVar("smm_speculative_spend", default=None)
+
+
+@contextmanager
+def speculative_spend() -> Iterator[Spend]:
+    """Считать расход запросов к AI внутри блока (и запущенных из него задач) в отдельный Spend"""
+    spend = Spend()
+    token = _current.set(spend)
+    try:
+        yield spend
+    finally:
+        _current.reset(token)
+
+
+def charge(tokens: int = 0, images: int = 0):
+    """Учесть расход, если он сделан ради заранее генерируемого варианта; иначе ничего не делает"""
+    spend = _current.get()
+    if spend is not None:
+        spend.tokens += tokens
+        spend.images += images
+
+
+def make_variant(value, spend: Spend) -> Dict:
+    """Запись варианта для VARIANTS_KEY черновика"""
+    return {"value": value, "tokens": spend.tokens, "images": spend.images}
+
+
+def ready_targets(post_data: Dict) -> List[str]:
+    return list(post_data.get(VARIANTS_KEY) or {})
+
+
+def take_variant(post_data: Dict, target: str) -> Optional[Dict]:
+    """Забрать готовый вариант части поста из черновика (None — его нет)"""
+    variants = post_data.get(VARIANTS_KEY) or {}
+    variant = variants.pop(target, None)
+    if not variants:
+        post_data.pop(VARIANTS_KEY, None)
+    return variant
+
+
+def take_all_variants(post_data: Dict) -> Dict[str, Dict]:
+    """Забрать из черновика все готовые варианты"""
+    return post_data.pop(VARIANTS_KEY, None) or {}
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+from json.decoder import scanstring
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def parse_partial_texts(buffer: str, platforms: list) -> Dict[str, str]:
+    """Разбор незавершённого JSON-объекта {"платформа": "текст", ...} во время стриминга.
+
+    Возвращает уже полученные тексты, включая недописанный последний.
+    """
+    texts = {}
+    pos = buffer.find("{")
+    if pos < 0:
+        return texts
+    pos += 1
+
+    while True:
+        # Пропускаем пробелы и запятые между парами
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+        if pos >= len(buffer) or buffer[pos] != '"':
+            break
+
+        try:
+            key, pos = scanstring(buffer, pos + 1)
+        except ValueError:
+            break
+
+        colon = buffer.find(":", pos)
+        if colon < 0:
+            break
+        pos = colon + 1
+        while pos < len(buffer) and buffer[pos] in " \t\r\n":
+            pos += 1
+        if pos >= len(buffer) or buffer[pos] != '"':
+            break
+
+        value, pos, complete = _scan_partial_string(buffer, pos + 1)
+        key = key.strip().lower()
+        if key in platforms and value:
+            texts[key] = value
+        if not complete:
+            break
+
+    return texts
+
+
+def _scan_partial_string(buffer: str, start: int):
+    """Строка JSON, начиная после открывающей кавычки: (значение, позиция, завершена ли)"""
+    try:
+        value, end = scanstring(buffer, start)
+        return value, end, True
+    except ValueError:
+        pass
+
+    # Строка ещё не закрыта: закрываем её сами, отбрасывая недописанную escape-последовательность
+    tail = buffer[start:]
+    for cut in range(0, min(len(tail), 6) + 1):
+        candidate = tail[:len(tail) - cut]
+        try:
+            value, _ = scanstring(candidate + '"', 0)
+            return value, len(buffer), False
+        except ValueError:
+            continue
+    return "", len(buffer), False
+
+
+class ThrottledEditor:
+    """Правка сообщения не чаще раза в min_interval секунд: промежуточные версии схлопываются"""
+
+    def __init__(self, message, min_interval: float = 1.0, parse_mode: str = 'HTML'):
+        self.message = message
+        self.min_interval = min_interval
+        self.parse_mode = parse_mode
+        self._latest = None  # (text, reply_markup)
+        self._sent = None
+        self._last_edit = 0.0
+        self._delivered = True  # удалась ли последняя отправленная правка
+        self._task: Optional[asyncio.Task] = None
+
+    def update(self, text: str, reply_markup=None):
+        """Запомнить новую версию сообщения; отправится при ближайшей возможности"""
+        self._latest = (text, reply_markup)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def flush(self) -> bool:
+        """Дождаться отправки последней версии; False — её не удалось отправить (например, исчерпаны
+        повторы после RetryAfter), и показать её нужно иначе, скажем, новым сообщением"""
+        if self._task is not None:
+            await self._task
+        return self._delivered
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while self._latest != self._sent:
+            delay = self._last_edit + self.min_interval - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            text, reply_markup = current = self._latest
+            try:
+                await self.message.edit_text(text, parse_mode=self.parse_mode, reply_markup=reply_markup)
+                self._delivered = True
+            except Exception as e:
+                logger.warning(f"Не удалось обновить превью: {e}")
+                self._delivered = False
+            self._sent = current
+            self._last_edit = loop.time()
+
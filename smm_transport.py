@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable, Dict, Optional
+
+import httpx
+
+try:
+    import h2  # noqa: F401
+except ImportError:  # Пакет h2 не установлен (pip install "httpx[http2]"): соединения остаются HTTP/1.1
+    h2 = None
+
+logger = logging.getLogger(__name__)
+
+
+def http2_available() -> bool:
+    return h2 is not None
+
+
+# Параметры TransportConfig, которые можно задать переменными окружения
+ENV_SETTINGS = {
+    "max_connections": int,
+    "max_keepalive": int,
+    "keepalive_expiry": float,
+    "http2": lambda value: value != "0",
+    "connect_timeout": float,
+    "read_timeout": float,
+    "write_timeout": float,
+    "pool_timeout": float,
+    "warmup": int,
+}
+
+
+class TransportConfig:
+    """Настройки пула соединений HTTP-клиента: размер пула, keep-alive, HTTP/2 и таймауты.
+
+    max_keepalive — сколько простаивающих соединений держать открытыми keepalive_expiry секунд,
+    чтобы всплеск запросов не ждал новых TCP- и TLS-рукопожатий. pool_timeout — сколько запрос
+    ждёт свободное соединение, когда заняты все max_connections. warmup — сколько соединений
+    открыть заранее при запуске.
+    """
+
+    def __init__(self, max_connections: int = 100, max_keepalive: int = 20, keepalive_expiry: float = 30.0,
+                 http2: bool = True, connect_timeout: float = 5.0, read_timeout: float = 60.0,
+                 write_timeout: float = 30.0, pool_timeout: float = 10.0, warmup: int = 4):
+        self.max_connections = max_connections
+        self.max_keepalive = min(max_keepalive, max_connections)
+        self.keepalive_expiry = keepalive_expiry
+        if http2 and not http2_available():
+            logger.warning("HTTP/2 недоступен: не установлен пакет h2, соединения будут HTTP/1.1")
+        self.http2 = http2 and http2_available()
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.write_timeout = write_timeout
+        self.pool_timeout = pool_timeout
+        # Открытые заранее соединения должны пережить ожидание в пуле keep-alive;
+        # по HTTP/2 все запросы идут через одно соединение
+        self.warmup = min(warmup, self.max_keepalive, 1 if self.http2 else warmup)
+
+    @classmethod
+    def from_env(cls, prefix: str, **defaults) -> "TransportConfig":
+        """Настройки из переменных окружения <prefix>_MAX_CONNECTIONS, <prefix>_HTTP2 и т.д.
+        (имена — параметры конструктора в верхнем регистре); не заданные берутся из defaults"""
+        settings = dict(defaults)
+        for name, cast in ENV_SETTINGS.items():
+            value = os.getenv(f"{prefix}_{name.upper()}")
+            if value:
+                settings[name] = cast(value)
+        return cls(**settings)
+
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive,
+            keepalive_expiry=self.keepalive_expiry
+        )
+
+    def timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(
+            connect=self.connect_timeout, read=self.read_timeout,
+            write=self.write_timeout, pool=self.pool_timeout
+        )
+
+
+def pool_stats(transport, in_flight: int, max_connections: int) -> Dict[str, float]:
+    """Состояние пула соединений httpx: соединений открыто, простаивает, из них HTTP/2,
+    запросов в работе (вместе с ждущими свободного соединения) и доля занятых соединений от предела"""
+    pool = getattr(transport, "_pool", None)
+    connections = list(getattr(pool, "connections", []))
+    idle = sum(1 for connection in connections if connection.is_idle())
+    return {
+        "connections": len(connections),
+        "idle": idle,
+        "http2": sum(1 for connection in connections if "HTTP/2" in connection.info()),
+        "in_flight": in_flight,
+        "utilization": (len(connections) - idle) / max_connections if max_connections else 0.0,
+    }
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """Тело ответа, по закрытию которого запрос перестаёт считаться выполняющимся"""
+
+    def __init__(self, stream: httpx.AsyncByteStream, release: Callable[[], None]):
+        self._stream = stream
+        self._release = release
+        self._released = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._released:
+                self._released = True
+                self._release()
+
+
+class PooledTransport(httpx.AsyncHTTPTransport):
+    """Транспорт httpx с настройками пула, который считает запросы в работе (до закрытия ответа,
+    так что потоковый ответ занимает соединение, пока читается)"""
+
+    def __init__(self, config: TransportConfig):
+        super().__init__(limits=config.limits(), http2=config.http2)
+        self.config = config
+        self.in_flight = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.in_flight += 1
+        try:
+            response = await super().handle_async_request(request)
+        except BaseException:
+            self.in_flight -= 1
+            raise
+        response.stream = _ReleasingStream(response.stream, self._release)
+        return response
+
+    def _release(self):
+        self.in_flight -= 1
+
+    def stats(self) -> Dict[str, float]:
+        return pool_stats(self, self.in_flight, self.config.max_connections)
+
+
+def build_http_client(transport: PooledTransport) -> httpx.AsyncClient:
+    """HTTP-клиент поверх настроенного пула (например, для AsyncOpenAI(http_client=...))"""
+    return httpx.AsyncClient(transport=transport, timeout=transport.config.timeout())
+
+
+async def warm_up(name: str, touch: Callable[[], Awaitable], connections: int) -> int:
+    """Открыть заранее до connections соединений одновременными лёгкими запросами touch.
+
+    Пока рукопожатие первого запроса не закончено, остальные не могут взять его соединение
+    и открывают свои, поэтому в пуле остаются готовые соединения. Ответ сервера не важен.
+    Возвращает число успешных запросов; ошибки прогрева только логируются.
+    """
+    if connections <= 0:
+        return 0
+    results = await asyncio.gather(*[touch() for _ in range(connections)], return_exceptions=True)
+    failed = [result for result in results if isinstance(result, Exception)]
+    if failed:
+        logger.warning(f"Прогрев соединений {name}: не удалось {len(failed)} из {connections}: {failed[0]}")
+    return connections - len(failed)
+
+
+def describe(stats: Optional[Dict[str, float]]) -> str:
+    if not stats:
+        return "нет данных"
+    return (f"соединений {stats['connections']} (простаивает {stats['idle']}, HTTP/2 {stats['http2']}), "
+            f"запросов в работе {stats['in_flight']}")
@@ -1,9 +1,19 @@
 import asyncio
+import functools
+import html
+import json
 import logging
 import os
-from datetime import datetime
-from typing import Dict, Optional
+import signal
+import sys
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from zoneinfo import ZoneInfo
 import random
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 
 # Импорт для работы с токеном из .env файла
 from dotenv import load_dotenv
@@ -16,12 +26,53 @@ from telegram.ext import (
     MessageHandler,
     ContextTypes,
     filters,
-    ConversationHandler
+    ConversationHandler,
+    PicklePersistence
 )
 
 # Импорты для работы с OpenAI
 from openai import AsyncOpenAI
 
+from smm_actions import ActionGuard
+from smm_batch import BatchError, BatchStore, build_archives, parse_batch
+from smm_cache import ResponseCache
+from smm_derivatives import ImageDerivatives, pillow_available
+from smm_drafts import MemoryDraftStore, SQLiteDraftStore
+from smm_images import ImageStore
+from smm_jobs import PRIORITY_BATCH, PRIORITY_INTERACTIVE, PRIORITY_SPECULATIVE, BackgroundJobQueue, Job
+from smm_limits import AdmissionController, estimate_tokens
+from smm_metrics import MetricsRegistry, start_metrics_server
+from smm_outbound import OutboundScheduler
+from smm_preview import ELLIPSIS, PreviewRenderer, clip_escaped
+from smm_prompts import DEFAULT_PROMPTS_FILE, PromptRegistry
+from smm_publish import (
+    InstagramAdapter,
+    Publisher,
+    PublishResult,
+    TelegramChannelAdapter,
+    TikTokAdapter,
+    VKAdapter
+)
+from smm_resilience import LatencyTracker, RetryPolicy, call_with_retry, generation_deadline, is_retryable
+from smm_routing import ModelRouter, Route
+from smm_replies import AutoReplyEngine, Comment, PostRegistry, build_reply_request, parse_replies
+from smm_schedule import PublicationScheduler, ScheduledPost, parse_publish_time
+from smm_similar import TopicIndex, decode_vector, encode_vector, numpy_available
+from smm_speculation import (
+    SPECULATIVE_LANE,
+    VARIANTS_KEY,
+    Spend,
+    charge,
+    make_variant,
+    ready_targets,
+    speculative_spend,
+    take_all_variants,
+    take_variant
+)
+from smm_server import InstrumentedRequest, PerChatUpdateProcessor, serve_webhook
+from smm_streaming import ThrottledEditor, parse_partial_texts
+from smm_transport import PooledTransport, TransportConfig, build_http_client, describe, warm_up
+
 # Настройка логирования
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -31,83 +82,523 @@ logger = logging.getLogger(__name__)
 
 # Инициализация OpenAI клиента
 # Ключ будет автоматически взят из переменной окружения OPENAI_API_KEY
-client = AsyncOpenAI()
+# Повторы и таймауты делает smm_resilience, поэтому встроенные повторы клиента отключены
+client = AsyncOpenAI(max_retries=0)
+
+def configure_openai_client(transport: PooledTransport):
+    """Клиент OpenAI поверх настроенного пула соединений вместо настроек httpx по умолчанию"""
+    global client
+    smm_bot.openai_pool = transport
+    smm_bot.openai_http = build_http_client(transport)
+    client = AsyncOpenAI(max_retries=0, http_client=smm_bot.openai_http, timeout=transport.config.timeout())
 
 # Состояния для ConversationHandler
-CHOOSING_NICHE, ENTERING_TOPIC, REVIEWING, EDITING = range(4)
+CHOOSING_NICHE, ENTERING_TOPIC, REVIEWING, EDITING, REGENERATING, SCHEDULING = range(6)
+# Названия состояний для метрик (None — обработчик не сменил состояние)
+STATE_NAMES = {
+    CHOOSING_NICHE: "choosing_niche",
+    ENTERING_TOPIC: "entering_topic",
+    REVIEWING: "reviewing",
+    EDITING: "editing",
+    REGENERATING: "regenerating",
+    SCHEDULING: "scheduling",
+    ConversationHandler.END: "end",
+    None: "unchanged",
+}
+
+# Платформы, для которых генерируется контент
+PLATFORMS = ["tiktok", "telegram", "instagram", "vk"]
+PLATFORM_TITLES = {"tiktok": "🎵 TikTok", "telegram": "✈️ Telegram", "instagram": "📸 Instagram", "vk": "🌐 VK"}
+# Части поста, которые можно сгенерировать заново по отдельности
+REGENERATION_TARGETS = {**PLATFORM_TITLES, "image": "🖼 Фото"}
+
+# Клавиатуры, которые не зависят от пользователя, собираются один раз (разметка PTB неизменяемая)
+EDIT_PLATFORMS_KEYBOARD = InlineKeyboardMarkup(
+    [[InlineKeyboardButton(title, callback_data=f"edit_{platform}")] for platform, title in PLATFORM_TITLES.items()]
+    + [[InlineKeyboardButton("◀️ Назад", callback_data="back_to_review")]]
+)
+CANCEL_EDIT_KEYBOARD = InlineKeyboardMarkup([[InlineKeyboardButton("◀️ Отмена", callback_data="edit")]])
+REGENERATION_KEYBOARD = InlineKeyboardMarkup(
+    [[InlineKeyboardButton(title, callback_data=f"regen_{target}")] for target, title in REGENERATION_TARGETS.items()]
+    + [[InlineKeyboardButton("◀️ Назад", callback_data="back_to_review")]]
+)
+BACK_TO_REVIEW_KEYBOARD = InlineKeyboardMarkup([[InlineKeyboardButton("◀️ Назад к посту", callback_data="back_to_review")]])
+# Сколько символов текущего текста показывать при редактировании
+EDIT_TEXT_PREVIEW_LIMIT = 3500
+
+# Модели AI (входят в ключ кэша вместе с версией промптов из реестра smm_prompts).
+# Модель текстов и бюджет токенов выбирает маршрутизатор (smm_routing)
+IMAGE_MODEL = "dall-e-2"
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIM = 1536
+
+# Официальный сервер Bot API: HTTP/2 к Bot API разрешается только к нему
+TELEGRAM_API_URL = "https://api.telegram.org"
+
+# Каталог бота: здесь по умолчанию лежат файлы SQLite очереди задач, пакетов, календаря и журнала
+# публикаций, а также индекс тем
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Ссылки DALL-E временные, поэтому держим их в кэше меньше часа
+IMAGE_URL_TTL = 50 * 60
+
+# Как часто обновлять позицию пользователя в очереди к AI, секунд
+QUEUE_STATUS_INTERVAL = 2.0
+
+# Картинка, которая подставляется, если DALL-E не ответил
+IMAGE_PLACEHOLDER_URL = (
+    "https://upload.wikimedia.org/wikipedia/commons/thumb/a/ac/No_image_available.svg/"
+    "1024px-No_image_available.svg.png"
+)
+
+# Пакетная генерация из файла: максимальный размер файла, байт
+BATCH_MAX_FILE_SIZE = 1024 * 1024
+
+# Фоновые задачи, которые отменяются, когда черновик заменён или создание поста отменено
+GENERATION_JOB_KINDS = ["generate", "regenerate_part"]
+
+# Начало текста, который generate_post_text возвращает вместо поста при ошибке AI
+TEXT_ERROR_PREFIX = "❌ Ошибка AI-генерации текста"
+
+GENERATING_TEXT = (
+    "⏳ <b>Генерирую контент...</b>\n\n"
+    "🤖 AI создаёт тексты для всех платформ и подбирает фото. Это займет ~5-10 секунд..."
+)
 
 class SMMBot:
     def __init__(self):
-        self.pending_posts = {}  # user_id: post_data
+        self.drafts = MemoryDraftStore()  # user_id: post_data (настраивается в main())
+        # Один запрос к GPT на все платформы вместо отдельного запроса на каждую
+        self.batch_generation = True
+        # Кэш ответов AI (настраивается в main() через переменные окружения)
+        self.cache = ResponseCache()
+        # Потоковая генерация: превью обновляется по мере поступления текста
+        self.streaming = False
+        self.stream_edit_interval = 1.0
+        # Пул соединений к OpenAI (создаётся в main(); None — настройки клиента по умолчанию)
+        self.openai_pool: Optional[PooledTransport] = None
+        self.openai_http = None
+        # Локальное хранилище картинок и их варианты под платформы (создаются в main())
+        self.images: Optional[ImageStore] = None
+        self.derivatives: Optional[ImageDerivatives] = None
+        # Общие лимиты запросов к OpenAI (отдельно для текста и картинок)
+        self.text_limiter = AdmissionController("text", rpm=3500, tpm=90000)
+        self.image_limiter = AdmissionController("image", rpm=50)
+        # Таймауты и повторы запросов к AI, общий дедлайн генерации поста
+        self.text_retry = RetryPolicy(timeout=30)
+        self.image_retry = RetryPolicy(timeout=60)
+        self.generation_deadline = 90.0
+        # Дублирующий запрос текста, если ответа нет дольше hedge_percentile обычной задержки
+        self.hedging = True
+        self.hedge_percentile = 0.95
+        self.text_latency = defaultdict(LatencyTracker)  # (модель, max_tokens): задержки
+        # Модель и бюджет токенов по платформе и нише, переключение на запасную модель при деградации
+        self.router = ModelRouter()
+        # Ниши, системный промпт и шаблоны запросов (файл prompts.json перечитывается при изменении)
+        self.prompts = PromptRegistry()
+        # Превью черновиков: длинные разбиваются на несколько сообщений по лимиту Telegram
+        self.preview = PreviewRenderer()
+        # Публикация на платформы (адаптеры подключаются в main() по переменным окружения)
+        self.publisher = Publisher()
+        # Фоновая очередь генерации постов
+        self.jobs = BackgroundJobQueue()
+        # Запасные варианты текстов и фото, которые генерируются заранее, пока пользователь читает превью:
+        # только если свободна доля speculation_headroom лимитов AI и не больше speculation_concurrency
+        # таких задач одновременно
+        self.speculation = False
+        self.speculation_headroom = 0.5
+        self.speculation_concurrency = 1
+        # Повторные нажатия кнопок не запускают действие второй раз
+        self.actions = ActionGuard()
+        # Индекс прошлых тем: на похожую тему предлагаются готовые черновики (создаётся в main())
+        self.topics: Optional[TopicIndex] = None
+        self.similar_threshold = 0.9
+        self.embedding_retry = RetryPolicy(attempts=1, timeout=5)
+        # Пакетная генерация из файла: строки пакетов, одновременно генерируемые строки, лимит строк
+        self.batches = BatchStore()
+        self.batch_concurrency = 4
+        self.batch_max_rows = 200
+        # Календарь отложенных публикаций; время показывается и вводится в часовом поясе timezone
+        # (None — часовой пояс сервера)
+        self.scheduler = PublicationScheduler()
+        self.timezone: Optional[ZoneInfo] = None
+        # Автоответы на комментарии под постами канала (создаются в main())
+        self.replies: Optional[AutoReplyEngine] = None
+        self.channel_posts = PostRegistry()
+        # Метрики (SMM_METRICS_PORT — отдельный HTTP-сервер с /metrics в режиме polling)
+        self.metrics = MetricsRegistry()
+        self.metrics_port: Optional[int] = None
+        self.metrics_runner = None
+        # Публичный адрес хранилища картинок для платформ, которые скачивают фото сами
+        self.public_image_url: Optional[str] = None
+
+    def text_cache_key(self, topic: str, platform: str, niche: str) -> str:
+        # Ключ — по основной модели маршрута: смена модели или бюджета в маршрутах сбрасывает кэш
+        route = self.router.route(platform, niche)
+        return ResponseCache.make_key("text", topic, platform, niche, route.model, str(route.max_tokens),
+                                      self.prompts.current().version)
+
+    def image_cache_key(self, keywords: list, niche: str) -> str:
+        return ResponseCache.make_key("image", " ".join(keywords), niche, IMAGE_MODEL, self.prompts.current().version)
         
-    async def generate_image_url(self, keywords: list, niche: str) -> str:
-        """Генерация реалистичного фото с помощью DALL-E"""
+    async def generate_image_url(self, keywords: list, niche: str, force_fresh: bool = False,
+                                 user_id: Optional[int] = None, instructions: Optional[str] = None) -> str:
+        """Генерация реалистичного фото с помощью DALL-E
+
+        instructions — пожелания пользователя к фото; такие фото не кэшируются.
+        """
+
+        cache_key = self.image_cache_key(keywords, niche)
+        if not force_fresh and not instructions:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
 
         # Создаем подробный запрос для AI
-        prompt = (
-            f"Фотореалистичное, высококачественное изображение на тему: '{' '.join(keywords)}' из ниши '{niche}'. "
-            f"Стиль: рекламная фотография, 4K, студийный свет, без текста, резкий фокус."
-        )
+        prompts = self.prompts.current()
+        prompt = prompts.render("image", keywords=" ".join(keywords), niche=niche)
+        if instructions:
+            prompt += prompts.render("image_instructions", instructions=instructions)
 
         try:
             # DALL-E-2 используется как более доступный и быстрый вариант для Telegram
-            response = await client.images.generate(
-                model="dall-e-2",
-                prompt=prompt,
-                n=1,
-                size="512x512" 
-            )
-            # DALL-E возвращает временную ссылку на изображение
-            return response.data[0].url
+            async def attempt(timeout: float):
+                async with self.image_limiter.slot(user_id):
+                    with self.track_openai("image", IMAGE_MODEL):
+                        return await asyncio.wait_for(client.images.generate(
+                            model=IMAGE_MODEL,
+                            prompt=prompt,
+                            n=1,
+                            size="512x512" 
+                        ), timeout)
+            
+            response = await call_with_retry(attempt, self.image_retry)
+            # DALL-E возвращает временную ссылку на изображение, поэтому кэшируем её ненадолго
+            image_url = response.data[0].url
+            charge(images=1)
+            if not instructions:
+                self.cache.set(cache_key, image_url, ttl=IMAGE_URL_TTL)
+            return image_url
             
         except Exception as e:
             logger.error(f"Ошибка генерации изображения: {e}")
             # Возвращаем ссылку на заглушку в случае ошибки (по необходимости, сейчас заглушек нет)
-            return "https://upload.wikimedia.org/wikipedia/commons/thumb/a/ac/No_image_available.svg/1024px-No_image_available.svg.png"
+            return IMAGE_PLACEHOLDER_URL
+        
+    async def generate_image(self, keywords: list, niche: str, force_fresh: bool = False,
+                             user_id: Optional[int] = None, instructions: Optional[str] = None):
+        """Генерация фото и сохранение его в локальное хранилище: (ссылка, хэш файла, {платформа: хэш варианта})"""
+        image_url = await self.generate_image_url(
+            keywords, niche, force_fresh=force_fresh, user_id=user_id, instructions=instructions
+        )
+        if self.images is None:
+            return image_url, None, {}
+        image_hash = await self.images.fetch(image_url)
+        return image_url, image_hash, await self.image_variants(image_hash)
+    
+    async def image_variants(self, image_hash: Optional[str]) -> Dict[str, str]:
+        """Кадрированные под платформы варианты картинки (пусто, если обработка выключена)"""
+        if self.derivatives is None or not image_hash:
+            return {}
+        started = time.perf_counter()
+        derivatives = await self.derivatives.ensure(image_hash)
+        self.metrics.observe("smm_image_processing_seconds", time.perf_counter() - started)
+        return ImageDerivatives.platform_variants(derivatives)
         
-    async def generate_post_text(self, topic: str, platform: str, niche: str) -> str:
-        """Генерация текста для поста с помощью AI (GPT)"""
+    async def generate_post_text(self, topic: str, platform: str, niche: str, force_fresh: bool = False,
+                                 on_update=None, user_id: Optional[int] = None, instructions: Optional[str] = None,
+                                 current_text: Optional[str] = None) -> str:
+        """Генерация текста для поста с помощью AI (GPT)
+
+        on_update — необязательный колбэк {платформа: текст} для потоковой генерации.
+        instructions — пожелания пользователя («короче», «больше эмодзи»): тогда модель переделывает
+        current_text, а результат не кэшируется.
+        """
+
+        cache_key = self.text_cache_key(topic, platform, niche)
+        if not force_fresh and not instructions:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
         
-        system_prompt = (
-            f"Ты профессиональный SMM-менеджер. Твоя задача — создать продающий и вовлекающий пост "
-            f"на тему '{topic}' для ниши '{niche}'. "
-            f"Адаптируй стиль, длину и хештеги под платформу '{platform}'. "
-            f"Сделай пост максимально естественным и привлекательным для ЦА этой платформы."
+        # Статический системный промпт первым (общее начало всех запросов попадает в кэш промптов OpenAI),
+        # тема, платформа и пожелания — в конце
+        prompts = self.prompts.current()
+        user_prompt = prompts.render("post", topic=topic, niche=niche, platform=platform)
+        route = self.router.route(platform, niche)
+        if instructions:
+            user_prompt += prompts.render("instructions", instructions=instructions)
+            if current_text:
+                user_prompt += prompts.render("current_text", current_text=current_text)
+
+        request = dict(
+            model=route.model,
+            messages=[
+                {"role": "system", "content": prompts.system},
+                {"role": "user", "content": user_prompt}
+            ],
+            temperature=0.7,
+            max_tokens=route.max_tokens
         )
 
-        user_prompt = f"Сгенерируй пост на тему '{topic}' для платформы {platform}. Включи эмодзи и релевантные хештеги."
+        on_chunk = None
+        if on_update is not None:
+            on_chunk = lambda partial: on_update({platform: partial})
 
         try:
-            response = await client.chat.completions.create(
-                model="gpt-3.5-turbo", # Быстрый и адекватный для контента
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.7,
-                max_tokens=500
-            )
-            return response.choices[0].message.content
+            text = await self._chat_completion(request, user_id=user_id, on_chunk=on_chunk, route=route)
+            if not instructions:
+                self.cache.set(cache_key, text)
+            return text
         except Exception as e:
             logger.error(f"Ошибка генерации текста: {e}")
-            return f"❌ Ошибка AI-генерации текста. Тема: {topic}. Попробуйте позже."
-        
-    def format_post_preview(self, post_data: Dict) -> str:
-        """Красивый превью поста"""
-        text = f"📋 <b>ПРЕВЬЮ ПОСТА</b>\n\n"
-        text += f"🎯 <b>Тема:</b> {post_data['topic']}\n"
-        text += f"📂 <b>Ниша:</b> {post_data['niche'].capitalize()}\n"
-        text += f"🖼 <b>Фото:</b> ✅ Готово\n\n"
-        text += f"━━━━━━━━━━━━━━━━━━━━\n\n"
+            return f"{TEXT_ERROR_PREFIX}. Тема: {topic}. Попробуйте позже."
         
-        icons = {"tiktok": "🎵", "telegram": "✈️", "instagram": "📸", "vk": "🌐"}
+    async def generate_all_texts(self, topic: str, niche: str, platforms: Optional[list] = None,
+                                 force_fresh: bool = False, on_update=None,
+                                 user_id: Optional[int] = None) -> Dict[str, str]:
+        """Генерация текстов для всех платформ одним запросом (JSON)"""
+        platforms = platforms or PLATFORMS
+
+        # Сначала берём из кэша всё, что уже генерировалось
+        texts = {}
+        if not force_fresh:
+            for platform in platforms:
+                cached = self.cache.get(self.text_cache_key(topic, platform, niche))
+                if cached is not None:
+                    texts[platform] = cached
+
+        if texts and on_update is not None:
+            on_update(dict(texts))
+
+        pending = [p for p in platforms if p not in texts]
+
+        if pending and (not self.batch_generation or len(pending) == 1):
+            generated = await asyncio.gather(*[
+                self.generate_post_text(topic, p, niche, force_fresh=True, on_update=on_update, user_id=user_id)
+                for p in pending
+            ])
+            texts.update(zip(pending, generated))
+            pending = []
+
+        if pending:
+            texts.update(await self._generate_batch(topic, niche, pending, on_update=on_update, user_id=user_id))
+
+        return {p: texts[p] for p in platforms}
+
+    async def _generate_batch(self, topic: str, niche: str, platforms: list, on_update=None,
+                              user_id: Optional[int] = None) -> Dict[str, str]:
+        """Один JSON-запрос на несколько платформ с добором недостающих по одной"""
+        # Системный промпт тот же, что у запросов по одной платформе: формат JSON задаётся в конце
+        prompts = self.prompts.current()
+        user_prompt = prompts.render("batch", topic=topic, niche=niche, platforms=", ".join(platforms))
+        route = self.router.batch_route(platforms, niche)
+
+        request = dict(
+            model=route.model,
+            messages=[
+                {"role": "system", "content": prompts.system},
+                {"role": "user", "content": user_prompt}
+            ],
+            response_format={"type": "json_object"},
+            temperature=0.7,
+            max_tokens=route.max_tokens
+        )
+
+        on_chunk = None
+        if on_update is not None:
+            on_chunk = lambda partial: on_update(parse_partial_texts(partial, platforms))
+
+        texts = {}
+        try:
+            content = await self._chat_completion(request, user_id=user_id, on_chunk=on_chunk, route=route)
+            texts = self.parse_platform_texts(content, platforms)
+        except Exception as e:
+            logger.error(f"Ошибка пакетной генерации текста: {e}")
+
+        for platform, text in texts.items():
+            self.cache.set(self.text_cache_key(topic, platform, niche), text)
+
+        # Для платформ, которые не удалось разобрать, делаем отдельные запросы
+        missing = [p for p in platforms if p not in texts]
+        if missing:
+            logger.warning(f"Пакетная генерация не вернула тексты для: {', '.join(missing)}")
+            fallback = await asyncio.gather(*[
+                self.generate_post_text(topic, p, niche, force_fresh=True, on_update=on_update, user_id=user_id)
+                for p in missing
+            ])
+            texts.update(zip(missing, fallback))
+
+        return texts
+
+    async def _chat_completion(self, request: Dict, user_id: Optional[int] = None, on_chunk=None,
+                               route: Optional[Route] = None) -> str:
+        """Запрос к GPT через общий планировщик, с таймаутами, повторами и дублированием.
+
+        С on_chunk ответ стримится: колбэк получает весь накопленный текст после каждого фрагмента.
+        route — модели-кандидаты: каждая попытка берёт здоровую модель, которая ещё не подвела этот запрос.
+        """
+        tokens = estimate_tokens(request["messages"], request["max_tokens"])
+        route = route or Route([request["model"]], request["max_tokens"])
+        failed = set()
+
+        async def attempt(timeout: float) -> str:
+            model = self.router.choose(route, exclude=failed)
+            if model != route.model:
+                self.metrics.inc("smm_model_failovers_total", model=route.model, fallback=model)
+            async with self.text_limiter.slot(user_id, tokens):
+                with self.track_openai("chat", model):
+                    started = time.monotonic()
+                    try:
+                        content = await asyncio.wait_for(
+                            self._request_completion(dict(request, model=model), on_chunk), timeout
+                        )
+                    except Exception as e:
+                        # Ошибки самого запроса (неверные параметры и т.п.) о здоровье модели не говорят
+                        if is_retryable(e):
+                            failed.add(model)
+                            self.router.record(model, time.monotonic() - started, ok=False,
+                                               max_tokens=request["max_tokens"])
+                        raise
+                    seconds = time.monotonic() - started
+                    self.text_latency[(model, request["max_tokens"])].record(seconds)
+                    self.router.record(model, seconds, ok=True, max_tokens=request["max_tokens"])
+                    return content
+
+        # Стрим дублировать нельзя: два потока писали бы в одно превью
+        hedge_after = None
+        if self.hedging and on_chunk is None:
+            latency = self.text_latency[(self.router.choose(route), request["max_tokens"])]
+            hedge_after = latency.percentile(self.hedge_percentile)
+
+        return await call_with_retry(attempt, self.text_retry, hedge_after=hedge_after)
+
+    async def _request_completion(self, request: Dict, on_chunk=None) -> str:
+        if on_chunk is None:
+            response = await client.chat.completions.create(**request)
+            self.record_usage(request["model"], response.usage)
+            return response.choices[0].message.content
+
+        # В стриме расход токенов приходит последним фрагментом без choices
+        stream = await client.chat.completions.create(stream=True, stream_options={"include_usage": True}, **request)
+        content = ""
+        async for chunk in stream:
+            if not chunk.choices:
+                self.record_usage(request["model"], getattr(chunk, "usage", None))
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                content += delta
+                on_chunk(content)
+        return content
+
+    @contextmanager
+    def track_openai(self, kind: str, model: str):
+        """Счётчик и гистограмма длительности одного запроса к OpenAI с его исходом"""
+        outcome = "ok"
+        started = time.perf_counter()
+        try:
+            yield
+        except asyncio.CancelledError:
+            # Например, проигравший дублирующий запрос
+            outcome = "cancelled"
+            raise
+        except Exception as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            self.metrics.observe("smm_openai_request_seconds", time.perf_counter() - started, kind=kind, model=model)
+            self.metrics.inc("smm_openai_requests_total", kind=kind, model=model, outcome=outcome)
+
+    def record_usage(self, model: str, usage):
+        if usage is None:
+            return
+        charge(tokens=(usage.prompt_tokens or 0) + (getattr(usage, "completion_tokens", 0) or 0))
+        self.metrics.inc("smm_openai_tokens_total", usage.prompt_tokens or 0, model=model, type="prompt")
+        # У эмбеддингов completion_tokens нет
+        if hasattr(usage, "completion_tokens"):
+            self.metrics.inc("smm_openai_tokens_total", usage.completion_tokens or 0, model=model, type="completion")
+        # Часть prompt, взятая из кэша промптов OpenAI (дешевле и быстрее)
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", None) if details is not None else None
+        if cached:
+            self.metrics.inc("smm_openai_tokens_total", cached, model=model, type="cached")
+
+    async def embed_topic(self, topic: str, user_id: Optional[int] = None):
+        """Эмбеддинг темы (кэшируется); None, если получить его не удалось"""
+        cache_key = ResponseCache.make_key("embedding", topic, EMBEDDING_MODEL)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return decode_vector(cached)
         
-        for platform, content in post_data['platforms'].items():
-            icon = icons.get(platform, "📱")
-            text += f"{icon} <b>{platform.upper()}</b>\n"
-            text += f"{content['text']}\n\n"
+        async def attempt(timeout: float):
+            async with self.text_limiter.slot(user_id, estimate_tokens([{"content": topic}], 0)):
+                with self.track_openai("embedding", EMBEDDING_MODEL):
+                    response = await asyncio.wait_for(
+                        client.embeddings.create(model=EMBEDDING_MODEL, input=topic), timeout
+                    )
+            self.record_usage(EMBEDDING_MODEL, response.usage)
+            return response.data[0].embedding
         
-        return text
+        try:
+            vector = await call_with_retry(attempt, self.embedding_retry)
+        except Exception as e:
+            logger.error(f"Ошибка получения эмбеддинга темы: {e}")
+            return None
+        self.cache.set(cache_key, encode_vector(vector))
+        return vector
+    
+    async def find_similar_topics(self, topic: str, niche: str, user_id: Optional[int] = None) -> list:
+        """Прошлые посты пользователя в нише на похожую тему (пусто, если индекса нет или тем ещё нет)"""
+        if self.topics is None or user_id is None or not self.topics.has_niche(niche, user_id):
+            return []
+        vector = await self.embed_topic(topic, user_id)
+        if vector is None:
+            return []
+        return self.topics.search(vector, niche, user_id, threshold=self.similar_threshold)
+    
+    async def remember_topic(self, post_data: Dict, user_id: Optional[int] = None):
+        """Добавить черновик пользователя в индекс тем (один раз на пост; неудачные не добавляются)"""
+        if self.topics is None or user_id is None or self.topics.contains(post_data['id']):
+            return
+        # Черновик с ошибкой генерации вместо текста или заглушкой вместо фото предлагать незачем
+        if post_data.get('image_url') == IMAGE_PLACEHOLDER_URL or any(
+            content['text'].startswith(TEXT_ERROR_PREFIX) for content in post_data['platforms'].values()
+        ):
+            return
+        vector = await self.embed_topic(post_data['topic'], user_id)
+        if vector is None:
+            return
+        snapshot = {key: post_data[key] for key in
+                    ("id", "topic", "niche", "platforms", "image_url", "image_hash", "image_variants")}
+        self.topics.add(vector, post_data['niche'], post_data['topic'], snapshot, user_id)
+    
+    async def answer_comments(self, comments: list) -> Dict[str, str]:
+        """Ответы GPT на пачку нетиповых комментариев одним запросом: {id комментария: ответ}"""
+        route = self.router.route("comments")
+        content = await self._chat_completion(build_reply_request(comments, route.model), route=route)
+        return parse_replies(content, comments)
+    
+    @staticmethod
+    def parse_platform_texts(content: Optional[str], platforms: list) -> Dict[str, str]:
+        """Разбор JSON-ответа модели: только непустые строки для известных платформ"""
+        try:
+            data = json.loads(content or "")
+        except ValueError:
+            return {}
+
+        if not isinstance(data, dict):
+            return {}
+
+        # Модель может вернуть ключи в другом регистре ("TikTok", "VK")
+        data = {str(key).strip().lower(): value for key, value in data.items()}
+
+        texts = {}
+        for platform in platforms:
+            value = data.get(platform)
+            if isinstance(value, str) and value.strip():
+                texts[platform] = value.strip()
+        return texts
 
 # Инициализация бота
 smm_bot = SMMBot()
@@ -117,6 +608,8 @@ smm_bot = SMMBot()
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Стартовое сообщение"""
     user = update.effective_user
+    # /start посреди генерации: начатый пост больше не нужен
+    await cancel_generation(context.bot, user.id)
     
     keyboard = [
         [InlineKeyboardButton("🚀 Создать пост", callback_data="create_post")],
@@ -157,21 +650,16 @@ async def choose_niche(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
-    keyboard = [
-        [InlineKeyboardButton("🚗 Автомобили", callback_data="niche_auto")],
-        [InlineKeyboardButton("🏡 Недвижимость", callback_data="niche_realestate")],
-        [InlineKeyboardButton("◀️ Назад", callback_data="back_to_start")]
-    ]
+    niches = smm_bot.prompts.current().niches.values()
+    keyboard = [[InlineKeyboardButton(niche.title, callback_data=f"niche_{niche.key}")] for niche in niches]
+    keyboard.append([InlineKeyboardButton("◀️ Назад", callback_data="back_to_start")])
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    text = """
+    descriptions = "\n\n".join(f"<b>{niche.title}</b>\n    {niche.description}" for niche in niches)
+    text = f"""
 <b>📂 Выберите тематику контента:</b>
 
-🚗 <b>Автомобили</b>
-    Премиум авто, новинки, тест-драйвы
-
-🏡 <b>Недвижимость</b>
-    Элитное жильё, новостройки, инвестиции
+{descriptions}
 
 Выберите нишу для создания поста:
     """
@@ -189,30 +677,26 @@ async def handle_niche_selection(update: Update, context: ContextTypes.DEFAULT_T
     query = update.callback_query
     await query.answer()
     
-    niche_map = {
-        "niche_auto": "автомобили",
-        "niche_realestate": "недвижимость"
-    }
-    
-    niche = niche_map.get(query.data)
-    context.user_data['niche'] = niche
-    
     keyboard = [
         [InlineKeyboardButton("◀️ Назад", callback_data="create_post")]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    examples = {
-        "автомобили": "Например:\n• BMW X5 2025: новая эра комфорта\n• Tesla Model Y для семьи\n• Электрокары будущего",
-        "недвижимость": "Например:\n• Пентхаус с панорамным видом\n• Квартира у моря в Сочи\n• Таунхаус в закрытом поселке"
-    }
+    niche = smm_bot.prompts.current().niche(query.data[len("niche_"):])
+    if niche is None:
+        # Ниша пропала из реестра после перезагрузки, а кнопка осталась в старом сообщении
+        await query.edit_message_text("❌ Эта ниша больше недоступна. Выберите другую.", reply_markup=reply_markup)
+        return ENTERING_TOPIC
+    context.user_data['niche'] = niche.name
+    
+    examples = "Например:\n" + "\n".join(f"• {example}" for example in niche.examples)
     
     text = f"""
 <b>✍️ Введите тему поста</b>
 
-<b>Выбрана ниша:</b> {niche.capitalize()} ✅
+<b>Выбрана ниша:</b> {niche.name.capitalize()} ✅
 
-{examples[niche]}
+{examples}
 
 <i>Напишите тему своего поста:</i>
     """
@@ -229,47 +713,250 @@ async def handle_topic_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
     """Обработка темы и генерация контента"""
     topic = update.message.text
     niche = context.user_data.get('niche', 'автомобили')
+    user_id = update.effective_user.id
     
-    # Показываем процесс генерации
-    status_msg = await update.message.reply_text(
-        "⏳ <b>Генерирую контент...</b>\n\n"
-        "🤖 AI создаёт тексты для всех платформ и подбирает фото. Это займет ~5-10 секунд...",
-        parse_mode='HTML'
+    # На похожую тему уже есть посты: предлагаем взять готовый вместо новой генерации
+    similar = await smm_bot.find_similar_topics(topic, niche, user_id)
+    if similar:
+        context.user_data['pending_topic'] = topic
+        lines = [f"🔎 <b>Похожие посты уже есть</b>\n\nВаша тема: {html.escape(topic)}\n"]
+        keyboard = []
+        for found in similar:
+            lines.append(f"• {html.escape(found.topic)} — сходство {found.score:.0%}")
+            keyboard.append([InlineKeyboardButton(f"📋 {found.topic[:40]}", callback_data=f"reuse_{found.row}")])
+        keyboard.append([InlineKeyboardButton("✨ Создать новый пост", callback_data="reuse_new")])
+        lines.append("\nВозьмите готовый черновик (тексты и фото появятся сразу) или создайте новый.")
+        await update.message.reply_text(
+            "\n".join(lines), parse_mode='HTML', reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+        return ENTERING_TOPIC
+    
+    return await enqueue_generation(update.message, user_id, topic, niche)
+
+async def reuse_similar_post(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Выбор между готовым черновиком на похожую тему и новой генерацией"""
+    query = update.callback_query
+    await query.answer()
+    
+    user_id = update.effective_user.id
+    topic = context.user_data.pop('pending_topic', None)
+    niche = context.user_data.get('niche', 'автомобили')
+    found = None
+    if query.data != "reuse_new":
+        found = smm_bot.topics.get(int(query.data[len("reuse_"):]), user_id) if smm_bot.topics else None
+    
+    if found is None:
+        if not topic:
+            await query.message.reply_text("❌ Тема не найдена. Напишите её ещё раз.")
+            return ENTERING_TOPIC
+        smm_bot.metrics.inc("smm_topic_reuse_total", outcome="new")
+        return await enqueue_generation(query.message, user_id, topic, niche)
+    
+    # Новый черновик из сохранённого: свой id, чтобы публикация не считалась повтором старой
+    await cancel_generation(context.bot, user_id)
+    post_data = dict(found.post)
+    post_data['id'] = f"post_{user_id}_{int(datetime.now().timestamp() * 1000)}"
+    post_data['platforms'] = {platform: dict(value) for platform, value in found.post['platforms'].items()}
+    post_data['status'] = "draft"
+    smm_bot.drafts.put(user_id, post_data)
+    smm_bot.metrics.inc("smm_topic_reuse_total", outcome="reused")
+    
+    await send_preview(
+        context.bot, query.message.chat_id, smm_bot.preview.render(post_data), review_keyboard(),
+        message_id=query.message.message_id
     )
+    speculate_variants(user_id, post_data)
+    
+    return REVIEWING
+
+async def regenerate_post(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Повторная генерация поста в обход кэша"""
+    query = update.callback_query
+    await query.answer()
     
-    # Генерируем контент
-    platforms = ["tiktok", "telegram", "instagram", "vk"]
-    generated_content = {}
+    user_id = update.effective_user.id
+    post_data = smm_bot.drafts.get(user_id)
     
-    # Асинхронно запускаем генерацию текста и фото
-    tasks = []
-    for platform in platforms:
-        tasks.append(smm_bot.generate_post_text(topic, platform, niche))
-        
-    # Получаем фото
-    keywords = [topic] 
-    tasks.append(smm_bot.generate_image_url(keywords, niche))
+    if not post_data:
+        await query.edit_message_text("❌ Пост не найден. Создайте новый.")
+        return ConversationHandler.END
     
-    results = await asyncio.gather(*tasks)
+    # Если заранее готовы варианты всех текстов и фото, новый пост собирается из них сразу
+    if smm_bot.speculation and serve_variants(post_data, list(REGENERATION_TARGETS)):
+        smm_bot.drafts.put(user_id, post_data)
+        smm_bot.drafts.flush()
+        await send_preview(context.bot, query.message.chat_id, smm_bot.preview.render(post_data), review_keyboard())
+        speculate_variants(user_id, post_data)
+        return REVIEWING
     
-    image_url = results[-1]
-    text_results = results[:-1]
+    return await enqueue_generation(
+        query.message, user_id, post_data['topic'], post_data['niche'], force_fresh=True
+    )
+
+async def enqueue_generation(message, user_id: int, topic: str, niche: str, force_fresh: bool = False):
+    """Постановка генерации в фоновую очередь: обработчик сразу освобождается, превью пришлёт воркер"""
+    # Очередь к AI переполнена: не ставим новые запросы, состояние диалога не меняем
+    if smm_bot.text_limiter.is_full() or smm_bot.image_limiter.is_full():
+        await message.reply_text("⏳ Сейчас очень много запросов к AI. Попробуйте ещё раз через минуту.")
+        return None
+    
+    # Новая тема заменяет пост, который ещё генерируется
+    await cancel_generation(message.get_bot(), user_id, "🚫 Генерация остановлена: вы отправили новую тему.")
+    
+    status_msg = await message.reply_text("🕐 <b>Тема принята, пост в очереди на генерацию...</b>", parse_mode='HTML')
+    
+    post_id = f"post_{user_id}_{int(datetime.now().timestamp() * 1000)}"
+    smm_bot.jobs.submit(
+        "generate",
+        user_id,
+        {
+            "chat_id": message.chat_id,
+            "status_message_id": status_msg.message_id,
+            "post_id": post_id,
+            "topic": topic,
+            "niche": niche,
+            "force_fresh": force_fresh
+        },
+        job_id=f"generate:{user_id}:{post_id}",
+        priority=PRIORITY_INTERACTIVE
+    )
     
-    for i, platform in enumerate(platforms):
-        generated_content[platform] = {"text": text_results[i]}
+    return REVIEWING
+
+async def cancel_generation(bot, user_id: int, notice: str = "🚫 Генерация отменена."):
+    """Отмена генерации пользователя, которая ещё в очереди или выполняется"""
+    # Черновик отменяют или заменяют новым: его запасные варианты больше не понадобятся
+    drop_speculation(user_id)
+    for job in smm_bot.jobs.cancel(user_id, GENERATION_JOB_KINDS):
+        smm_bot.metrics.inc("smm_jobs_cancelled_total", kind=job.kind)
+        try:
+            await bot.edit_message_text(
+                notice, chat_id=job.payload['chat_id'], message_id=job.payload['status_message_id']
+            )
+        except Exception as e:
+            logger.warning(f"Не удалось обновить статус отменённой генерации: {e}")
+
+async def run_generation_job(bot, job: Job):
+    """Выполнение фоновой задачи генерации поста"""
+    payload = job.payload
+    await generate_and_preview(
+        bot,
+        payload['chat_id'],
+        job.user_id,
+        payload['topic'],
+        payload['niche'],
+        payload['post_id'],
+        force_fresh=payload['force_fresh'],
+        status_message_id=payload['status_message_id'],
+        job_id=job.id
+    )
+    # Черновик сразу пишем в базу: его может читать бот из другого процесса
+    smm_bot.drafts.flush()
+    # В индекс тем — уже после того, как превью отправлено
+    post_data = smm_bot.drafts.get(job.user_id)
+    if post_data and post_data['id'] == payload['post_id']:
+        # Пока пользователь читает превью, готовим запасные варианты
+        speculate_variants(job.user_id, post_data)
+        await smm_bot.remember_topic(post_data, job.user_id)
+
+@functools.lru_cache(maxsize=None)
+def review_keyboard(edit_label: str = "✏️ Редактировать") -> InlineKeyboardMarkup:
+    """Кнопки под превью поста (разметка неизменяемая, поэтому собирается один раз на каждую подпись)"""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("✅ Одобрить и опубликовать", callback_data="approve")],
+        [InlineKeyboardButton("🕒 Запланировать публикацию", callback_data="schedule")],
+        [InlineKeyboardButton(edit_label, callback_data="edit")],
+        [InlineKeyboardButton("🔄 Сгенерировать заново", callback_data="regenerate")],
+        [InlineKeyboardButton("🔁 Перегенерировать часть", callback_data="partial")],
+        [InlineKeyboardButton("🖼 Показать фото", callback_data="show_image")],
+        [InlineKeyboardButton("❌ Отменить", callback_data="cancel")]
+    ])
+
+async def generate_and_preview(bot, chat_id: int, user_id: int, topic: str, niche: str, post_id: str,
+                               force_fresh: bool = False, status_message_id: Optional[int] = None,
+                               job_id: Optional[str] = None):
+    """Генерация контента и отправка превью в чат"""
+    # Показываем процесс генерации (в сообщении о постановке в очередь, если оно есть)
+    status_msg = None
+    if status_message_id:
+        try:
+            status_msg = await bot.edit_message_text(
+                GENERATING_TEXT, chat_id=chat_id, message_id=status_message_id, parse_mode='HTML'
+            )
+        except Exception as e:
+            logger.warning(f"Не удалось обновить статус генерации: {e}")
+    if status_msg is None:
+        status_msg = await bot.send_message(chat_id, GENERATING_TEXT, parse_mode='HTML')
+    
+    # Пока запросы ждут в общей очереди, показываем позицию в ней
+    queue_reporter = asyncio.create_task(report_queue_position(status_msg, user_id))
     
     # Сохраняем пост
     post_data = {
-        "id": f"post_{int(datetime.now().timestamp())}",
+        "id": post_id,
         "topic": topic,
         "niche": niche,
-        "platforms": generated_content,
-        "image_url": image_url,
+        "platforms": {platform: {"text": "⏳ Генерируется..."} for platform in PLATFORMS},
+        "image_url": None,
+        "image_hash": None,
+        "image_variants": {},
         "status": "draft"
     }
     
-    user_id = update.effective_user.id
-    smm_bot.pending_posts[user_id] = post_data
+    # В потоковом режиме статусное сообщение само превращается в превью
+    editor = None
+    on_update = None
+    if smm_bot.streaming:
+        editor = ThrottledEditor(status_msg, min_interval=smm_bot.stream_edit_interval)
+        
+        def on_update(texts: Dict[str, str]):
+            queue_reporter.cancel()
+            for platform, text in texts.items():
+                post_data['platforms'][platform]['text'] = text
+            editor.update(smm_bot.preview.render_single(post_data))
+    
+    # Асинхронно запускаем генерацию текстов (одним запросом) и фото
+    keywords = [topic] 
+    try:
+        with generation_deadline(smm_bot.generation_deadline):
+            text_results, (image_url, image_hash, image_variants) = await asyncio.gather(
+                smm_bot.generate_all_texts(
+                    topic, niche, PLATFORMS, force_fresh=force_fresh, on_update=on_update, user_id=user_id
+                ),
+                smm_bot.generate_image(keywords, niche, force_fresh=force_fresh, user_id=user_id)
+            )
+    finally:
+        queue_reporter.cancel()
+    
+    for platform in PLATFORMS:
+        post_data['platforms'][platform]['text'] = text_results[platform]
+    post_data['image_url'] = image_url
+    post_data['image_hash'] = image_hash
+    post_data['image_variants'] = image_variants
+    
+    # Задачу могли отменить из другого процесса, пока шла генерация: превью уже не нужно
+    if job_id and smm_bot.jobs.is_cancelled(job_id):
+        return
+    
+    smm_bot.drafts.put(user_id, post_data)
+    smm_bot.metrics.count_event("posts_generated", user_id)
+    for platform in PLATFORMS:
+        smm_bot.metrics.inc("smm_posts_generated_total", platform=platform)
+    
+    # Показываем превью
+    pages = smm_bot.preview.render(post_data)
+    
+    reply_markup = review_keyboard()
+    
+    if editor is not None:
+        # Кнопки — под последним сообщением превью
+        editor.update(pages[0], reply_markup=reply_markup if len(pages) == 1 else None)
+        if await editor.flush():
+            await send_preview(bot, chat_id, pages[1:], reply_markup)
+        else:
+            # Последняя правка не прошла: без превью и кнопок пользователю нечего делать дальше
+            await send_preview(bot, chat_id, pages, reply_markup)
+        return
     
     await status_msg.edit_text(
         "✅ <b>Контент готов!</b>\n\n"
@@ -278,26 +965,48 @@ async def handle_topic_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
         parse_mode='HTML'
     )
     
-    await asyncio.sleep(1)
-    
-    # Показываем превью
-    preview_text = smm_bot.format_post_preview(post_data)
-    
-    keyboard = [
-        [InlineKeyboardButton("✅ Одобрить и опубликовать", callback_data="approve")],
-        [InlineKeyboardButton("✏️ Редактировать", callback_data="edit")],
-        [InlineKeyboardButton("🖼 Показать фото", callback_data="show_image")],
-        [InlineKeyboardButton("❌ Отменить", callback_data="cancel")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await update.message.reply_text(
-        preview_text,
-        parse_mode='HTML',
-        reply_markup=reply_markup
-    )
-    
-    return REVIEWING
+    await send_preview(bot, chat_id, pages, reply_markup)
+
+async def send_preview(bot, chat_id: int, pages: List[str], reply_markup: InlineKeyboardMarkup,
+                       message_id: Optional[int] = None):
+    """Отправка сообщений превью по порядку с кнопками под последним.
+
+    Если задан message_id, первое сообщение заменяет текст этого сообщения (а если его уже
+    нельзя изменить, отправляется новым). Под новым превью кнопки снова активны, поэтому
+    прежние нажатия в этом сообщении забываются.
+    """
+    if message_id is not None:
+        smm_bot.actions.forget((chat_id, message_id))
+    for index, page in enumerate(pages):
+        markup = reply_markup if index == len(pages) - 1 else None
+        if index == 0 and message_id is not None:
+            try:
+                await bot.edit_message_text(
+                    page, chat_id=chat_id, message_id=message_id, parse_mode='HTML', reply_markup=markup
+                )
+                continue
+            except Exception as e:
+                logger.warning(f"Не удалось заменить сообщение превью, отправляю новое: {e}")
+        await bot.send_message(chat_id, page, parse_mode='HTML', reply_markup=markup)
+
+async def report_queue_position(status_msg, user_id: int):
+    """Обновление статуса генерации позицией пользователя в очереди к AI"""
+    shown = None
+    while True:
+        await asyncio.sleep(QUEUE_STATUS_INTERVAL)
+        position = smm_bot.text_limiter.position(user_id) or smm_bot.image_limiter.position(user_id)
+        if position == shown:
+            continue
+        shown = position
+        
+        if position:
+            text = f"⏳ <b>Генерирую контент...</b>\n\n👥 Ваша позиция в очереди: <b>{position}</b>"
+        else:
+            text = GENERATING_TEXT
+        try:
+            await status_msg.edit_text(text, parse_mode='HTML')
+        except Exception as e:
+            logger.warning(f"Не удалось обновить статус очереди: {e}")
 
 async def show_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать фото поста"""
@@ -305,24 +1014,26 @@ async def show_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     user_id = update.effective_user.id
-    post_data = smm_bot.pending_posts.get(user_id)
+    post_data = smm_bot.drafts.get(user_id)
     
     if not post_data:
         await query.edit_message_text("❌ Пост не найден. Создайте новый.")
         return ConversationHandler.END
     
-    keyboard = [
-        [InlineKeyboardButton("◀️ Назад к посту", callback_data="back_to_review")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    # Берём file_id или локальный файл; временная ссылка DALL-E — только если файла нет
+    image_hash = post_data.get('image_hash')
+    photo = smm_bot.images.photo(image_hash) if smm_bot.images else None
     
-    await query.message.reply_photo(
-        photo=post_data['image_url'],
-        caption=f"🖼 <b>Фото для поста:</b>\n{post_data['topic']}",
+    sent = await query.message.reply_photo(
+        photo=photo or post_data['image_url'],
+        caption=f"🖼 <b>Фото для поста:</b>\n{html.escape(post_data['topic'])}",
         parse_mode='HTML',
-        reply_markup=reply_markup
+        reply_markup=BACK_TO_REVIEW_KEYBOARD
     )
     
+    if smm_bot.images and photo is not None:
+        smm_bot.images.remember_file_id(image_hash, sent)
+    
     return REVIEWING
 
 async def back_to_review(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -331,29 +1042,18 @@ async def back_to_review(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     user_id = update.effective_user.id
-    post_data = smm_bot.pending_posts.get(user_id)
+    post_data = smm_bot.drafts.get(user_id)
     
-    if query.message.text:
-         # Если сообщение - это превью, просто его редактируем
-        edit_func = query.edit_message_text
-    else:
-        # Если это ответ на фото, нужно отправить новое сообщение
-        edit_func = query.message.reply_text
-        
-    preview_text = smm_bot.format_post_preview(post_data)
+    if not post_data:
+        await query.message.reply_text("❌ Пост не найден. Создайте новый.")
+        return ConversationHandler.END
     
-    keyboard = [
-        [InlineKeyboardButton("✅ Одобрить и опубликовать", callback_data="approve")],
-        [InlineKeyboardButton("✏️ Редактировать", callback_data="edit")],
-        [InlineKeyboardButton("🖼 Показать фото", callback_data="show_image")],
-        [InlineKeyboardButton("❌ Отменить", callback_data="cancel")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    # Текстовое сообщение (меню) заменяем превью, а под фото отправляем превью новым сообщением
+    message_id = query.message.message_id if query.message.text else None
     
-    await edit_func(
-        preview_text,
-        parse_mode='HTML',
-        reply_markup=reply_markup
+    await send_preview(
+        context.bot, query.message.chat_id, smm_bot.preview.render(post_data), review_keyboard(),
+        message_id=message_id
     )
     
     return REVIEWING
@@ -363,15 +1063,6 @@ async def edit_post(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
-    keyboard = [
-        [InlineKeyboardButton("🎵 TikTok", callback_data="edit_tiktok")],
-        [InlineKeyboardButton("✈️ Telegram", callback_data="edit_telegram")],
-        [InlineKeyboardButton("📸 Instagram", callback_data="edit_instagram")],
-        [InlineKeyboardButton("🌐 VK", callback_data="edit_vk")],
-        [InlineKeyboardButton("◀️ Назад", callback_data="back_to_review")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
     text = """
 <b>✏️ РЕДАКТИРОВАНИЕ ПОСТА</b>
 
@@ -383,7 +1074,7 @@ async def edit_post(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.edit_message_text(
         text,
         parse_mode='HTML',
-        reply_markup=reply_markup
+        reply_markup=EDIT_PLATFORMS_KEYBOARD
     )
     
     return EDITING
@@ -404,23 +1095,19 @@ async def select_platform_to_edit(update: Update, context: ContextTypes.DEFAULT_
     context.user_data['editing_platform'] = platform
     
     user_id = update.effective_user.id
-    post_data = smm_bot.pending_posts.get(user_id)
-    current_text = post_data['platforms'][platform]['text']
+    post_data = smm_bot.drafts.get(user_id)
     
-    keyboard = [
-        [InlineKeyboardButton("◀️ Отмена", callback_data="edit")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    if not post_data or not platform:
+        await query.edit_message_text("❌ Пост не найден. Создайте новый.")
+        return ConversationHandler.END
     
-    platform_names = {
-        "tiktok": "TikTok 🎵",
-        "telegram": "Telegram ✈️",
-        "instagram": "Instagram 📸",
-        "vk": "VK 🌐"
-    }
+    # Текст целиком не влезет в сообщение рядом с подсказкой, если он длиннее лимита Telegram
+    current_text = html.escape(post_data['platforms'][platform]['text'])
+    if len(current_text) > EDIT_TEXT_PREVIEW_LIMIT:
+        current_text = clip_escaped(current_text, EDIT_TEXT_PREVIEW_LIMIT) + ELLIPSIS
     
     text = f"""
-<b>✏️ Редактирование: {platform_names[platform]}</b>
+<b>✏️ Редактирование: {PLATFORM_TITLES[platform]}</b>
 
 <b>Текущий текст:</b>
 {current_text}
@@ -433,7 +1120,7 @@ async def select_platform_to_edit(update: Update, context: ContextTypes.DEFAULT_
     await query.edit_message_text(
         text,
         parse_mode='HTML',
-        reply_markup=reply_markup
+        reply_markup=CANCEL_EDIT_KEYBOARD
     )
     
     return EDITING
@@ -444,7 +1131,7 @@ async def save_edited_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     platform = context.user_data.get('editing_platform')
     
     user_id = update.effective_user.id
-    post_data = smm_bot.pending_posts.get(user_id)
+    post_data = smm_bot.drafts.get(user_id)
     
     if not platform or not post_data:
         await update.message.reply_text("❌ Произошла ошибка. Пожалуйста, начните сначала (/start).")
@@ -452,79 +1139,352 @@ async def save_edited_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Обновляем текст
     post_data['platforms'][platform]['text'] = new_text
-    
-    platform_names = {
-        "tiktok": "TikTok 🎵",
-        "telegram": "Telegram ✈️",
-        "instagram": "Instagram 📸",
-        "vk": "VK 🌐"
-    }
+    smm_bot.drafts.put(user_id, post_data)
     
     await update.message.reply_text(
-        f"✅ Текст для <b>{platform_names[platform]}</b> обновлён!",
+        f"✅ Текст для <b>{PLATFORM_TITLES[platform]}</b> обновлён!",
         parse_mode='HTML'
     )
     
     # Возвращаемся к превью
-    preview_text = smm_bot.format_post_preview(post_data)
+    await send_preview(
+        context.bot, update.message.chat_id, smm_bot.preview.render(post_data),
+        review_keyboard(edit_label="✏️ Редактировать ещё")
+    )
+    
+    # Сбрасываем платформу редактирования
+    context.user_data['editing_platform'] = None
+
+    return REVIEWING
+
+async def choose_regeneration(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Выбор части поста, которую нужно сгенерировать заново"""
+    query = update.callback_query
+    await query.answer()
+    
+    text = """
+<b>🔁 ПЕРЕГЕНЕРАЦИЯ</b>
+
+Выберите, что сгенерировать заново.
+Остальные тексты и фото останутся как есть.
+    """
+    
+    await query.edit_message_text(
+        text,
+        parse_mode='HTML',
+        reply_markup=REGENERATION_KEYBOARD
+    )
+    
+    return REGENERATING
+
+async def select_regeneration_target(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Запрос пожеланий к выбранной части поста"""
+    query = update.callback_query
+    await query.answer()
+    
+    target = query.data[len("regen_"):]
+    post_data = smm_bot.drafts.get(update.effective_user.id)
+    
+    if not post_data or target not in REGENERATION_TARGETS:
+        await query.edit_message_text("❌ Пост не найден. Создайте новый.")
+        return ConversationHandler.END
+    
+    context.user_data['regenerating'] = target
     
     keyboard = [
-        [InlineKeyboardButton("✅ Одобрить и опубликовать", callback_data="approve")],
-        [InlineKeyboardButton("✏️ Редактировать ещё", callback_data="edit")],
-        [InlineKeyboardButton("🖼 Показать фото", callback_data="show_image")],
-        [InlineKeyboardButton("❌ Отменить", callback_data="cancel")]
+        [InlineKeyboardButton("⚡ Без пожеланий", callback_data="regen_now")],
+        [InlineKeyboardButton("◀️ Назад", callback_data="partial")]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    await update.message.reply_text(
-        preview_text,
+    text = f"""
+<b>🔁 Перегенерация: {REGENERATION_TARGETS[target]}</b>
+
+Напишите пожелания, например: <i>короче</i>, <i>больше эмодзи</i>, <i>без хештегов</i>.
+
+Или сгенерируйте заново без пожеланий 👇
+    """
+    
+    await query.edit_message_text(
+        text,
         parse_mode='HTML',
         reply_markup=reply_markup
     )
     
-    # Сбрасываем платформу редактирования
-    context.user_data['editing_platform'] = None
+    return REGENERATING
 
+async def regenerate_part(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Перегенерация выбранной части: кнопка «Без пожеланий» или сообщение с пожеланиями"""
+    if update.callback_query:
+        await update.callback_query.answer()
+        message = update.callback_query.message
+        instructions = None
+    else:
+        message = update.message
+        instructions = update.message.text.strip()
+    
+    user_id = update.effective_user.id
+    target = context.user_data.get('regenerating')
+    post_data = smm_bot.drafts.get(user_id)
+    
+    if not target or not post_data:
+        await message.reply_text("❌ Произошла ошибка. Пожалуйста, начните сначала (/start).")
+        return ConversationHandler.END
+    
+    # Готовый запасной вариант без пожеланий выдаётся сразу, без запроса к AI
+    if instructions is None and smm_bot.speculation and serve_variants(post_data, [target]):
+        smm_bot.drafts.put(user_id, post_data)
+        smm_bot.drafts.flush()
+        smm_bot.metrics.inc("smm_partial_regenerations_total", target=target)
+        context.user_data['regenerating'] = None
+        # Новым сообщением, как и результат перегенерации через очередь
+        await send_preview(
+            context.bot, message.chat_id,
+            smm_bot.preview.render(post_data, prefix=f"✅ Обновлено: {REGENERATION_TARGETS[target]}\n\n"),
+            review_keyboard()
+        )
+        speculate_variants(user_id, post_data, [target])
+        return REVIEWING
+    
+    if smm_bot.text_limiter.is_full() or smm_bot.image_limiter.is_full():
+        await message.reply_text("⏳ Сейчас очень много запросов к AI. Попробуйте ещё раз через минуту.")
+        return None
+    
+    status_msg = await message.reply_text(
+        f"🔁 <b>Генерирую заново: {REGENERATION_TARGETS[target]}...</b>", parse_mode='HTML'
+    )
+    job = smm_bot.jobs.submit(
+        "regenerate_part",
+        user_id,
+        {
+            "chat_id": message.chat_id,
+            "status_message_id": status_msg.message_id,
+            "post_id": post_data['id'],
+            "target": target,
+            "instructions": instructions
+        },
+        # Одна и та же часть поста не перегенерируется дважды одновременно
+        job_id=f"regenerate_part:{user_id}:{post_data['id']}:{target}",
+        priority=PRIORITY_INTERACTIVE
+    )
+    if job.payload['status_message_id'] != status_msg.message_id:
+        await status_msg.edit_text("⏳ Эта часть уже генерируется заново, дождитесь результата.")
+    
+    context.user_data['regenerating'] = None
+    
     return REVIEWING
 
+async def run_partial_job(bot, job: Job):
+    """Фоновая перегенерация одного текста или фото: остальная часть черновика не меняется"""
+    payload = job.payload
+    chat_id = payload['chat_id']
+    target = payload['target']
+    
+    post_data = smm_bot.drafts.get(job.user_id)
+    if not post_data or post_data['id'] != payload['post_id']:
+        await bot.edit_message_text(
+            "❌ Пост уже неактуален. Создайте новый.", chat_id=chat_id, message_id=payload['status_message_id']
+        )
+        return
+    
+    with generation_deadline(smm_bot.generation_deadline):
+        if target == "image":
+            image = await smm_bot.generate_image(
+                [post_data['topic']], post_data['niche'], force_fresh=True, user_id=job.user_id,
+                instructions=payload['instructions']
+            )
+        else:
+            text = await smm_bot.generate_post_text(
+                post_data['topic'], target, post_data['niche'], force_fresh=True, user_id=job.user_id,
+                instructions=payload['instructions'], current_text=post_data['platforms'][target]['text']
+            )
+    
+    # Пока шла генерация, черновик могли отредактировать или заменить новым постом
+    post_data = smm_bot.drafts.get(job.user_id)
+    if not post_data or post_data['id'] != payload['post_id']:
+        await bot.edit_message_text(
+            "❌ Пост уже неактуален. Создайте новый.", chat_id=chat_id, message_id=payload['status_message_id']
+        )
+        return
+    
+    if smm_bot.jobs.is_cancelled(job.id):
+        return
+    
+    notice = f"✅ Обновлено: {REGENERATION_TARGETS[target]}"
+    if target == "image":
+        if image[0] == IMAGE_PLACEHOLDER_URL:
+            # Не заменяем готовое фото заглушкой
+            notice = "❌ Не удалось сгенерировать фото заново. Фото осталось прежним."
+        else:
+            post_data['image_url'], post_data['image_hash'], post_data['image_variants'] = image
+    elif text.startswith(TEXT_ERROR_PREFIX):
+        # Не заменяем рабочий текст сообщением об ошибке
+        notice = f"❌ Не удалось сгенерировать заново: {REGENERATION_TARGETS[target]}. Текст остался прежним."
+    else:
+        post_data['platforms'][target]['text'] = text
+    
+    smm_bot.drafts.put(job.user_id, post_data)
+    smm_bot.drafts.flush()
+    smm_bot.metrics.inc("smm_partial_regenerations_total", target=target)
+    
+    await send_preview(
+        bot, chat_id, smm_bot.preview.render(post_data, prefix=f"{notice}\n\n"), review_keyboard(),
+        message_id=payload['status_message_id']
+    )
+
+def speculate_variants(user_id: int, post_data: Dict, targets: Optional[list] = None):
+    """Заранее сгенерировать запасные варианты частей черновика, пока пользователь читает превью.
+
+    Задача ставится, только если у AI сейчас есть свободная ёмкость; части, для которых
+    вариант уже готов, заново не генерируются.
+    """
+    if not smm_bot.speculation:
+        return
+    ready = ready_targets(post_data)
+    targets = [target for target in (targets or REGENERATION_TARGETS) if target not in ready]
+    if smm_bot.jobs.count_active("speculate") >= smm_bot.speculation_concurrency:
+        skipped = targets
+    else:
+        skipped = [target for target in targets if not has_spare_capacity(target)]
+    for target in skipped:
+        smm_bot.metrics.inc("smm_speculative_variants_total", target=target, outcome="skipped")
+    targets = [target for target in targets if target not in skipped]
+    if not targets:
+        return
+    
+    smm_bot.jobs.submit(
+        "speculate",
+        user_id,
+        {"post_id": post_data['id'], "targets": targets},
+        job_id=f"speculate:{user_id}:{post_data['id']}:{','.join(targets)}",
+        priority=PRIORITY_SPECULATIVE
+    )
+
+def has_spare_capacity(target: str) -> bool:
+    limiter = smm_bot.image_limiter if target == "image" else smm_bot.text_limiter
+    return limiter.has_spare_capacity(smm_bot.speculation_headroom)
+
+async def run_speculation_job(job: Job):
+    """Фоновая генерация запасных вариантов: каждый готовый вариант сразу сохраняется в черновик"""
+    payload = job.payload
+    post_data = smm_bot.drafts.get(job.user_id)
+    if not post_data or post_data['id'] != payload['post_id']:
+        return
+    topic, niche = post_data['topic'], post_data['niche']
+    
+    async def speculate(target: str):
+        # Пока задача ждала в очереди, AI мог оказаться занят живыми запросами
+        if not has_spare_capacity(target):
+            smm_bot.metrics.inc("smm_speculative_variants_total", target=target, outcome="skipped")
+            return
+        with speculative_spend() as spend:
+            try:
+                if target == "image":
+                    value = await smm_bot.generate_image([topic], niche, force_fresh=True, user_id=SPECULATIVE_LANE)
+                    failed = value[0] == IMAGE_PLACEHOLDER_URL
+                else:
+                    value = await smm_bot.generate_post_text(
+                        topic, target, niche, force_fresh=True, user_id=SPECULATIVE_LANE
+                    )
+                    failed = value.startswith(TEXT_ERROR_PREFIX)
+            except asyncio.CancelledError:
+                # Черновик одобрили или отменили раньше, чем вариант был готов
+                record_speculation(target, "wasted", spend)
+                raise
+        if failed:
+            record_speculation(target, "failed", spend)
+            return
+        
+        # Пока шла генерация, черновик могли заменить или поправить, а задачу — отменить из другого процесса.
+        # Дописываем только вариант: черновик целиком из этого процесса может быть устаревшим
+        if smm_bot.jobs.is_cancelled(job.id) or not smm_bot.drafts.merge(
+            job.user_id, payload['post_id'], VARIANTS_KEY, {target: make_variant(value, spend)}
+        ):
+            record_speculation(target, "wasted", spend)
+            return
+        smm_bot.metrics.inc("smm_speculative_variants_total", target=target, outcome="ready")
+    
+    with generation_deadline(smm_bot.generation_deadline):
+        await asyncio.gather(*[speculate(target) for target in payload['targets']])
+
+def serve_variants(post_data: Dict, targets: list) -> bool:
+    """Подставить в черновик готовые варианты всех частей targets; False — готовы не все, черновик не меняется"""
+    if not set(targets) <= set(ready_targets(post_data)):
+        smm_bot.metrics.inc("smm_speculative_requests_total", outcome="miss")
+        return False
+    smm_bot.metrics.inc("smm_speculative_requests_total", outcome="hit")
+    for target in targets:
+        variant = take_variant(post_data, target)
+        if target == "image":
+            post_data['image_url'], post_data['image_hash'], post_data['image_variants'] = variant['value']
+        else:
+            post_data['platforms'][target]['text'] = variant['value']
+        record_speculation(target, "served", Spend(variant['tokens'], variant['images']))
+    return True
+
+def drop_speculation(user_id: int):
+    """Черновик одобрен, отменён или заменён: заранее начатые варианты больше не нужны"""
+    smm_bot.jobs.cancel(user_id, ["speculate"])
+    post_data = smm_bot.drafts.get(user_id)
+    if not post_data:
+        return
+    variants = take_all_variants(post_data)
+    for target, variant in variants.items():
+        record_speculation(target, "wasted", Spend(variant['tokens'], variant['images']))
+    if variants:
+        smm_bot.drafts.put(user_id, post_data)
+
+def record_speculation(target: str, outcome: str, spend: Spend):
+    """Исход заранее сгенерированного варианта; его расход — выдан пользователю или потрачен впустую"""
+    smm_bot.metrics.inc("smm_speculative_variants_total", target=target, outcome=outcome)
+    spent = "served" if outcome == "served" else "wasted"
+    smm_bot.metrics.inc("smm_speculative_tokens_total", spend.tokens, outcome=spent)
+    smm_bot.metrics.inc("smm_speculative_images_total", spend.images, outcome=spent)
+
 async def approve_and_publish(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Публикация поста"""
     query = update.callback_query
     await query.answer()
     
     user_id = update.effective_user.id
-    post_data = smm_bot.pending_posts.get(user_id)
+    drop_speculation(user_id)
+    post_data = smm_bot.drafts.get(user_id)
+    
+    if not post_data:
+        await query.message.reply_text("❌ Пост не найден. Создайте новый.")
+        return ConversationHandler.END
     
-    # Анимация публикации
     status_msg = await query.message.reply_text(
         "🚀 <b>ПУБЛИКАЦИЯ...</b>\n\n"
         "⏳ Подключаемся к платформам...",
         parse_mode='HTML'
     )
     
-    platforms = ["TikTok 🎵", "Telegram ✈️", "Instagram 📸", "VK 🌐"]
+    # Публикуем на все платформы параллельно, статус обновляется по мере готовности
+    editor = ThrottledEditor(status_msg, min_interval=smm_bot.stream_edit_interval)
+    progress = {}
     
-    for i, platform in enumerate(platforms, 1):
-        await asyncio.sleep(1)
-        await status_msg.edit_text(
-            f"🚀 <b>ПУБЛИКАЦИЯ...</b>\n\n"
-            f"{'✅ ' * i}{'⏳ ' * (4-i)}\n\n"
-            f"Публикуем в {platform}...",
-            parse_mode='HTML'
+    def on_progress(result: PublishResult):
+        progress[result.platform] = result
+        editor.update(
+            f"🚀 <b>ПУБЛИКАЦИЯ...</b>\n\n{format_publish_results(post_data, progress)}",
+            reply_markup=None
         )
     
-    await asyncio.sleep(1)
+    # Черновики, сгенерированные воркером в другом процессе, попадают в индекс тем при публикации
+    await smm_bot.remember_topic(post_data, user_id)
+    results = await smm_bot.publisher.publish(post_data, on_progress=on_progress)
+    record_publish_metrics(user_id, results)
+    remember_channel_post(post_data, results)
     
-    # Финальное сообщение
-    success_text = f"""
+    if results and all(result.ok for result in results.values()):
+        # Финальное сообщение
+        final_text = f"""
 ✅ <b>ПОСТ УСПЕШНО ОПУБЛИКОВАН!</b>
 
 📊 <b>Результаты:</b>
 
-🎵 TikTok: ✅ Опубликовано
-✈️ Telegram: ✅ Опубликовано  
-📸 Instagram: ✅ Опубликовано
-🌐 VK: ✅ Опубликовано
+{format_publish_results(post_data, results)}
 
 🎯 <b>Тема:</b> {post_data['topic']}
 ⏰ <b>Время:</b> {datetime.now().strftime("%H:%M")}
@@ -535,56 +1495,293 @@ async def approve_and_publish(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 Бот будет автоматически отвечать на вопросы подписчиков!
     """
+        keyboard = [
+            [InlineKeyboardButton("🚀 Создать ещё пост", callback_data="create_post")],
+            [InlineKeyboardButton("🏠 В главное меню", callback_data="back_to_start")]
+        ]
+        next_state = CHOOSING_NICHE
+        # Очищаем временные данные
+        smm_bot.drafts.delete(user_id)
+    else:
+        # Черновик оставляем: повторная публикация затронет только платформы с ошибкой
+        final_text = f"""
+⚠️ <b>ПОСТ ОПУБЛИКОВАН НЕ ВЕЗДЕ</b>
+
+📊 <b>Результаты:</b>
+
+{format_publish_results(post_data, results)}
+
+🎯 <b>Тема:</b> {post_data['topic']}
+
+Можно повторить публикацию — уже опубликованное не продублируется.
+    """
+        keyboard = [
+            [InlineKeyboardButton("🔁 Повторить публикацию", callback_data="approve")],
+            [InlineKeyboardButton("❌ Отменить", callback_data="cancel")]
+        ]
+        next_state = REVIEWING
+    
+    editor.update(final_text, reply_markup=InlineKeyboardMarkup(keyboard))
+    if not await editor.flush():
+        await query.message.reply_text(final_text, parse_mode='HTML', reply_markup=InlineKeyboardMarkup(keyboard))
+    
+    return next_state
+
+def remember_channel_post(post_data: Dict, results: Dict[str, PublishResult]):
+    """Под опубликованным постом в канале комментарии получат ответы по теме и нише поста"""
+    telegram_result = results.get("telegram")
+    if telegram_result and telegram_result.ok and telegram_result.external_id:
+        smm_bot.channel_posts.remember(telegram_result.external_id, post_data['niche'], post_data['topic'])
+
+async def choose_publish_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Выбор времени отложенной публикации"""
+    query = update.callback_query
+    await query.answer()
     
+    if not smm_bot.drafts.get(update.effective_user.id):
+        await query.message.reply_text("❌ Пост не найден. Создайте новый.")
+        return ConversationHandler.END
+    
+    now = datetime.now(smm_bot.timezone)
     keyboard = [
-        [InlineKeyboardButton("🚀 Создать ещё пост", callback_data="create_post")],
-        [InlineKeyboardButton("🏠 В главное меню", callback_data="back_to_start")]
+        [InlineKeyboardButton(label, callback_data=f"schedule_at_{int(moment.timestamp())}")]
+        for label, moment in publish_time_presets(now)
     ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    keyboard.append([InlineKeyboardButton("◀️ Назад к посту", callback_data="back_to_review")])
     
-    await status_msg.edit_text(
-        success_text,
+    await query.edit_message_text(
+        "🕒 <b>Когда опубликовать пост?</b>\n\n"
+        "Выберите время или напишите его сообщением:\n"
+        "<code>18:30</code> — сегодня (или завтра, если время прошло)\n"
+        "<code>25.12 10:00</code> — в этот день\n\n"
+        f"Сейчас: {now.strftime('%d.%m %H:%M')}",
         parse_mode='HTML',
-        reply_markup=reply_markup
+        reply_markup=InlineKeyboardMarkup(keyboard)
     )
     
-    # Очищаем временные данные
-    if user_id in smm_bot.pending_posts:
-        del smm_bot.pending_posts[user_id]
+    return SCHEDULING
+
+def publish_time_presets(now: datetime) -> list:
+    """Быстрый выбор времени: (подпись, момент)"""
+    in_hour = (now + timedelta(hours=1)).replace(second=0, microsecond=0)
+    in_hour -= timedelta(minutes=in_hour.minute % 5)
+    tomorrow = now + timedelta(days=1)
+    presets = [("⏱ Через час", in_hour)]
+    evening = now.replace(hour=18, minute=0, second=0, microsecond=0)
+    if evening - now > timedelta(minutes=30):
+        presets.append(("🌆 Сегодня в 18:00", evening))
+    presets.append(("🌅 Завтра в 10:00", tomorrow.replace(hour=10, minute=0, second=0, microsecond=0)))
+    presets.append(("🌆 Завтра в 18:00", tomorrow.replace(hour=18, minute=0, second=0, microsecond=0)))
+    return presets
+
+def format_publish_time(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, smm_bot.timezone).strftime("%d.%m в %H:%M")
+
+async def schedule_publication(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Постановка черновика в календарь: кнопка с готовым временем или время сообщением"""
+    if update.callback_query:
+        await update.callback_query.answer()
+        message = update.callback_query.message
+        publish_at = float(update.callback_query.data[len("schedule_at_"):])
+    else:
+        message = update.message
+        moment = parse_publish_time(update.message.text, datetime.now(smm_bot.timezone))
+        if moment is None:
+            await message.reply_text(
+                "❌ Не удалось разобрать время. Напишите, например, <code>18:30</code> или <code>25.12 10:00</code> "
+                "(не в прошлом и не дальше чем через 90 дней).",
+                parse_mode='HTML'
+            )
+            return None
+        publish_at = moment.timestamp()
+    
+    if publish_at <= time.time():
+        await message.reply_text("❌ Это время уже прошло. Выберите другое.")
+        return None
+    
+    user_id = update.effective_user.id
+    # Запасные варианты не нужны, и в календарь черновик попадает без них
+    drop_speculation(user_id)
+    post_data = smm_bot.drafts.get(user_id)
+    if not post_data:
+        await message.reply_text("❌ Пост не найден. Создайте новый.")
+        return ConversationHandler.END
+    
+    item = smm_bot.scheduler.schedule(post_data, user_id, message.chat_id, publish_at)
+    smm_bot.drafts.delete(user_id)
+    smm_bot.metrics.inc("smm_scheduled_total", outcome="scheduled")
+    
+    keyboard = [
+        [InlineKeyboardButton("🚫 Отменить публикацию", callback_data=f"unschedule_{item.id}")],
+        [InlineKeyboardButton("🚀 Создать ещё пост", callback_data="create_post")],
+        [InlineKeyboardButton("🏠 В главное меню", callback_data="back_to_start")]
+    ]
+    await message.reply_text(
+        f"🕒 <b>ПОСТ ЗАПЛАНИРОВАН</b>\n\n"
+        f"🎯 <b>Тема:</b> {html.escape(post_data['topic'])}\n"
+        f"⏰ <b>Публикация:</b> {format_publish_time(publish_at)}\n\n"
+        f"Все запланированные посты — /scheduled",
+        parse_mode='HTML',
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
     
     return CHOOSING_NICHE
 
+async def resolve_scheduled_image(post_data: Dict) -> Dict:
+    """Фото отложенного поста на момент публикации: из хранилища по хэшу, а не по ссылке DALL-E.
+
+    Ссылка DALL-E живёт около часа, поэтому к публикации она уже недействительна. Если файла
+    в хранилище нет и скачать картинку уже нельзя, пост публикуется без фото.
+    """
+    post_data = dict(post_data)
+    if smm_bot.images is None or not post_data.get('image_url') or post_data['image_url'] == IMAGE_PLACEHOLDER_URL:
+        return post_data
+    
+    if not smm_bot.images.path(post_data.get('image_hash')):
+        post_data['image_hash'] = await smm_bot.images.fetch(post_data['image_url'])
+        post_data['image_variants'] = {}
+    if not post_data['image_hash']:
+        logger.warning(f"Фото отложенного поста {post_data['id']} недоступно, публикуем без него")
+        post_data['image_url'] = None
+        return post_data
+    
+    variants = post_data.get('image_variants') or {}
+    if not all(smm_bot.images.path(digest) for digest in variants.values()):
+        variants = await smm_bot.image_variants(post_data['image_hash'])
+    post_data['image_variants'] = variants
+    return post_data
+
+async def publish_scheduled(bot, item: ScheduledPost) -> bool:
+    """Публикация из календаря, когда подошло её время"""
+    post_data = await resolve_scheduled_image(item.post)
+    results = await smm_bot.publisher.publish(post_data)
+    record_publish_metrics(item.user_id, results)
+    remember_channel_post(post_data, results)
+    
+    published = bool(results) and all(result.ok for result in results.values())
+    smm_bot.metrics.inc("smm_scheduled_total", outcome="published" if published else "failed")
+    title = "✅ <b>ОТЛОЖЕННЫЙ ПОСТ ОПУБЛИКОВАН</b>" if published else "⚠️ <b>ОТЛОЖЕННЫЙ ПОСТ ОПУБЛИКОВАН НЕ ВЕЗДЕ</b>"
+    try:
+        await bot.send_message(
+            item.chat_id,
+            f"{title}\n\n📊 <b>Результаты:</b>\n\n{format_publish_results(item.post, results)}\n\n"
+            f"🎯 <b>Тема:</b> {html.escape(item.post['topic'])}",
+            parse_mode='HTML'
+        )
+    except Exception as e:
+        logger.warning(f"Не удалось сообщить об отложенной публикации: {e}")
+    return published
+
+async def show_scheduled(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Запланированные публикации пользователя (/scheduled)"""
+    upcoming = smm_bot.scheduler.upcoming(update.effective_user.id)
+    
+    if not upcoming:
+        await update.message.reply_text("📭 Запланированных публикаций нет.")
+        return
+    
+    lines = ["🗓 <b>ЗАПЛАНИРОВАННЫЕ ПУБЛИКАЦИИ</b>\n"]
+    keyboard = []
+    for item in upcoming:
+        lines.append(f"⏰ {format_publish_time(item.publish_at)} — {html.escape(item.post['topic'])}")
+        keyboard.append([InlineKeyboardButton(
+            f"🚫 {format_publish_time(item.publish_at)}: {item.post['topic'][:30]}",
+            callback_data=f"unschedule_{item.id}"
+        )])
+    
+    await update.message.reply_text(
+        "\n".join(lines) + "\n\nНажмите на пост ниже, чтобы отменить его публикацию.",
+        parse_mode='HTML',
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+async def unschedule_publication(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отмена отложенной публикации"""
+    query = update.callback_query
+    post_id = query.data[len("unschedule_"):]
+    
+    if smm_bot.scheduler.cancel(post_id, update.effective_user.id):
+        smm_bot.metrics.inc("smm_scheduled_total", outcome="cancelled")
+        await query.answer("🚫 Публикация отменена")
+        await query.message.reply_text("🚫 Отложенная публикация отменена.")
+    else:
+        await query.answer("Пост уже опубликован или отменён", show_alert=True)
+
+def record_publish_metrics(user_id: int, results: Dict[str, PublishResult]):
+    """Учёт публикаций; повторы уже опубликованного не считаются"""
+    for platform, result in results.items():
+        if result.duplicate:
+            continue
+        smm_bot.metrics.inc("smm_publications_total", platform=platform, outcome="ok" if result.ok else "error")
+        if result.ok:
+            smm_bot.metrics.count_event(f"published:{platform}", user_id)
+    
+    if results and all(result.ok for result in results.values()):
+        smm_bot.metrics.count_event("posts_published", user_id)
+
+def format_publish_results(post_data: Dict, results: Dict[str, PublishResult]) -> str:
+    """Строки статуса публикации по платформам"""
+    platforms = smm_bot.publisher.platforms(post_data)
+    if not platforms:
+        return "⚠️ Ни одна площадка поста не подключена к публикации"
+    lines = []
+    for platform in platforms:
+        result = results.get(platform)
+        if result is None:
+            status = "⏳ Публикуем..."
+        elif result.ok:
+            status = "✅ Опубликовано" + (" ранее" if result.duplicate else "")
+            if result.url:
+                status += f" (<a href=\"{html.escape(result.url)}\">ссылка</a>)"
+        else:
+            status = f"❌ {html.escape(result.error or 'ошибка')}"
+        lines.append(f"{PLATFORM_TITLES.get(platform, platform)}: {status}")
+    return "\n".join(lines)
+
 async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать статистику"""
     query = update.callback_query
     await query.answer()
     
-    stats_text = """
+    metrics = smm_bot.metrics
+    today = metrics.today()
+    mine = metrics.users[update.effective_user.id]
+    cache_stats = smm_bot.cache.stats()
+    
+    platform_lines = "\n".join(
+        f"{PLATFORM_TITLES[platform]}: {int(today[f'published:{platform}'])} постов" for platform in PLATFORMS
+    )
+    
+    ai_requests = metrics.total("smm_openai_requests_total")
+    ai_errors = ai_requests - metrics.total("smm_openai_requests_total", outcome="ok")
+    ai_latency = metrics.merged_histogram("smm_openai_request_seconds", kind="chat")
+    tg_latency = metrics.merged_histogram("smm_telegram_request_seconds")
+    
+    stats_text = f"""
 📊 <b>СТАТИСТИКА РАБОТЫ БОТА</b>
 
 <b>За сегодня:</b>
-✅ Создано постов: 5
-🚀 Опубликовано: 5
-💬 Автоответов: 23
+✅ Создано постов: {int(today['posts_generated'])}
+🚀 Опубликовано: {int(today['posts_published'])}
 
-<b>По платформам:</b>
-🎵 TikTok: 5 постов
-✈️ Telegram: 5 постов
-📸 Instagram: 5 постов
-🌐 VK: 5 постов
+<b>Публикации по платформам (сегодня):</b>
+{platform_lines}
 
-<b>Охват:</b>
-👁 Просмотры: ~12,500
-❤️ Реакции: 847
-💬 Комментарии: 156
+<b>Ваши посты за всё время:</b>
+✅ Создано: {int(mine['posts_generated'])}
+🚀 Опубликовано: {int(mine['posts_published'])}
 
-<b>Экономия времени:</b>
-⏱ Сэкономлено: ~3.5 часа
-💰 Стоимость работы SMM: $150/мес
+<b>AI:</b>
+🤖 Запросов: {int(ai_requests)}, ошибок: {int(ai_errors)}
+⏱ Тексты p50 / p95: {format_seconds(ai_latency.quantile(0.5))} / {format_seconds(ai_latency.quantile(0.95))}
+🔤 Токенов: {int(metrics.total("smm_openai_tokens_total"))}
 
-━━━━━━━━━━━━━━━━━━━━
+<b>Telegram API:</b>
+📨 Запросов: {int(metrics.total("smm_telegram_requests_total"))}, p95: {format_seconds(tg_latency.quantile(0.95))}
 
-🤖 Автоматизация работает отлично!
+<b>Кэш AI:</b>
+🎯 Попаданий: {cache_stats['hits']} / промахов: {cache_stats['misses']} ({cache_stats['hit_rate']:.0%})
+{format_speculation_stats(metrics) if smm_bot.speculation else ""}
     """
     
     keyboard = [
@@ -600,6 +1797,23 @@ async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     return CHOOSING_NICHE
 
+def format_speculation_stats(metrics: MetricsRegistry) -> str:
+    """Заранее сгенерированные варианты: сколько просьб о новом варианте выполнено сразу и сколько потрачено зря"""
+    hits = metrics.total("smm_speculative_requests_total", outcome="hit")
+    requests = hits + metrics.total("smm_speculative_requests_total", outcome="miss")
+    hit_rate = f"{hits / requests:.0%}" if requests else "—"
+    served = metrics.total("smm_speculative_tokens_total", outcome="served")
+    wasted = metrics.total("smm_speculative_tokens_total", outcome="wasted")
+    return (
+        f"<b>Запасные варианты:</b>\n"
+        f"⚡ Выдано сразу: {int(hits)} из {int(requests)} ({hit_rate})\n"
+        f"🔤 Токенов: пригодилось {int(served)}, впустую {int(wasted)}; "
+        f"фото впустую: {int(metrics.total('smm_speculative_images_total', outcome='wasted'))}"
+    )
+
+def format_seconds(value: Optional[float]) -> str:
+    return "—" if value is None else f"{value:.1f} с"
+
 async def show_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать помощь"""
     query = update.callback_query
@@ -622,6 +1836,9 @@ async def show_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
 ✅ Генерация уникальных текстов (GPT)
 ✅ Подбор качественных фото (DALL-E)
 ✅ Адаптация под каждую платформу
+✅ Перегенерация отдельного текста или фото с пожеланиями
+✅ Пакетная генерация из файла с темами (/batch)
+✅ Отложенная публикация по расписанию (/scheduled)
 ✅ Автоматическая публикация
 ✅ Умные автоответы на комментарии
 ✅ Статистика и аналитика
@@ -666,8 +1883,8 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     user_id = update.effective_user.id
-    if user_id in smm_bot.pending_posts:
-        del smm_bot.pending_posts[user_id]
+    await cancel_generation(context.bot, user_id)
+    smm_bot.drafts.delete(user_id)
     
     keyboard = [
         [InlineKeyboardButton("🚀 Создать пост", callback_data="create_post")],
@@ -682,6 +1899,274 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     return CHOOSING_NICHE
 
+async def auto_reply_comment(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Автоответ на комментарий в группе обсуждения канала"""
+    message = update.message
+    if smm_bot.replies is None or not message or not message.text:
+        return
+    # Комментарий — ответ на автоматически пересланный пост канала
+    post = message.reply_to_message
+    if post is None or not post.is_automatic_forward:
+        return
+    origin = getattr(post, "forward_origin", None)
+    channel_message_id = getattr(origin, "message_id", None) or getattr(post, "forward_from_message_id", None)
+    niche, topic = smm_bot.channel_posts.get(channel_message_id)
+    
+    prompts = smm_bot.prompts.current()
+    if smm_bot.replies.version != prompts.version:
+        # Ключевые слова и шаблоны ниш — из реестра ниш: перечитываем вместе с ним
+        smm_bot.replies.configure(prompts.reply_keywords, prompts.reply_templates, prompts.version)
+    comment = Comment(f"{message.chat_id}:{message.message_id}", message.text, niche, topic)
+    reply = await smm_bot.replies.reply(comment)
+    if reply is None:
+        return
+    smm_bot.metrics.inc("smm_auto_replies_total", source=reply.source, intent=reply.intent or "other")
+    try:
+        await message.reply_text(reply.text)
+    except Exception as e:
+        logger.warning(f"Не удалось ответить на комментарий: {e}")
+
+async def batch_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Как запустить пакетную генерацию (/batch)"""
+    await update.message.reply_text(
+        "📦 <b>ПАКЕТНАЯ ГЕНЕРАЦИЯ</b>\n\n"
+        "Отправьте файл <b>.csv</b> или <b>.txt</b> со списком тем:\n"
+        "• CSV — колонки «ниша, тема» (например: <code>авто, Tesla Model Y для семьи</code>)\n"
+        "• TXT — по теме на строке, можно «ниша; тема»\n\n"
+        f"Ниша по умолчанию — выбранная в последний раз. До {smm_bot.batch_max_rows} тем в файле.\n"
+        "Результат придёт одним архивом: posts.jsonl и фото.",
+        parse_mode='HTML'
+    )
+
+async def handle_batch_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Файл с темами: постановка пакета в фоновую очередь с низким приоритетом"""
+    message = update.message
+    user_id = update.effective_user.id
+    
+    if message.document.file_size and message.document.file_size > BATCH_MAX_FILE_SIZE:
+        await message.reply_text("❌ Файл слишком большой: не больше 1 МБ.")
+        return
+    
+    file = await message.document.get_file()
+    data = bytes(await file.download_as_bytearray())
+    try:
+        rows = parse_batch(data, context.user_data.get('niche', 'автомобили'),
+                           smm_bot.prompts.current().niche_aliases, max_rows=smm_bot.batch_max_rows)
+    except BatchError as e:
+        await message.reply_text(f"❌ {e}. Формат файла — в /batch.")
+        return
+    
+    batch_id = f"batch_{user_id}_{int(datetime.now().timestamp() * 1000)}"
+    smm_bot.batches.create(batch_id, rows)
+    await submit_batch(message, user_id, batch_id, len(rows))
+
+async def resume_batch(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Догенерация строк пакета, которые не получились целиком"""
+    query = update.callback_query
+    await query.answer()
+    
+    user_id = update.effective_user.id
+    batch_id = query.data[len("batch_resume_"):]
+    if not batch_id.startswith(f"batch_{user_id}_"):
+        return
+    
+    await submit_batch(query.message, user_id, batch_id, len(smm_bot.batches.unfinished(batch_id)))
+
+async def submit_batch(message, user_id: int, batch_id: str, total: int):
+    status_msg = await message.reply_text(
+        f"📦 <b>Пакет принят:</b> {total} тем в очереди на генерацию...", parse_mode='HTML'
+    )
+    job = smm_bot.jobs.submit(
+        "batch",
+        user_id,
+        {"chat_id": message.chat_id, "status_message_id": status_msg.message_id, "batch_id": batch_id},
+        # Один пакет не генерируется двумя задачами одновременно
+        job_id=f"batch:{batch_id}",
+        priority=PRIORITY_BATCH
+    )
+    if job.payload['status_message_id'] != status_msg.message_id:
+        await status_msg.edit_text("⏳ Этот пакет уже генерируется, дождитесь результата.")
+
+async def run_batch_job(bot, job: Job):
+    """Генерация пакета: строки идут через общие лимиты AI не больше batch_concurrency одновременно"""
+    payload = job.payload
+    batch_id = payload['batch_id']
+    rows = smm_bot.batches.unfinished(batch_id)
+    summary = smm_bot.batches.summary(batch_id)
+    total = sum(summary.values())
+    progress = {"done": summary.get("done", 0), "partial": 0, "failed": 0}
+    
+    status_msg = await bot.edit_message_text(
+        f"📦 <b>Генерирую пакет...</b> {progress['done']}/{total}",
+        chat_id=payload['chat_id'], message_id=payload['status_message_id'], parse_mode='HTML'
+    )
+    # Прогресс — одно сообщение, которое правится не чаще раза в несколько секунд
+    editor = ThrottledEditor(status_msg, min_interval=max(smm_bot.stream_edit_interval, 3.0))
+    semaphore = asyncio.Semaphore(smm_bot.batch_concurrency)
+    
+    async def generate_row(row: Dict):
+        async with semaphore:
+            status = await generate_batch_row(batch_id, row, job.user_id)
+        progress[status] += 1
+        smm_bot.metrics.inc("smm_batch_rows_total", status=status)
+        editor.update(
+            f"📦 <b>Генерирую пакет...</b> {progress['done'] + progress['partial'] + progress['failed']}/{total}\n\n"
+            f"✅ Готово: {progress['done']}  ⚠️ Частично: {progress['partial']}  ❌ Ошибок: {progress['failed']}"
+        )
+    
+    await asyncio.gather(*[generate_row(row) for row in rows])
+    await editor.flush()
+    
+    # Архив собирается вне цикла событий: картинок может быть много
+    results = smm_bot.batches.rows(batch_id)
+    image_paths = {}
+    if smm_bot.images:
+        for row in results:
+            path = smm_bot.images.path((row['result'] or {}).get('image_hash'))
+            if path:
+                image_paths[row['row']] = path
+    archives = await asyncio.to_thread(build_archives, results, image_paths)
+    
+    summary = smm_bot.batches.summary(batch_id)
+    unfinished = total - summary.get("done", 0)
+    caption = f"📦 Пакет готов: {summary.get('done', 0)} из {total} постов."
+    reply_markup = None
+    if unfinished:
+        caption += f"\n⚠️ Не получилось целиком: {unfinished}. Их можно догенерировать."
+        reply_markup = InlineKeyboardMarkup([
+            [InlineKeyboardButton("🔁 Догенерировать ошибки", callback_data=f"batch_resume_{batch_id}")]
+        ])
+    if len(archives) == 1:
+        await bot.send_document(
+            payload['chat_id'], document=archives[0], filename=f"{batch_id}.zip", caption=caption,
+            reply_markup=reply_markup
+        )
+        return
+    # Больше лимита Bot API на файл: отправляем частями, итог и кнопки — под последней
+    for number, archive in enumerate(archives, 1):
+        last = number == len(archives)
+        await bot.send_document(
+            payload['chat_id'], document=archive, filename=f"{batch_id}_{number}of{len(archives)}.zip",
+            caption=f"{caption}\n📎 Часть {number} из {len(archives)}." if last else f"📎 Часть {number} из {len(archives)}",
+            reply_markup=reply_markup if last else None
+        )
+
+async def generate_batch_row(batch_id: str, row: Dict, user_id: int) -> str:
+    """Генерация одной строки пакета; при повторе генерируется только то, что не получилось раньше"""
+    previous = row['result'] or {}
+    texts = dict(previous.get('platforms') or {})
+    platforms = [p for p in PLATFORMS if not texts.get(p) or texts[p].startswith(TEXT_ERROR_PREFIX)]
+    image = None
+    need_image = not previous.get('image_url') or previous['image_url'] == IMAGE_PLACEHOLDER_URL
+    
+    try:
+        # Готовые части не генерируются: asyncio.sleep(0, значение) сразу возвращает значение
+        with generation_deadline(smm_bot.generation_deadline):
+            generated, image = await asyncio.gather(
+                smm_bot.generate_all_texts(row['topic'], row['niche'], platforms, user_id=user_id)
+                if platforms else asyncio.sleep(0, {}),
+                smm_bot.generate_image([row['topic']], row['niche'], user_id=user_id)
+                if need_image else asyncio.sleep(0, None)
+            )
+    except Exception as e:
+        logger.error(f"Ошибка генерации строки {row['row']} пакета {batch_id}: {e}")
+        smm_bot.batches.save(batch_id, row['row'], "failed", error=str(e)[:300] or type(e).__name__)
+        return "failed"
+    
+    texts.update(generated)
+    result = {
+        "platforms": texts,
+        "image_url": previous.get('image_url'),
+        "image_hash": previous.get('image_hash'),
+        "image_variants": previous.get('image_variants') or {},
+    }
+    if image is not None:
+        result['image_url'], result['image_hash'], result['image_variants'] = image
+    
+    failed_parts = [p for p in PLATFORMS if texts[p].startswith(TEXT_ERROR_PREFIX)]
+    if result['image_url'] == IMAGE_PLACEHOLDER_URL:
+        failed_parts.append("image")
+    status = "partial" if failed_parts else "done"
+    smm_bot.batches.save(batch_id, row['row'], status, result,
+                         error=f"не получилось: {', '.join(failed_parts)}" if failed_parts else None)
+    return status
+
+async def show_jobs(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Статус фоновых задач пользователя (/jobs)"""
+    jobs = smm_bot.jobs.jobs_for(update.effective_user.id, limit=5)
+    
+    if not jobs:
+        await update.message.reply_text("📭 У вас нет задач в работе.")
+        return
+    
+    icons = {"queued": "🕐", "running": "⚙️", "done": "✅", "failed": "❌", "cancelled": "🚫"}
+    names = {"queued": "в очереди", "running": "выполняется", "done": "готово", "failed": "ошибка", "cancelled": "отменено"}
+    
+    lines = ["📋 <b>ВАШИ ЗАДАЧИ</b>\n"]
+    for job in jobs:
+        topic = html.escape(job.payload.get('topic', job.kind))
+        line = f"{icons.get(job.status, '•')} {topic} — {names.get(job.status, job.status)}"
+        position = smm_bot.jobs.position(job)
+        if position:
+            line += f" (позиция {position})"
+        lines.append(line)
+    
+    await update.message.reply_text("\n".join(lines), parse_mode='HTML')
+
+async def startup(application: Application):
+    """Запуск фоновых задач после инициализации бота"""
+    await smm_bot.drafts.start()
+    await smm_bot.jobs.start()
+    await smm_bot.scheduler.start()
+    await smm_bot.metrics.start()
+    await warm_up_connections(application)
+    if smm_bot.metrics_port:
+        smm_bot.metrics_runner = await start_metrics_server(smm_bot.metrics, "0.0.0.0", smm_bot.metrics_port)
+
+async def shutdown(application: Application):
+    """Освобождение ресурсов при остановке бота"""
+    await smm_bot.jobs.stop()
+    await smm_bot.scheduler.stop()
+    await smm_bot.publisher.close()
+    await client.close()
+    await smm_bot.drafts.close()
+    if smm_bot.images:
+        await smm_bot.images.close()
+    if smm_bot.derivatives:
+        await smm_bot.derivatives.close()
+    if smm_bot.topics is not None:
+        smm_bot.topics.close()
+    if smm_bot.replies is not None:
+        await smm_bot.replies.close()
+    smm_bot.batches.close()
+    smm_bot.scheduler.close()
+    if smm_bot.metrics_runner is not None:
+        await smm_bot.metrics_runner.cleanup()
+    await smm_bot.metrics.close()
+
+async def warm_up_connections(application: Application):
+    """Заранее открыть соединения к OpenAI и Bot API, чтобы первые запросы не ждали TCP- и TLS-рукопожатий"""
+    request = application.bot.request
+    warm_ups = []
+    if smm_bot.openai_pool is not None:
+        # Ответ на HEAD к корню API не важен: нужно только соединение
+        warm_ups.append(warm_up(
+            "OpenAI", lambda: smm_bot.openai_http.head(str(client.base_url)), smm_bot.openai_pool.config.warmup
+        ))
+    if isinstance(request, InstrumentedRequest):
+        warm_ups.append(request.warm_up(application.bot.base_url))
+    if not warm_ups:
+        return
+    
+    started = time.perf_counter()
+    await asyncio.gather(*warm_ups)
+    openai_stats = smm_bot.openai_pool.stats() if smm_bot.openai_pool is not None else None
+    telegram_stats = request.pool_stats() if isinstance(request, InstrumentedRequest) else None
+    logger.info(
+        f"Соединения прогреты за {time.perf_counter() - started:.2f} с: "
+        f"OpenAI — {describe(openai_stats)}; Telegram — {describe(telegram_stats)}"
+    )
+
 def main():
     """Запуск бота"""
     
@@ -702,47 +2187,466 @@ def main():
         print("Для работы AI нужна регистрация на platform.openai.com и активный ключ.")
         return
     
-    # Создаём приложение
-    application = Application.builder().token(TOKEN).build()
+    # Отдельный процесс-воркер фоновых задач: python telegram_smm_bot.py worker
+    worker_mode = len(sys.argv) > 1 and sys.argv[1] == "worker"
+    
+    # Пулы соединений к OpenAI (SMM_OPENAI_*) и Bot API (SMM_TELEGRAM_*), суффиксы переменных:
+    # MAX_CONNECTIONS — предел соединений, MAX_KEEPALIVE и KEEPALIVE_EXPIRY — сколько простаивающих
+    # соединений и сколько секунд держать открытыми, HTTP2 (0 — только HTTP/1.1, для HTTP/2 нужен пакет h2),
+    # CONNECT_TIMEOUT, READ_TIMEOUT, WRITE_TIMEOUT, POOL_TIMEOUT — таймауты в секундах,
+    # WARMUP — сколько соединений открыть при запуске.
+    # К Bot API по умолчанию HTTP/1.1: локальный сервер Bot API и прокси HTTP/2 не понимают,
+    # SMM_TELEGRAM_HTTP2=1 включает его только для https://api.telegram.org
+    configure_openai_client(PooledTransport(TransportConfig.from_env(
+        "SMM_OPENAI", max_connections=64, max_keepalive=32, keepalive_expiry=60.0, read_timeout=60.0
+    )))
+    telegram_transport = TransportConfig.from_env(
+        "SMM_TELEGRAM", max_connections=256, max_keepalive=32, keepalive_expiry=60.0,
+        read_timeout=10.0, write_timeout=20.0, pool_timeout=3.0, http2=False
+    )
+    
+    # Метрики: SMM_METRICS_DB — куда раз в SMM_METRICS_FLUSH_INTERVAL секунд сохранять агрегаты,
+    # SMM_METRICS_PORT — порт /metrics (в режиме вебхука /metrics отдаёт сервер вебхука)
+    smm_bot.metrics = MetricsRegistry(
+        db_path=os.getenv("SMM_METRICS_DB"),
+        flush_interval=float(os.getenv("SMM_METRICS_FLUSH_INTERVAL", "30"))
+    )
+    if os.getenv("SMM_METRICS_PORT"):
+        smm_bot.metrics_port = int(os.getenv("SMM_METRICS_PORT"))
+    
+    # Фоновые задачи генерации: SMM_JOB_WORKERS — сколько постов генерируется одновременно,
+    # SMM_JOBS_DB — файл очереди (общий для бота и процессов-воркеров, задачи переживают перезапуск;
+    # по умолчанию smm_jobs.db рядом с ботом)
+    job_workers = int(os.getenv("SMM_JOB_WORKERS", "4"))
+    smm_bot.jobs = BackgroundJobQueue(
+        db_path=os.getenv("SMM_JOBS_DB", os.path.join(BOT_DIR, "smm_jobs.db")),
+        workers=job_workers,
+        worker_name=os.getenv("SMM_WORKER_NAME", "worker" if worker_mode else "bot")
+    )
+    
+    # Пакетная генерация текстов (SMM_BATCH_GENERATION=0 — отдельный запрос на каждую платформу)
+    smm_bot.batch_generation = os.getenv("SMM_BATCH_GENERATION", "1") != "0"
+    
+    # Потоковая генерация превью (SMM_STREAMING=1), правки не чаще раза в SMM_STREAM_EDIT_INTERVAL секунд
+    smm_bot.streaming = os.getenv("SMM_STREAMING", "0") == "1"
+    smm_bot.stream_edit_interval = float(os.getenv("SMM_STREAM_EDIT_INTERVAL", "1.0"))
+    
+    # Запасные варианты текстов и фото, пока пользователь читает превью (SMM_SPECULATION=1):
+    # SMM_SPECULATION_HEADROOM — какая доля лимитов AI должна быть свободна, чтобы их генерировать,
+    # SMM_SPECULATION_CONCURRENCY — сколько таких задач может выполняться одновременно
+    smm_bot.speculation = os.getenv("SMM_SPECULATION", "0") == "1"
+    smm_bot.speculation_headroom = float(os.getenv("SMM_SPECULATION_HEADROOM", "0.5"))
+    smm_bot.speculation_concurrency = int(os.getenv("SMM_SPECULATION_CONCURRENCY", "1"))
+    
+    # Кэш ответов AI (SMM_CACHE_DB — путь к SQLite, чтобы кэш переживал перезапуск)
+    smm_bot.cache = ResponseCache(
+        max_size=int(os.getenv("SMM_CACHE_SIZE", "1000")),
+        ttl=float(os.getenv("SMM_CACHE_TTL", str(24 * 3600))),
+        db_path=os.getenv("SMM_CACHE_DB")
+    )
+    
+    # Хранилище черновиков (SMM_DRAFTS_DB — путь к SQLite, чтобы черновики переживали перезапуск)
+    drafts_max = int(os.getenv("SMM_DRAFTS_MAX", "1000"))
+    drafts_ttl = float(os.getenv("SMM_DRAFTS_TTL", str(24 * 3600)))
+    drafts_db = os.getenv("SMM_DRAFTS_DB")
+    if drafts_db:
+        if worker_mode or job_workers == 0:
+            # Бот и воркер в разных процессах правят одни черновики: читаем их всегда из общей базы,
+            # а не из памяти, где может лежать устаревшая копия
+            drafts_max = 0
+        smm_bot.drafts = SQLiteDraftStore(
+            drafts_db,
+            max_size=drafts_max,
+            ttl=drafts_ttl,
+            flush_interval=float(os.getenv("SMM_DRAFTS_FLUSH_INTERVAL", "2.0"))
+        )
+    else:
+        smm_bot.drafts = MemoryDraftStore(max_size=drafts_max, ttl=drafts_ttl)
+    
+    # Лимиты OpenAI: RPM/TPM для текста, RPM для картинок, общий предел одновременных запросов и очереди
+    max_in_flight = int(os.getenv("SMM_AI_MAX_IN_FLIGHT", "16"))
+    max_queue = int(os.getenv("SMM_AI_MAX_QUEUE", "500"))
+    smm_bot.text_limiter = AdmissionController(
+        "text",
+        rpm=float(os.getenv("SMM_TEXT_RPM", "3500")),
+        tpm=float(os.getenv("SMM_TEXT_TPM", "90000")),
+        max_in_flight=max_in_flight,
+        max_queue=max_queue
+    )
+    smm_bot.image_limiter = AdmissionController(
+        "image",
+        rpm=float(os.getenv("SMM_IMAGE_RPM", "50")),
+        max_in_flight=max_in_flight,
+        max_queue=max_queue
+    )
+    
+    # Таймауты (SMM_AI_TIMEOUT, SMM_IMAGE_TIMEOUT), число попыток и общий дедлайн генерации поста
+    attempts = int(os.getenv("SMM_AI_ATTEMPTS", "3"))
+    smm_bot.text_retry = RetryPolicy(attempts=attempts, timeout=float(os.getenv("SMM_AI_TIMEOUT", "30")))
+    smm_bot.image_retry = RetryPolicy(attempts=attempts, timeout=float(os.getenv("SMM_IMAGE_TIMEOUT", "60")))
+    smm_bot.generation_deadline = float(os.getenv("SMM_GENERATION_DEADLINE", "90"))
+    smm_bot.hedging = os.getenv("SMM_HEDGE", "1") != "0"
+    smm_bot.hedge_percentile = float(os.getenv("SMM_HEDGE_PERCENTILE", "0.95"))
+    
+    # Ниши и промпты: SMM_PROMPTS_FILE — JSON-реестр (по умолчанию prompts.json рядом с ботом),
+    # изменения подхватываются без перезапуска, файл проверяется раз в SMM_PROMPTS_CHECK_INTERVAL секунд
+    smm_bot.prompts = PromptRegistry(
+        os.getenv("SMM_PROMPTS_FILE", DEFAULT_PROMPTS_FILE),
+        check_interval=float(os.getenv("SMM_PROMPTS_CHECK_INTERVAL", "5"))
+    )
+    
+    # Маршрутизация моделей: SMM_MODEL_ROUTES — JSON-файл с моделью, запасными моделями и бюджетом
+    # токенов по ключам "default", "<платформа>" и "<ниша>/<платформа>" (формат — DEFAULT_ROUTES в smm_routing).
+    # Модель деградировала, если за SMM_MODEL_HEALTH_WINDOW секунд доля ошибок выше SMM_MODEL_MAX_ERROR_RATE
+    # или p95 длительности ответов того же бюджета токенов выше SMM_MODEL_LATENCY_SLO секунд — тогда запросы
+    # идут в запасную. SLO задан для ответов до SMM_MODEL_SLO_TOKENS токенов, для больших растёт пропорционально
+    routes_file = os.getenv("SMM_MODEL_ROUTES")
+    smm_bot.router = ModelRouter(
+        ModelRouter.load(routes_file) if routes_file else None,
+        latency_slo=float(os.getenv("SMM_MODEL_LATENCY_SLO", "20")),
+        max_error_rate=float(os.getenv("SMM_MODEL_MAX_ERROR_RATE", "0.2")),
+        window=float(os.getenv("SMM_MODEL_HEALTH_WINDOW", "300")),
+        slo_tokens=int(os.getenv("SMM_MODEL_SLO_TOKENS", "600"))
+    )
+    
+    # Локальное хранилище сгенерированных картинок
+    smm_bot.images = ImageStore(os.getenv("SMM_IMAGE_DIR", "images"))
+    
+    # Варианты картинки под платформы (нужен Pillow; SMM_IMAGE_DERIVATIVES=0 — выключить).
+    # SMM_IMAGE_WORKERS — размер пула обработки, SMM_IMAGE_PROCESSES=1 — пул процессов вместо потоков
+    if os.getenv("SMM_IMAGE_DERIVATIVES", "1") != "0":
+        if pillow_available():
+            image_workers = int(os.getenv("SMM_IMAGE_WORKERS", "2"))
+            executor = None
+            if os.getenv("SMM_IMAGE_PROCESSES", "0") == "1":
+                executor = ProcessPoolExecutor(max_workers=image_workers)
+            smm_bot.derivatives = ImageDerivatives(smm_bot.images, executor=executor, workers=image_workers)
+        else:
+            logger.warning("Pillow не установлен: варианты картинок под платформы не создаются")
+    
+    # Лимиты исходящих сообщений Telegram: SMM_TG_GLOBAL_RATE — в секунду на бота,
+    # SMM_TG_CHAT_RATE и SMM_TG_GROUP_RATE — в минуту на личный чат и на группу/канал
+    # (SMM_TG_RATE_LIMIT=0 — отправлять без планировщика)
+    rate_limiter = None
+    if os.getenv("SMM_TG_RATE_LIMIT", "1") != "0":
+        rate_limiter = OutboundScheduler(
+            global_rate=float(os.getenv("SMM_TG_GLOBAL_RATE", "30")),
+            private_rate=float(os.getenv("SMM_TG_CHAT_RATE", "60")),
+            group_rate=float(os.getenv("SMM_TG_GROUP_RATE", "20")),
+            metrics=smm_bot.metrics
+        )
+    
+    # Похожие темы (нужен NumPy; SMM_TOPIC_INDEX=0 — выключить): SMM_TOPIC_INDEX_DIR — где хранить индекс
+    # (по умолчанию topic_index рядом с ботом),
+    # SMM_SIMILAR_THRESHOLD — с какой косинусной близости тема считается похожей.
+    # Индекс пишет только процесс бота, воркер в отдельном процессе его не открывает
+    smm_bot.similar_threshold = float(os.getenv("SMM_SIMILAR_THRESHOLD", "0.9"))
+    if os.getenv("SMM_TOPIC_INDEX", "1") != "0" and not worker_mode:
+        if numpy_available():
+            smm_bot.topics = TopicIndex(
+                os.getenv("SMM_TOPIC_INDEX_DIR", os.path.join(BOT_DIR, "topic_index")), dim=EMBEDDING_DIM
+            )
+        else:
+            logger.warning("NumPy не установлен: похожие темы не ищутся")
+    
+    # Пакетная генерация из файла (/batch): SMM_BATCH_DB — строки пакетов (общий файл для бота и воркеров,
+    # чтобы прерванный пакет можно было догенерировать; по умолчанию smm_batch.db рядом с ботом),
+    # SMM_BATCH_CONCURRENCY — строк одновременно, SMM_BATCH_MAX_ROWS — тем в одном файле
+    smm_bot.batches = BatchStore(os.getenv("SMM_BATCH_DB", os.path.join(BOT_DIR, "smm_batch.db")))
+    smm_bot.batch_concurrency = int(os.getenv("SMM_BATCH_CONCURRENCY", "4"))
+    smm_bot.batch_max_rows = int(os.getenv("SMM_BATCH_MAX_ROWS", "200"))
+    
+    # Отложенные публикации: SMM_SCHEDULE_DB — календарь (переживает перезапуск; общий файл для бота и воркеров,
+    # публикация всё равно уйдёт один раз; по умолчанию smm_schedule.db рядом с ботом),
+    # SMM_SCHEDULE_CONCURRENCY — публикаций одновременно,
+    # SMM_TIMEZONE — часовой пояс, в котором пользователи выбирают время
+    smm_bot.scheduler = PublicationScheduler(
+        os.getenv("SMM_SCHEDULE_DB", os.path.join(BOT_DIR, "smm_schedule.db")),
+        concurrency=int(os.getenv("SMM_SCHEDULE_CONCURRENCY", "4")),
+        worker_name=os.getenv("SMM_WORKER_NAME", "worker" if worker_mode else "bot")
+    )
+    smm_bot.timezone = ZoneInfo(os.getenv("SMM_TIMEZONE", "Europe/Moscow"))
+    
+    # Автоответы на комментарии в группе обсуждения канала (SMM_AUTO_REPLY=0 — выключить):
+    # типовые вопросы — по шаблонам, остальные — GPT пачками по SMM_AUTO_REPLY_BATCH комментариев
+    # не реже раза в SMM_AUTO_REPLY_DELAY секунд (SMM_AUTO_REPLY_AI=0 — только шаблоны)
+    if os.getenv("SMM_AUTO_REPLY", "1") != "0":
+        smm_bot.replies = AutoReplyEngine(
+            responder=smm_bot.answer_comments if os.getenv("SMM_AUTO_REPLY_AI", "1") != "0" else None,
+            batch_size=int(os.getenv("SMM_AUTO_REPLY_BATCH", "20")),
+            max_delay=float(os.getenv("SMM_AUTO_REPLY_DELAY", "2.0"))
+        )
+    
+    # Создаём приложение (апдейты разных чатов обрабатываются параллельно)
+    application = build_application(
+        TOKEN,
+        concurrent_updates=int(os.getenv("SMM_CONCURRENT_UPDATES", "64")),
+        persistence_file=os.getenv("SMM_PERSISTENCE_FILE"),
+        rate_limiter=rate_limiter,
+        transport=telegram_transport
+    )
+    
+    # Подключаем платформы для публикации (SMM_PUBLISH_DB — журнал публикаций против повторов, общий для бота
+    # и воркеров; по умолчанию smm_publish.db рядом с ботом)
+    # SMM_PUBLIC_IMAGE_URL — публичный адрес, по которому доступны файлы хранилища картинок
+    # (в режиме вебхука бот сам отдаёт их по {SMM_WEBHOOK_URL}/images); по нему Instagram и TikTok
+    # скачивают фото поста вместо временной ссылки DALL-E
+    smm_bot.public_image_url = os.getenv("SMM_PUBLIC_IMAGE_URL")
+    if not smm_bot.public_image_url and os.getenv("SMM_WEBHOOK_URL"):
+        smm_bot.public_image_url = f"{os.getenv('SMM_WEBHOOK_URL').rstrip('/')}/images"
+    smm_bot.publisher = Publisher(
+        db_path=os.getenv("SMM_PUBLISH_DB", os.path.join(BOT_DIR, "smm_publish.db")),
+        timeout=float(os.getenv("SMM_PUBLISH_TIMEOUT", "60")),
+        image_resolver=public_image_url
+    )
+    setup_publisher(smm_bot.publisher, application)
+    
+    # Текущие длины очередей снимаются при каждом запросе /metrics
+    smm_bot.metrics.gauge("smm_ai_queue_depth_text", lambda: smm_bot.text_limiter.queue_depth)
+    smm_bot.metrics.gauge("smm_ai_queue_depth_image", lambda: smm_bot.image_limiter.queue_depth)
+    smm_bot.metrics.gauge("smm_jobs_queued", lambda: smm_bot.jobs.stats().get("queued", 0))
+    smm_bot.metrics.gauge("smm_drafts_in_memory", lambda: len(smm_bot.drafts))
+    smm_bot.metrics.gauge("smm_scheduled_pending", lambda: len(smm_bot.scheduler))
+    # Пулы соединений: открыто, простаивает, запросов в работе, доля занятых соединений от предела
+    pools = {"openai": smm_bot.openai_pool.stats, "telegram": application.bot.request.pool_stats}
+    for pool_name, read_stats in pools.items():
+        for stat in ("connections", "idle", "in_flight", "utilization"):
+            smm_bot.metrics.gauge(f"smm_{pool_name}_pool_{stat}", lambda read=read_stats, stat=stat: read()[stat])
+    if rate_limiter is not None:
+        smm_bot.metrics.gauge("smm_telegram_send_queue", lambda: rate_limiter.queue_depth)
+    
+    if worker_mode:
+        print("⚙️ Воркер фоновых задач запущен!")
+        asyncio.run(run_worker(application))
+        return
+    
+    # Запускаем бота
+    print("🤖 Бот запущен!")
+    print("Найди его в Telegram и напиши /start")
+    
+    # Режим вебхука включается, если задан публичный адрес SMM_WEBHOOK_URL
+    webhook_url = os.getenv("SMM_WEBHOOK_URL")
+    if webhook_url:
+        asyncio.run(serve_webhook(
+            application,
+            webhook_url,
+            host=os.getenv("SMM_WEBHOOK_HOST", "0.0.0.0"),
+            port=int(os.getenv("PORT", "8080")),
+            path=os.getenv("SMM_WEBHOOK_PATH", "webhook"),
+            secret_token=os.getenv("SMM_WEBHOOK_SECRET"),
+            metrics=None if smm_bot.metrics_port else smm_bot.metrics,
+            images=smm_bot.images
+        ))
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
+
+async def run_worker(application: Application):
+    """Процесс-воркер: только выполняет задачи из общей очереди, апдейты не получает"""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+    
+    async with application:
+        await startup(application)
+        try:
+            await stop_event.wait()
+        finally:
+            await shutdown(application)
+
+def setup_publisher(publisher: Publisher, application: Application):
+    """Подключение адаптеров платформ, для которых заданы ключи доступа"""
+    if os.getenv("SMM_TELEGRAM_CHANNEL_ID"):
+        publisher.add_adapter(TelegramChannelAdapter(
+            application.bot, os.getenv("SMM_TELEGRAM_CHANNEL_ID"), images=smm_bot.images
+        ))
+    if os.getenv("SMM_VK_TOKEN") and os.getenv("SMM_VK_GROUP_ID"):
+        publisher.add_adapter(VKAdapter(
+            os.getenv("SMM_VK_TOKEN"), os.getenv("SMM_VK_GROUP_ID"), publisher.session,
+            base_url=os.getenv("SMM_VK_API_URL", "https://api.vk.com/method")
+        ))
+    if os.getenv("SMM_INSTAGRAM_TOKEN") and os.getenv("SMM_INSTAGRAM_USER_ID"):
+        publisher.add_adapter(InstagramAdapter(
+            os.getenv("SMM_INSTAGRAM_TOKEN"), os.getenv("SMM_INSTAGRAM_USER_ID"), publisher.session,
+            base_url=os.getenv("SMM_INSTAGRAM_API_URL", "https://graph.facebook.com/v19.0")
+        ))
+    if os.getenv("SMM_TIKTOK_TOKEN"):
+        publisher.add_adapter(TikTokAdapter(
+            os.getenv("SMM_TIKTOK_TOKEN"), publisher.session,
+            base_url=os.getenv("SMM_TIKTOK_API_URL", "https://open.tiktokapis.com/v2")
+        ))
+    
+    if not publisher.adapters:
+        logger.warning("Ни одна платформа для публикации не подключена")
+    elif not smm_bot.public_image_url and {"instagram", "tiktok"} & set(publisher.adapters):
+        logger.warning("Не задан SMM_PUBLIC_IMAGE_URL: Instagram и TikTok не получат фото поста")
+
+def public_image_url(post_data: Dict, platform: str) -> Optional[str]:
+    """Постоянная публичная ссылка на фото поста (вариант под платформу, если есть) или None.
+
+    Картинка берётся из хранилища по хэшу в момент публикации, поэтому истёкшая ссылка DALL-E
+    не мешает; заглушка вместо несгенерированного фото не публикуется.
+    """
+    if not smm_bot.public_image_url or not smm_bot.images:
+        return None
+    if post_data.get('image_url') == IMAGE_PLACEHOLDER_URL:
+        return None
+    for digest in ((post_data.get('image_variants') or {}).get(platform), post_data.get('image_hash')):
+        relative = smm_bot.images.relative_path(digest)
+        if relative:
+            return f"{smm_bot.public_image_url.rstrip('/')}/{relative}"
+    return None
+
+def tracked(callback):
+    """Обработчик диалога с метриками: длительность и состояние, в которое он перевёл диалог"""
+    
+    @functools.wraps(callback)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        state = "error"
+        started = time.perf_counter()
+        try:
+            result = await callback(update, context)
+            state = STATE_NAMES.get(result, str(result))
+            return result
+        finally:
+            smm_bot.metrics.observe("smm_handler_seconds", time.perf_counter() - started, handler=callback.__name__)
+            smm_bot.metrics.inc("smm_transitions_total", handler=callback.__name__, state=state)
+    
+    return wrapper
+
+def deduplicated(callback, once: bool = False):
+    """Обработчик кнопки, который не выполняется повторно при повторном нажатии.
+
+    Пока действие выполняется, нажатия той же кнопки под тем же сообщением игнорируются;
+    с once=True кнопка остаётся «нажатой» и после выполнения (публикация, отмена) — пока
+    в это сообщение не выведут новое превью (send_preview).
+    """
+    
+    @functools.wraps(callback)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        if query is None:
+            return await callback(update, context)
+        
+        message = (query.message.chat_id, query.message.message_id) if query.message else None
+        key = (message, update.effective_user.id, query.data)
+        if not smm_bot.actions.begin(key):
+            smm_bot.metrics.inc("smm_duplicate_actions_total", handler=callback.__name__)
+            await query.answer("⏳ Уже выполняется")
+            return None
+        
+        completed = False
+        try:
+            result = await callback(update, context)
+            completed = True
+            return result
+        finally:
+            smm_bot.actions.end(key, remember=once and completed)
+    
+    return wrapper
+
+def build_application(token: str, base_url: Optional[str] = None, concurrent_updates: int = 1,
+                      persistence_file: Optional[str] = None,
+                      rate_limiter: Optional[OutboundScheduler] = None,
+                      transport: Optional[TransportConfig] = None) -> Application:
+    """Создание приложения со всеми обработчиками диалога"""
+    builder = Application.builder().token(token).post_init(startup).post_shutdown(shutdown)
+    if transport is not None and transport.http2 and base_url and not base_url.startswith(TELEGRAM_API_URL):
+        logger.warning(f"HTTP/2 к Bot API включается только для {TELEGRAM_API_URL}, к {base_url} — HTTP/1.1")
+        transport.http2 = False
+    # Запросы бота к Bot API идут через транспорт с метриками и настроенным пулом соединений
+    builder = builder.request(InstrumentedRequest(smm_bot.metrics, transport))
+    if base_url:
+        builder = builder.base_url(base_url)
+    if rate_limiter is not None:
+        # Исходящие сообщения идут через планировщик с лимитами Telegram и приоритетами
+        builder = builder.rate_limiter(rate_limiter)
+    if persistence_file:
+        # Состояния диалогов переживают перезапуск вместе с черновиками и очередью задач
+        builder = builder.persistence(PicklePersistence(filepath=persistence_file))
+    if concurrent_updates > 1:
+        builder = builder.concurrent_updates(PerChatUpdateProcessor(concurrent_updates))
+    application = builder.build()
     
     # ConversationHandler для управления диалогом
     conv_handler = ConversationHandler(
-        entry_points=[CommandHandler("start", start)],
+        entry_points=[CommandHandler("start", tracked(start))],
         states={
             CHOOSING_NICHE: [
-                CallbackQueryHandler(choose_niche, pattern="^create_post$"),
-                CallbackQueryHandler(show_stats, pattern="^stats$"),
-                CallbackQueryHandler(show_help, pattern="^help$"),
-                CallbackQueryHandler(start, pattern="^back_to_start$"),
+                CallbackQueryHandler(tracked(choose_niche), pattern="^create_post$"),
+                CallbackQueryHandler(tracked(show_stats), pattern="^stats$"),
+                CallbackQueryHandler(tracked(show_help), pattern="^help$"),
+                CallbackQueryHandler(tracked(start), pattern="^back_to_start$"),
             ],
             ENTERING_TOPIC: [
-                CallbackQueryHandler(handle_niche_selection, pattern="^niche_"),
-                CallbackQueryHandler(choose_niche, pattern="^create_post$"),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_topic_input),
+                CallbackQueryHandler(tracked(handle_niche_selection), pattern="^niche_"),
+                CallbackQueryHandler(tracked(choose_niche), pattern="^create_post$"),
+                CallbackQueryHandler(tracked(deduplicated(reuse_similar_post, once=True)), pattern="^reuse_"),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, tracked(handle_topic_input)),
             ],
             REVIEWING: [
-                CallbackQueryHandler(approve_and_publish, pattern="^approve$"),
-                CallbackQueryHandler(edit_post, pattern="^edit$"),
-                CallbackQueryHandler(show_image, pattern="^show_image$"),
-                CallbackQueryHandler(back_to_review, pattern="^back_to_review$"),
-                CallbackQueryHandler(cancel, pattern="^cancel$"),
+                CallbackQueryHandler(tracked(deduplicated(approve_and_publish, once=True)), pattern="^approve$"),
+                CallbackQueryHandler(tracked(choose_publish_time), pattern="^schedule$"),
+                CallbackQueryHandler(tracked(edit_post), pattern="^edit$"),
+                CallbackQueryHandler(tracked(deduplicated(regenerate_post, once=True)), pattern="^regenerate$"),
+                CallbackQueryHandler(tracked(choose_regeneration), pattern="^partial$"),
+                CallbackQueryHandler(tracked(deduplicated(show_image)), pattern="^show_image$"),
+                CallbackQueryHandler(tracked(back_to_review), pattern="^back_to_review$"),
+                CallbackQueryHandler(tracked(deduplicated(cancel, once=True)), pattern="^cancel$"),
             ],
             EDITING: [
-                CallbackQueryHandler(select_platform_to_edit, pattern="^edit_"),
-                CallbackQueryHandler(edit_post, pattern="^edit$"),
-                CallbackQueryHandler(back_to_review, pattern="^back_to_review$"),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, save_edited_text),
+                CallbackQueryHandler(tracked(select_platform_to_edit), pattern="^edit_"),
+                CallbackQueryHandler(tracked(edit_post), pattern="^edit$"),
+                CallbackQueryHandler(tracked(back_to_review), pattern="^back_to_review$"),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, tracked(save_edited_text)),
+            ],
+            SCHEDULING: [
+                CallbackQueryHandler(tracked(deduplicated(schedule_publication, once=True)), pattern="^schedule_at_"),
+                CallbackQueryHandler(tracked(back_to_review), pattern="^back_to_review$"),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, tracked(schedule_publication)),
+            ],
+            REGENERATING: [
+                CallbackQueryHandler(tracked(deduplicated(regenerate_part, once=True)), pattern="^regen_now$"),
+                CallbackQueryHandler(tracked(select_regeneration_target), pattern="^regen_"),
+                CallbackQueryHandler(tracked(choose_regeneration), pattern="^partial$"),
+                CallbackQueryHandler(tracked(back_to_review), pattern="^back_to_review$"),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, tracked(regenerate_part)),
             ],
         },
-        fallbacks=[CommandHandler("start", start)],
+        fallbacks=[CommandHandler("start", tracked(start))],
+        name="smm_conversation",
+        persistent=bool(persistence_file),
     )
     
     application.add_handler(conv_handler)
-    
-    # Запускаем бота
-    print("🤖 Бот запущен!")
-    print("Найди его в Telegram и напиши /start")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    application.add_handler(CommandHandler("jobs", show_jobs))
+    application.add_handler(CommandHandler("batch", batch_help))
+    application.add_handler(CommandHandler("scheduled", show_scheduled))
+    application.add_handler(CallbackQueryHandler(
+        deduplicated(unschedule_publication, once=True), pattern="^unschedule_"
+    ))
+    application.add_handler(MessageHandler(
+        filters.ChatType.PRIVATE & (filters.Document.FileExtension("csv") | filters.Document.FileExtension("txt")),
+        handle_batch_file
+    ))
+    application.add_handler(CallbackQueryHandler(
+        deduplicated(resume_batch, once=True), pattern="^batch_resume_"
+    ))
+    application.add_handler(MessageHandler(
+        filters.ChatType.GROUPS & filters.REPLY & filters.TEXT & ~filters.COMMAND, auto_reply_comment
+    ))
+    
+    # Готовые превью воркер отправляет через бота этого приложения
+    smm_bot.jobs.register("generate", lambda job: run_generation_job(application.bot, job))
+    smm_bot.jobs.register("regenerate_part", lambda job: run_partial_job(application.bot, job))
+    smm_bot.jobs.register("batch", lambda job: run_batch_job(application.bot, job))
+    smm_bot.jobs.register("speculate", run_speculation_job)
+    smm_bot.scheduler.register(lambda item: publish_scheduled(application.bot, item))
+    
+    return application
 
 if __name__ == "__main__":
     main()